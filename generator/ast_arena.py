@@ -0,0 +1,256 @@
+"""
+Columnar arena form of the Marlowe AST
+
+For machine-generated specs with tens of thousands of nodes, one Python
+object per node costs far more than the JSON on disk. A ContractArena keeps
+the whole tree in flat typed arrays instead:
+
+    kinds[i]    node class code (index into NODE_CLASSES)
+    offsets[i]  start of node i's record in `slots`
+    slots       per field: child index / string id / int id,
+                sequence fields (When.cases, Choice.bounds) as count + indices
+
+Strings and integer payloads live in interned tables. Structurally equal
+subtrees are stored once (hash-consed while building), matching the
+semantics of the marlowe_types classes.
+
+ArenaNode is a two-slot view that passes isinstance checks for the node
+class it stands for, so fsm_model.parse_contract_to_infos and the BPMN
+emitter can walk an arena unchanged; views are created on access and
+nothing else is materialized.
+"""
+
+from array import array
+from dataclasses import MISSING, fields
+from typing import Any, Dict, List, Optional, Tuple, get_origin
+
+import marlowe_types
+from marlowe_types import Node
+
+# 欄位編碼方式
+NODE = 0
+NODES = 1
+STR = 2
+INT = 3
+
+NODE_CLASSES: Tuple[type, ...] = tuple(
+    cls for cls in vars(marlowe_types).values()
+    if isinstance(cls, type) and issubclass(cls, Node) and cls is not Node
+)
+_CODES: Dict[type, int] = {cls: code for (code, cls) in enumerate(NODE_CLASSES)}
+_DEFAULTS: Tuple[Dict[str, Any], ...] = tuple(
+    {f.name: f.default for f in fields(cls) if f.default is not MISSING} for cls in NODE_CLASSES
+)
+
+
+def _field_tag(annotation: Any) -> int:
+    if annotation is str:
+        return STR
+    if annotation is int:
+        return INT
+    if get_origin(annotation) is tuple:
+        return NODES
+    return NODE
+
+
+# code -> ((field name, tag), ...)
+SCHEMAS: Tuple[Tuple[Tuple[str, int], ...], ...] = tuple(
+    tuple((f.name, _field_tag(f.type)) for f in fields(cls)) for cls in NODE_CLASSES
+)
+
+
+class ContractArena:
+    """Flat, typed-array storage for one contract tree"""
+
+    def __init__(self) -> None:
+        self.kinds = array("B")
+        self.offsets = array("I")
+        self.slots = array("I")
+        self.strings: List[str] = []
+        self.ints: List[int] = []
+        self.root: Optional[int] = None
+        self._string_ids: Dict[str, int] = {}
+        self._int_ids: Dict[Tuple[type, int], int] = {}
+        # build 期間的 hash-consing 表 (hash -> node index)；seal() 後釋放
+        self._dedupe: Optional[Dict[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the node arrays (string/int tables excluded)"""
+        return sum(a.itemsize * len(a) for a in (self.kinds, self.offsets, self.slots))
+
+    # --- Building ---
+
+    def add(self, cls: type, **values: Any) -> int:
+        """Appends a node; NODE fields take an arena index or a marlowe_types node"""
+        code = _CODES[cls]
+        record: List[int] = []
+        for (name, tag) in SCHEMAS[code]:
+            value = values[name] if name in values else _DEFAULTS[code][name]
+            if tag == NODE:
+                record.append(self._child(value))
+            elif tag == NODES:
+                record.append(len(value))
+                record.extend(self._child(item) for item in value)
+            elif tag == STR:
+                record.append(self._string_id(value))
+            else:
+                record.append(self._int_id(value))
+        return self._append(code, record)
+
+    def encode(self, node: Node) -> int:
+        """Copies a marlowe_types subtree into the arena"""
+        values = {f.name: getattr(node, f.name) for f in fields(node)}
+        return self.add(node.__class__, **values)
+
+    def seal(self, root: int) -> "ContractArena":
+        """Marks the root and drops build-time tables"""
+        self.root = root
+        self._dedupe = None
+        self._string_ids = {}
+        self._int_ids = {}
+        return self
+
+    def _child(self, value: Any) -> int:
+        return value if isinstance(value, int) else self.encode(value)
+
+    def _string_id(self, value: str) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def _int_id(self, value: int) -> int:
+        # bool 與 int 分開存，還原時型別不變 (Constant(True) vs Constant(1))
+        key = (value.__class__, value)
+        int_id = self._int_ids.get(key)
+        if int_id is None:
+            int_id = self._int_ids[key] = len(self.ints)
+            self.ints.append(value)
+        return int_id
+
+    def _append(self, code: int, record: List[int]) -> int:
+        existing = None
+        if self._dedupe is not None:
+            digest = hash((code, *record))
+            existing = self._dedupe.get(digest)
+            if existing is not None and self.kinds[existing] == code and self._record(existing) == record:
+                return existing
+        index = len(self.kinds)
+        self.kinds.append(code)
+        self.offsets.append(len(self.slots))
+        self.slots.extend(record)
+        if self._dedupe is not None and existing is None:
+            self._dedupe[digest] = index
+        return index
+
+    def _record(self, index: int) -> List[int]:
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else len(self.slots)
+        return self.slots[self.offsets[index]:end].tolist()
+
+    # --- Reading ---
+
+    def node_class(self, index: int) -> type:
+        return NODE_CLASSES[self.kinds[index]]
+
+    def field(self, index: int, name: str) -> Any:
+        """Decodes one field of node `index` (child nodes come back as ArenaNode views)"""
+        pos = self.offsets[index]
+        for (field_name, tag) in SCHEMAS[self.kinds[index]]:
+            if tag == NODES:
+                count = self.slots[pos]
+                if field_name == name:
+                    return tuple(ArenaNode(self, child) for child in self.slots[pos + 1:pos + 1 + count])
+                pos += 1 + count
+                continue
+            if field_name == name:
+                slot = self.slots[pos]
+                if tag == NODE:
+                    return ArenaNode(self, slot)
+                return self.strings[slot] if tag == STR else self.ints[slot]
+            pos += 1
+        raise AttributeError(f"{self.node_class(index).__name__} has no field {name!r}")
+
+    def view(self, index: Optional[int] = None) -> "ArenaNode":
+        """View of node `index` (default: root)"""
+        return ArenaNode(self, self.root if index is None else index)
+
+    def materialize(self, index: Optional[int] = None) -> Node:
+        """Rebuilds the marlowe_types tree below `index` (small subtrees / debugging)"""
+        built: Dict[int, Node] = {}
+        stack = [self.root if index is None else index]
+        while stack:
+            current = stack[-1]
+            if current in built:
+                stack.pop()
+                continue
+            children = [c for c in self._children(current) if c not in built]
+            if children:
+                stack.extend(children)
+                continue
+            stack.pop()
+            values: Dict[str, Any] = {}
+            pos = self.offsets[current]
+            for (name, tag) in SCHEMAS[self.kinds[current]]:
+                slot = self.slots[pos]
+                if tag == NODES:
+                    values[name] = tuple(built[c] for c in self.slots[pos + 1:pos + 1 + slot])
+                    pos += 1 + slot
+                    continue
+                if tag == NODE:
+                    values[name] = built[slot]
+                else:
+                    values[name] = self.strings[slot] if tag == STR else self.ints[slot]
+                pos += 1
+            built[current] = self.node_class(current)(**values)
+        return built[self.root if index is None else index]
+
+    def _children(self, index: int) -> List[int]:
+        children: List[int] = []
+        pos = self.offsets[index]
+        for (_, tag) in SCHEMAS[self.kinds[index]]:
+            if tag == NODES:
+                count = self.slots[pos]
+                children.extend(self.slots[pos + 1:pos + 1 + count])
+                pos += 1 + count
+                continue
+            if tag == NODE:
+                children.append(self.slots[pos])
+            pos += 1
+        return children
+
+
+class ArenaNode:
+    """Read-only view of one arena node; isinstance() sees the marlowe_types class"""
+
+    __slots__ = ("arena", "index")
+
+    def __init__(self, arena: ContractArena, index: int) -> None:
+        object.__setattr__(self, "arena", arena)
+        object.__setattr__(self, "index", index)
+
+    @property
+    def __class__(self):  # type: ignore[override]
+        return self.arena.node_class(self.index)
+
+    def __getattr__(self, name: str) -> Any:
+        return self.arena.field(self.index, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("arena nodes are read-only")
+
+    # arena 已 hash-consed：同一 index 即結構相等
+    def __eq__(self, other: object) -> bool:
+        if type(other) is ArenaNode:
+            return self.arena is other.arena and self.index == other.index
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((id(self.arena), self.index))
+
+    def __repr__(self) -> str:
+        return repr(self.arena.materialize(self.index))
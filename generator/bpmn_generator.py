@@ -14,6 +14,7 @@ from datetime import datetime, timezone
 from typing import Dict, Iterable, List, Optional
 import xml.etree.ElementTree as ET
 
+from instrumentation import traced
 from marlowe_types import (
     AccountPayee,
     AddValue,
@@ -31,6 +32,7 @@ from marlowe_types import (
     Deposit,
     DivValue,
     FalseObs,
+    Frame,
     If,
     Let,
     MulValue,
@@ -58,6 +60,7 @@ from marlowe_types import (
     ValueLE,
     ValueLT,
     When,
+    run_frames,
 )
 
 BPMN_NS = "http://www.omg.org/spec/BPMN/20100524/MODEL"
@@ -152,7 +155,9 @@ class MarloweToBpmnConverter:
         self.lanes: List[BpmnLane] = []
         self.participant_bounds: Dict[str, int] = {"x": 0, "y": 0, "width": 0, "height": 0}
 
-    def generate_xml(self, contract: Contract, process_name: str = "Marlowe Contract") -> str:
+    @traced("bpmn_layout")
+    def layout(self, contract: Contract) -> "MarloweToBpmnConverter":
+        """Builds nodes, flows and lane geometry for `contract` (shared by render_xml / render_svg)"""
         self.nodes.clear()
         self.flows.clear()
         self._node_counter = 0
@@ -161,7 +166,14 @@ class MarloweToBpmnConverter:
         start_id = self._add_node("startEvent", "Contract start", 80, 120, lane="Contract")
         self._emit_contract(contract, start_id, 220, 120)
         self._layout_lanes()
+        return self
+
+    def generate_xml(self, contract: Contract, process_name: str = "Marlowe Contract") -> str:
+        return self.layout(contract).render_xml(process_name)
 
+    @traced("bpmn_render_xml")
+    def render_xml(self, process_name: str = "Marlowe Contract") -> str:
+        """BPMN 2.0 XML of the current layout"""
         definitions = ET.Element(
             self._qname(BPMN_NS, "definitions"),
             {
@@ -328,7 +340,11 @@ class MarloweToBpmnConverter:
         return ET.tostring(definitions, encoding="unicode", xml_declaration=True)
 
     def generate_svg(self, contract: Contract, process_name: str = "Marlowe Contract") -> str:
-        self.generate_xml(contract, process_name=process_name)
+        return self.layout(contract).render_svg(process_name)
+
+    @traced("bpmn_render_svg")
+    def render_svg(self, process_name: str = "Marlowe Contract") -> str:
+        """Standalone SVG diagram of the current layout"""
         width = self.participant_bounds["x"] + self.participant_bounds["width"] + self.POOL_MARGIN
         height = self.participant_bounds["y"] + self.participant_bounds["height"] + self.POOL_MARGIN
         svg = ET.Element(
@@ -440,6 +456,18 @@ class MarloweToBpmnConverter:
         flow_name: Optional[str] = None,
         flow_condition: Optional[str] = None,
     ) -> None:
+        run_frames(self._emit_contract_frame(contract, incoming_id, x, y, flow_name, flow_condition))
+
+    def _emit_contract_frame(
+        self,
+        contract: Contract,
+        incoming_id: str,
+        x: int,
+        y: int,
+        flow_name: Optional[str] = None,
+        flow_condition: Optional[str] = None,
+    ) -> Frame:
+        """_emit_contract 的單層；後續合約以 `yield` 交給 run_frames (深層合約不受遞迴上限限制)"""
         if isinstance(contract, Close):
             end_id = self._add_node("endEvent", "Close", x, y, lane="Contract")
             self._add_flow(incoming_id, end_id, name=flow_name, condition_text=flow_condition)
@@ -452,7 +480,7 @@ class MarloweToBpmnConverter:
             )
             node_id = self._add_node("serviceTask", name, x, y, lane="Contract")
             self._add_flow(incoming_id, node_id, name=flow_name, condition_text=flow_condition)
-            self._emit_contract(contract.then, node_id, x + self.H_STEP, y)
+            yield self._emit_contract_frame(contract.then, node_id, x + self.H_STEP, y)
             return
 
         if isinstance(contract, Let):
@@ -464,7 +492,7 @@ class MarloweToBpmnConverter:
                 lane="Contract",
             )
             self._add_flow(incoming_id, node_id, name=flow_name, condition_text=flow_condition)
-            self._emit_contract(contract.then, node_id, x + self.H_STEP, y)
+            yield self._emit_contract_frame(contract.then, node_id, x + self.H_STEP, y)
             return
 
         if isinstance(contract, Assert):
@@ -476,7 +504,7 @@ class MarloweToBpmnConverter:
                 lane="Contract",
             )
             self._add_flow(incoming_id, node_id, name=flow_name, condition_text=flow_condition)
-            self._emit_contract(contract.then, node_id, x + self.H_STEP, y)
+            yield self._emit_contract_frame(contract.then, node_id, x + self.H_STEP, y)
             return
 
         if isinstance(contract, If):
@@ -495,7 +523,7 @@ class MarloweToBpmnConverter:
             else_y = y + self.V_STEP // 2
             cond_text = self._format_observation(contract.cond)
             then_flow_id = self._peek_next_flow_id()
-            self._emit_contract(
+            yield self._emit_contract_frame(
                 contract.then,
                 gateway_id,
                 x + self.H_STEP,
@@ -504,7 +532,7 @@ class MarloweToBpmnConverter:
                 flow_condition=cond_text,
             )
             self.nodes[gateway_id].attrs["default"] = self._peek_next_flow_id()
-            self._emit_contract(
+            yield self._emit_contract_frame(
                 contract.else_,
                 gateway_id,
                 x + self.H_STEP,
@@ -534,7 +562,7 @@ class MarloweToBpmnConverter:
             for index, case in enumerate(contract.cases):
                 action_id = self._emit_action(case, x + self.H_STEP, branch_positions[index])
                 self._add_flow(gateway_id, action_id, name=self._action_edge_name(case))
-                self._emit_contract(case.then, action_id, x + (self.H_STEP * 2), branch_positions[index])
+                yield self._emit_contract_frame(case.then, action_id, x + (self.H_STEP * 2), branch_positions[index])
 
             timeout_y = branch_positions[-1]
             timer_id = self._add_node(
@@ -547,7 +575,7 @@ class MarloweToBpmnConverter:
                 documentation=f"Marlowe timeout branch for UNIX timestamp {contract.timeout}",
             )
             self._add_flow(gateway_id, timer_id, name="timeout")
-            self._emit_contract(
+            yield self._emit_contract_frame(
                 contract.timeout_continuation,
                 timer_id,
                 x + (self.H_STEP * 2),
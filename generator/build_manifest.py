@@ -0,0 +1,151 @@
+"""
+Incremental build manifest
+
+`cli.py build` used to rewrite every generated file on each run, bumping
+mtimes so `sui move build` and the TS toolchain recompiled everything. The
+manifest records, per spec,
+
+    inputs    sha256 of the spec bytes, generator sources, LoweringOptions
+              (+ build flags), token registry and deployment.json
+    outputs   path -> sha256 of each file the build wrote
+
+A spec whose inputs are unchanged and whose outputs are still on disk with
+the recorded hashes is skipped. Outputs go through write_if_changed(), which
+renders into a temp file and only replaces the target when the bytes differ.
+
+The manifest lives in <repo>/.cache/build-manifest.json (MARLOWE_BUILD_MANIFEST).
+"""
+
+import filecmp
+import hashlib
+import json
+import os
+import re
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from parse_cache import source_digest
+from token_registry import current_token_registry
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPTS_DIR)
+DEFAULT_MANIFEST_PATH = os.path.join(ROOT_DIR, ".cache", "build-manifest.json")
+MANIFEST_VERSION = 1
+
+# build 流程的進入點；影響產出的原始碼 = 這些檔案 import (含函式內 lazy import) 的本地模組遞移閉包，
+# 不再手動列舉，新增的 generator 模組 (例如 bpmn_generator) 不會漏掉
+BUILD_ROOTS = ("cli.py", "session.py", "build_manifest.py")
+
+
+# 行首的 import 敘述 (比 ast.parse 整個 cli.py 快得多；字串樣板中不會有行首 import)
+_IMPORT_LINE = re.compile(r"^[ \t]*(?:from[ \t]+([A-Za-z_][\w.]*)[ \t]+import\b|import[ \t]+([A-Za-z_][\w., \t]*))", re.MULTILINE)
+
+
+def build_sources(roots: Tuple[str, ...] = BUILD_ROOTS) -> Tuple[str, ...]:
+    """Generator modules reachable from `roots` through import statements, sorted"""
+    found: Set[str] = set()
+    pending = list(roots)
+    while pending:
+        name = pending.pop()
+        if name in found:
+            continue
+        found.add(name)
+        with open(os.path.join(SCRIPTS_DIR, name), "r", encoding="utf-8") as f:
+            source = f.read()
+        for (from_module, imported) in _IMPORT_LINE.findall(source):
+            modules = [from_module] if from_module else [part.split()[0] for part in imported.split(",") if part.strip()]
+            for module in modules:
+                path = f"{module.split('.')[0]}.py"
+                if os.path.isfile(os.path.join(SCRIPTS_DIR, path)):
+                    pending.append(path)
+    return tuple(sorted(found))
+
+
+_build_version: Optional[str] = None
+
+
+def build_version() -> str:
+    global _build_version
+    if _build_version is None:
+        _build_version = source_digest(build_sources())
+    return _build_version
+
+
+def file_digest(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def write_if_changed(path: str, write: Callable[[Any], None], binary: bool = False) -> str:
+    """Renders `write(f)` into path.tmp and replaces `path` only if the bytes differ; returns the sha256"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb" if binary else "w") as f:
+            write(f)
+        digest = file_digest(tmp_path)
+        if os.path.isfile(path) and filecmp.cmp(tmp_path, path, shallow=False):
+            os.remove(tmp_path)  # 內容相同：保留原檔 mtime
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest
+
+
+class BuildManifest:
+    """spec file -> {"inputs": ..., "outputs": {path: sha256}}"""
+
+    def __init__(self, path: Optional[str] = None, entries: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        self.path = path or os.environ.get("MARLOWE_BUILD_MANIFEST") or DEFAULT_MANIFEST_PATH
+        self.entries: Dict[str, Dict[str, Any]] = entries or {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "BuildManifest":
+        manifest = cls(path)
+        try:
+            with open(manifest.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return manifest  # 不存在或損毀：視為全部需要重建
+        if isinstance(data, dict) and data.get("version") == MANIFEST_VERSION and isinstance(data.get("specs"), dict):
+            manifest.entries = data["specs"]
+        return manifest
+
+    @staticmethod
+    def inputs(spec_path: str, options: Any, extra: Dict[str, Any]) -> Dict[str, Any]:
+        """Everything that determines a spec's outputs"""
+        return {
+            "spec": file_digest(spec_path),
+            "generator": build_version(),
+            "options": repr(options),
+            "tokens": current_token_registry().fingerprint(),
+            **extra,
+        }
+
+    def is_fresh(self, spec: str, inputs: Dict[str, Any]) -> bool:
+        entry = self.entries.get(spec)
+        if entry is None or entry.get("inputs") != inputs:
+            return False
+        return all(file_digest(path) == digest for (path, digest) in entry.get("outputs", {}).items())
+
+    def record(self, spec: str, entry: Optional[Dict[str, Any]]) -> None:
+        if entry is None:
+            if self.entries.pop(spec, None) is not None:
+                self.dirty = True
+            return
+        if self.entries.get(spec) != entry:
+            self.entries[spec] = entry
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        payload = {"version": MANIFEST_VERSION, "specs": self.entries}
+        write_if_changed(self.path, lambda f: json.dump(payload, f, indent=2, sort_keys=True))
+        self.dirty = False
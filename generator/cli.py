@@ -5,39 +5,30 @@ Marlowe-to-Move Compiler CLI
 Command-line interface for generating Move smart contracts from Marlowe specs.
 """
 
+from __future__ import annotations
+
 import argparse
+import importlib.util
 import json
 import os
 import subprocess
 import sys
-from typing import Optional
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+# 啟動路徑只載入 argparse；rich 與編譯器模組 (parser / codegen / BPMN / xml.etree)
+# 由各子命令在需要時才 import，`list`、`--help` 與 shell completion 不必載入整個編譯器。
+# (startup_bench.py 檢查各子命令的 import 預算)
 
 # Rich for beautiful terminal output
-try:
-    from rich.console import Console
-    from rich.table import Table
-    from rich.panel import Panel
-    from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
-    from rich.syntax import Syntax
-    from rich import print as rprint
-    RICH_AVAILABLE = True
-except ImportError:
-    RICH_AVAILABLE = False
+RICH_AVAILABLE = importlib.util.find_spec("rich") is not None
+if not RICH_AVAILABLE:
     print("Warning: 'rich' not installed. Install with: pip install rich")
 
-# Local imports
-from parser import parse_contract
-from fsm_model import parse_contract_to_infos
-from bpmn_generator import generate_bpmn_xml, generate_bpmn_svg
-from bpmn_validate import validate_bpmn_file, validate_bpmn_xml
-from move_generator import (
-    generate_module,
-    build_stage_lookup,
-    generate_test_module,
-    sanitize_module_name,
-    LoweringOptions,
-)
-from ts_generator import generate_ts_sdk
+if TYPE_CHECKING:
+    from build_manifest import BuildManifest
+    from move_generator import LoweringOptions
+    from session import CompilationSession
 
 # Path setup
 SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -45,12 +36,22 @@ ROOT_DIR = os.path.dirname(SCRIPTS_DIR)
 SPECS_DIR = os.path.join(ROOT_DIR, "specs")
 ARTIFACTS_DIR = os.path.join(ROOT_DIR, "artifacts")
 BPMN_ARTIFACTS_DIR = os.path.join(ARTIFACTS_DIR, "bpmn")
+IR_ARTIFACTS_DIR = os.path.join(ARTIFACTS_DIR, "ir")
 CONTRACT_DIR = os.path.join(ROOT_DIR, "contract")
 SDK_DIR = os.path.join(ROOT_DIR, "sdk")
 DEPLOYMENT_FILE = os.path.join(ROOT_DIR, "deployments", "deployment.json")
 INTENT_PIPELINE_SCRIPT = os.path.join(SCRIPTS_DIR, "intent_pipeline.py")
 
-console = Console() if RICH_AVAILABLE else None
+_console = None
+
+
+def get_console():
+    """Shared rich Console, created on first output"""
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
 
 
 def unwrap_marlowe_payload(payload):
@@ -67,23 +68,39 @@ def get_specs() -> list[str]:
             if f.endswith(".json") and f != "test.json"]
 
 
+# 平行 build 時 worker 的訊息先收集，由主程序依 spec 順序重播
+_captured_logs: Optional[List[Tuple[str, str]]] = None
+
+
+def _replay_logs(logs: List[Tuple[str, str]]) -> None:
+    printers = {"success": print_success, "error": print_error, "info": print_info}
+    for (kind, msg) in logs:
+        printers[kind](msg)
+
+
 def print_success(msg: str):
-    if RICH_AVAILABLE:
-        console.print(f"[green]✓[/green] {msg}")
+    if _captured_logs is not None:
+        _captured_logs.append(("success", msg))
+    elif RICH_AVAILABLE:
+        get_console().print(f"[green]✓[/green] {msg}")
     else:
         print(f"✓ {msg}")
 
 
 def print_error(msg: str):
-    if RICH_AVAILABLE:
-        console.print(f"[red]✗[/red] {msg}")
+    if _captured_logs is not None:
+        _captured_logs.append(("error", msg))
+    elif RICH_AVAILABLE:
+        get_console().print(f"[red]✗[/red] {msg}")
     else:
         print(f"✗ {msg}")
 
 
 def print_info(msg: str):
-    if RICH_AVAILABLE:
-        console.print(f"[blue]ℹ[/blue] {msg}")
+    if _captured_logs is not None:
+        _captured_logs.append(("info", msg))
+    elif RICH_AVAILABLE:
+        get_console().print(f"[blue]ℹ[/blue] {msg}")
     else:
         print(f"ℹ {msg}")
 
@@ -97,6 +114,8 @@ def cmd_list(args):
         return 1
     
     if RICH_AVAILABLE:
+        from rich.table import Table
+
         table = Table(title="Available Specs")
         table.add_column("Name", style="cyan")
         table.add_column("File", style="dim")
@@ -108,7 +127,7 @@ def cmd_list(args):
             name = os.path.splitext(spec)[0]
             table.add_row(name, spec, f"{size} bytes")
         
-        console.print(table)
+        get_console().print(table)
     else:
         print("Available Specs:")
         print("-" * 40)
@@ -119,6 +138,36 @@ def cmd_list(args):
     return 0
 
 
+def _open_session(
+    spec_file: str,
+    lowering_options: Optional[LoweringOptions] = None,
+    ast_arena: bool = False,
+) -> CompilationSession:
+    from session import CompilationSession
+
+    return CompilationSession(
+        os.path.join(SPECS_DIR, spec_file),
+        lowering_options,
+        unwrap=unwrap_marlowe_payload,
+        ast_arena=ast_arena,
+        name=os.path.splitext(spec_file)[0],
+    )
+
+
+def validate_session(session: CompilationSession) -> bool:
+    """Parses and linearizes the session's spec, reporting the result"""
+    try:
+        # Try parsing (cached by spec content hash)
+        infos = session.infos
+        print_success(f"{session.name}: Valid ({len(infos)} stages)")
+        return True
+    except json.JSONDecodeError as e:
+        print_error(f"{session.name}: Invalid JSON - {e}")
+    except Exception as e:
+        print_error(f"{session.name}: Parse error - {e}")
+    return False
+
+
 def cmd_validate(args):
     """Validate a spec file."""
     specs = get_specs()
@@ -128,6 +177,8 @@ def cmd_validate(args):
     else:
         target_specs = specs
     
+    from instrumentation import spec_scope
+
     success_count = 0
     fail_count = 0
     
@@ -137,25 +188,11 @@ def cmd_validate(args):
             fail_count += 1
             continue
         
-        json_path = os.path.join(SPECS_DIR, spec)
-        name = os.path.splitext(spec)[0]
-        
-        try:
-            with open(json_path, "r") as f:
-                json_data = unwrap_marlowe_payload(json.load(f))
-            
-            # Try parsing
-            contract_ast = parse_contract(json_data)
-            (infos, _) = parse_contract_to_infos(contract_ast, stage=0)
-            
-            print_success(f"{name}: Valid ({len(infos)} stages)")
+        with spec_scope(os.path.splitext(spec)[0]):
+            ok = validate_session(_open_session(spec))
+        if ok:
             success_count += 1
-            
-        except json.JSONDecodeError as e:
-            print_error(f"{name}: Invalid JSON - {e}")
-            fail_count += 1
-        except Exception as e:
-            print_error(f"{name}: Parse error - {e}")
+        else:
             fail_count += 1
     
     print()
@@ -167,53 +204,186 @@ def build_single_spec(
     spec_file: str,
     output_dir: Optional[str] = None,
     lowering_options: Optional[LoweringOptions] = None,
+    ast_arena: bool = False,
+    emit_ir: Optional[str] = None,
+    manifest: Optional[BuildManifest] = None,
+    force: bool = False,
+    with_bpmn: bool = False,
+    validate: bool = False,
+    timings: Optional[Dict[str, float]] = None,
 ) -> bool:
-    """Build a single spec file."""
+    """Build a single spec file (skipped when `manifest` says its outputs are up to date).
+
+    Every artifact comes from one CompilationSession, so the spec is read,
+    parsed and linearized once however many outputs are requested. Per-phase
+    times (ms) are added to `timings` when given.
+    """
+    from build_manifest import BuildManifest, file_digest, write_if_changed
+    from move_generator import LoweringOptions
+
     lowering_options = (lowering_options or LoweringOptions()).normalized()
     module_name_raw = os.path.splitext(spec_file)[0]
-    module_name = sanitize_module_name(module_name_raw)
     json_path = os.path.join(SPECS_DIR, spec_file)
+    output_path = os.path.join(output_dir or CONTRACT_DIR, "sources", f"{module_name_raw}.move")
+    test_path = os.path.join(output_dir or CONTRACT_DIR, "tests", f"{module_name_raw}_tests.move")
+    ts_path = os.path.join(SDK_DIR, f"{module_name_raw}_sdk.ts")
+    ir_base = os.path.join(IR_ARTIFACTS_DIR, module_name_raw)
+    session = None
     
     try:
-        # Parse
-        with open(json_path, "r") as f:
-            json_data = unwrap_marlowe_payload(json.load(f))
+        if manifest is not None:
+            inputs = BuildManifest.inputs(json_path, lowering_options, {
+                "ast_arena": ast_arena,
+                "emit_ir": emit_ir,
+                "bpmn": with_bpmn,
+                "validate": validate,  # 驗證失敗時不寫入 manifest，所以有紀錄即代表驗證通過
+                "deployment": file_digest(DEPLOYMENT_FILE),  # SDK 內嵌 package / contract id
+                "paths": [output_path, test_path, ts_path],
+            })
+            if not force and manifest.is_fresh(spec_file, inputs):
+                print_info(f"{module_name_raw}: up to date")
+                return True
+            manifest.record(spec_file, None)
+        outputs = {}
+
+        session = _open_session(spec_file, lowering_options, ast_arena)
+        if validate and not validate_session(session):
+            return False
+        if session.report is not None:
+            print_info(f"{module_name_raw}: optimized {session.report.summary()}")
+
+        if emit_ir:
+            # FSM IR: 下游工具可直接從 stage infos 開始，不必重跑 parser
+            if emit_ir in ("bin", "both"):
+                outputs[f"{ir_base}.fsm.bin"] = write_if_changed(
+                    f"{ir_base}.fsm.bin", lambda f: f.write(session.ir_bytes), binary=True
+                )
+            if emit_ir in ("json", "both"):
+                outputs[f"{ir_base}.fsm.json"] = _write_text_file(f"{ir_base}.fsm.json", session.ir_json)
         
-        contract_ast = parse_contract(json_data)
-        (infos, _) = parse_contract_to_infos(contract_ast, stage=0)
-        stage_lookup = build_stage_lookup(infos)
-        
-        # Generate Move
-        move_code = generate_module(
-            infos,
-            stage_lookup,
-            module_name=module_name,
-            options=lowering_options,
-        )
-        output_path = os.path.join(output_dir or CONTRACT_DIR, "sources", f"{module_name_raw}.move")
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w") as f:
-            f.write(move_code)
+        # Generate Move (逐個函式串流寫入檔案，內容不變則不覆寫)
+        outputs[output_path] = write_if_changed(output_path, session.write_move)
         
         # Generate Tests
-        test_code = generate_test_module(infos, package_name=module_name)
-        test_path = os.path.join(output_dir or CONTRACT_DIR, "tests", f"{module_name_raw}_tests.move")
-        os.makedirs(os.path.dirname(test_path), exist_ok=True)
-        with open(test_path, "w") as f:
-            f.write(test_code)
+        outputs[test_path] = _write_text_file(test_path, session.test_source)
         
         # Generate TypeScript SDK
-        ts_code = generate_ts_sdk(infos, deployment_path=DEPLOYMENT_FILE, module_name=module_name)
-        ts_path = os.path.join(SDK_DIR, f"{module_name_raw}_sdk.ts")
-        os.makedirs(os.path.dirname(ts_path), exist_ok=True)
-        with open(ts_path, "w") as f:
-            f.write(ts_code)
-        
+        outputs[ts_path] = write_if_changed(ts_path, lambda out: session.write_ts(out, DEPLOYMENT_FILE))
+
+        if with_bpmn and not build_bpmn_for_spec(spec_file, run_validation=validate, session=session, outputs=outputs):
+            return False
+
+        if manifest is not None:
+            manifest.record(spec_file, {"inputs": inputs, "outputs": outputs})
         return True
         
     except Exception as e:
         print_error(f"Build failed for {module_name_raw}: {e}")
         return False
+    finally:
+        if timings is not None and session is not None:
+            timings.update(session.timings)
+
+
+def _build_spec_job(
+    spec_file: str,
+    output_dir: Optional[str],
+    lowering_options: LoweringOptions,
+    ast_arena: bool,
+    emit_ir: Optional[str],
+    manifest: Optional[BuildManifest],
+    force: bool,
+    with_bpmn: bool,
+    validate: bool,
+) -> Tuple[bool, List[Tuple[str, str]], Optional[dict]]:
+    """Process-pool entry point: builds one spec; returns (ok, captured log lines, manifest entry)"""
+    global _captured_logs
+    _captured_logs = []
+    try:
+        ok = build_single_spec(
+            spec_file, output_dir, lowering_options, ast_arena, emit_ir, manifest, force, with_bpmn, validate
+        )
+        entry = manifest.entries.get(spec_file) if manifest is not None else None
+        return (ok, _captured_logs, entry)
+    finally:
+        _captured_logs = None
+
+
+def _iter_builds(
+    target_specs: List[str],
+    args,
+    lowering_options: LoweringOptions,
+    jobs: int,
+    on_start: Callable[[str], None],
+    manifest: Optional[BuildManifest] = None,
+) -> Iterator[Tuple[str, bool]]:
+    """Builds specs and yields (name, ok) in spec order; jobs > 1 builds in a process pool"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    from build_manifest import BuildManifest
+
+    build_args = (args.output, lowering_options, args.ast_arena, args.emit_ir)
+    session_args = (args.with_bpmn, args.validate)
+    if jobs == 1 or len(target_specs) == 1:
+        from instrumentation import spec_scope
+
+        for spec in target_specs:
+            name = os.path.splitext(spec)[0]
+            on_start(name)
+            with spec_scope(name):
+                ok = build_single_spec(spec, *build_args, manifest, args.force, *session_args)
+            yield (name, ok)
+        return
+
+    def job_manifest(spec: str) -> Optional[BuildManifest]:
+        # worker 只需要自己那一筆；結果由主程序合併
+        if manifest is None:
+            return None
+        entry = manifest.entries.get(spec)
+        return BuildManifest(manifest.path, {spec: entry} if entry is not None else {})
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(target_specs))) as pool:
+        futures = [
+            pool.submit(_build_spec_job, spec, *build_args, job_manifest(spec), args.force, *session_args)
+            for spec in target_specs
+        ]
+        for (spec, future) in zip(target_specs, futures):
+            name = os.path.splitext(spec)[0]
+            on_start(name)
+            try:
+                (ok, logs, entry) = future.result()
+            except Exception as e:
+                (ok, logs, entry) = (False, [("error", f"Build failed for {name}: {e}")], None)
+            _replay_logs(logs)
+            if manifest is not None:
+                manifest.record(spec, entry)
+            yield (name, ok)
+
+
+def _lowering_options_from_args(args) -> Optional[LoweringOptions]:
+    """LoweringOptions from the shared build flags (None after reporting an invalid combination)"""
+    from move_generator import LoweringOptions
+
+    try:
+        lowering_options = LoweringOptions(
+            choice_write_policy=args.choice_policy,
+            emit_debug_views=not args.no_emit_views,
+            expr_mode=args.expr_mode,
+            symbol_keys=args.symbol_keys,
+            share_continuations=args.share_continuations,
+            fold_constants=args.fold_constants,
+            fuse_auto_stages=args.fuse_stages,
+            auto_dispatch=args.auto_dispatch,
+            bytecode_format=args.bytecode_format,
+            verified_eval=args.verified_eval,
+        ).normalized()
+    except ValueError as e:
+        print_error(str(e))
+        return None
+    if getattr(args, "ast_arena", False) and lowering_options.fold_constants:
+        print_error("--ast-arena cannot be combined with --fold-constants (the optimizer rebuilds AST objects)")
+        return None
+    return lowering_options
 
 
 def cmd_build(args):
@@ -233,29 +403,42 @@ def cmd_build(args):
         print_error("No specs to build")
         return 1
     
-    lowering_options = LoweringOptions(
-        choice_write_policy=args.choice_policy,
-        emit_debug_views=not args.no_emit_views,
-    ).normalized()
+    lowering_options = _lowering_options_from_args(args)
+    if lowering_options is None:
+        return 1
 
+    jobs = args.jobs if args.jobs is not None else (os.cpu_count() or 1)
+    if jobs < 1:
+        print_error("--jobs must be at least 1")
+        return 1
+    if jobs > 1 and _profiling(args):
+        # span 與 cProfile 只收集本 process 的資料
+        print_info("--profile builds in-process (--jobs 1)")
+        jobs = 1
+
+    from build_manifest import BuildManifest
+
+    manifest = BuildManifest.load()
     success_count = 0
     fail_count = 0
     
     if RICH_AVAILABLE:
+        from rich.progress import BarColumn, Progress, SpinnerColumn, TextColumn
+
         with Progress(
             SpinnerColumn(),
             TextColumn("[progress.description]{task.description}"),
             BarColumn(),
             TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-            console=console,
+            console=get_console(),
         ) as progress:
             task = progress.add_task("Building specs...", total=len(target_specs))
             
-            for spec in target_specs:
-                name = os.path.splitext(spec)[0]
+            def on_start(name: str) -> None:
                 progress.update(task, description=f"Building {name}...")
-                
-                if build_single_spec(spec, args.output, lowering_options):
+
+            for (name, ok) in _iter_builds(target_specs, args, lowering_options, jobs, on_start, manifest):
+                if ok:
                     print_success(f"Built {name}")
                     success_count += 1
                 else:
@@ -263,21 +446,169 @@ def cmd_build(args):
                 
                 progress.advance(task)
     else:
-        for spec in target_specs:
-            name = os.path.splitext(spec)[0]
+        def on_start(name: str) -> None:
             print(f"Building {name}...")
-            
-            if build_single_spec(spec, args.output, lowering_options):
+
+        for (name, ok) in _iter_builds(target_specs, args, lowering_options, jobs, on_start, manifest):
+            if ok:
                 print_success(f"Built {name}")
                 success_count += 1
             else:
                 fail_count += 1
     
+    manifest.save()
     print()
     print_info(f"Build complete: {success_count} succeeded, {fail_count} failed")
     return 0 if fail_count == 0 else 1
 
 
+def cmd_watch(args):
+    """Rebuild specs as they change, keeping the generator loaded in-process."""
+    lowering_options = _lowering_options_from_args(args)
+    if lowering_options is None:
+        return 1
+
+    only = None
+    if args.spec:
+        only = f"{args.spec}.json" if not args.spec.endswith(".json") else args.spec
+        if only not in get_specs():
+            print_error(f"Spec '{args.spec}' not found")
+            return 1
+
+    from build_manifest import BuildManifest
+    from instrumentation import spec_scope
+    from spec_watch import InotifyWatcher, open_watcher, wait_for_changes
+
+    manifest = BuildManifest.load()
+
+    def rebuild(changed) -> None:
+        specs = set(get_specs())
+        for spec in sorted(changed):
+            if spec not in specs or (only is not None and spec != only):
+                continue  # 已刪除、test.json 或不在 --spec 範圍
+            name = os.path.splitext(spec)[0]
+            timings: Dict[str, float] = {}
+            start = time.perf_counter()
+            with spec_scope(name):
+                ok = build_single_spec(
+                    spec, args.output, lowering_options, args.ast_arena, args.emit_ir,
+                    manifest, False, args.with_bpmn, args.validate, timings,
+                )
+            elapsed = (time.perf_counter() - start) * 1000
+            manifest.save()
+            if ok and timings:
+                phases = ", ".join(f"{phase} {ms:.1f}" for (phase, ms) in timings.items())
+                print_success(f"Rebuilt {name} in {elapsed:.1f} ms ({phases})")
+
+    rebuild([only] if only else get_specs())
+    watcher = open_watcher(SPECS_DIR, polling=args.poll, interval=args.poll_interval)
+    backend = "inotify" if isinstance(watcher, InotifyWatcher) else "polling"
+    print_info(f"Watching {SPECS_DIR} ({backend}), Ctrl+C to stop")
+    try:
+        while True:
+            rebuild(wait_for_changes(watcher, args.debounce))
+    except KeyboardInterrupt:
+        print()
+        print_info("Watch stopped")
+        return 0
+    finally:
+        watcher.close()
+
+
+def cmd_bench(args):
+    """Benchmark every pipeline phase over specs and synthetic contracts."""
+    lowering_options = _lowering_options_from_args(args)
+    if lowering_options is None:
+        return 1
+    try:
+        sizes = [int(n) for n in args.synthetic.split(",") if n.strip()]
+    except ValueError:
+        print_error(f"--synthetic must be a comma-separated list of stage counts: {args.synthetic}")
+        return 1
+    if args.repeat < 1:
+        print_error("--repeat must be at least 1")
+        return 1
+
+    specs = get_specs()
+    if args.spec:
+        target_file = f"{args.spec}.json" if not args.spec.endswith(".json") else args.spec
+        if target_file not in specs:
+            print_error(f"Spec '{args.spec}' not found")
+            return 1
+        specs = [target_file]
+    elif args.no_specs:
+        specs = []
+
+    from pipeline_bench import BenchInput, compare_results, load_results, run_bench, suite_totals, synthetic_input
+
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = load_results(args.baseline)
+        except (OSError, ValueError) as e:
+            print_error(f"Cannot load baseline: {e}")
+            return 1
+
+    inputs = []
+    for spec in specs:
+        with open(os.path.join(SPECS_DIR, spec), "rb") as f:
+            inputs.append(BenchInput(os.path.splitext(spec)[0], "specs", f.read(), unwrap_marlowe_payload))
+    inputs.extend(synthetic_input(n) for n in sizes)
+    if not inputs:
+        print_error("Nothing to benchmark")
+        return 1
+
+    document = run_bench(
+        inputs, lowering_options, DEPLOYMENT_FILE, args.repeat,
+        on_input=lambda item: print_info(f"Benchmarking {item.name} ({len(item.spec_bytes)} bytes)..."),
+    )
+    for (name, result) in document["results"].items():
+        if "error" in result:
+            print_error(f"{name}: skipped ({result['error'][:160]})")
+
+    counts: Dict[str, int] = {}
+    for result in document["results"].values():
+        if "phases" in result:
+            counts[result["suite"]] = counts.get(result["suite"], 0) + 1
+    rows = [
+        (f"{suite} ({counts[suite]})", phase, stats)
+        for (suite, phases) in suite_totals(document).items()
+        for (phase, stats) in phases.items()
+    ]
+    if RICH_AVAILABLE:
+        from rich.table import Table
+
+        table = Table(title=f"Pipeline phases (median of {args.repeat}, summed per suite)")
+        table.add_column("Suite", style="cyan")
+        table.add_column("Phase")
+        table.add_column("Median ms", justify="right")
+        table.add_column("p95 ms", justify="right")
+        table.add_column("Peak KiB", justify="right", style="dim")
+        for (suite, phase, stats) in rows:
+            table.add_row(suite, phase, f"{stats['median_ms']:.2f}", f"{stats['p95_ms']:.2f}", f"{stats['peak_kib']:.0f}")
+        get_console().print(table)
+    else:
+        print(f"{'Suite':<20} {'Phase':<24} {'Median ms':>10} {'p95 ms':>10} {'Peak KiB':>10}")
+        for (suite, phase, stats) in rows:
+            print(f"{suite:<20} {phase:<24} {stats['median_ms']:>10.2f} {stats['p95_ms']:>10.2f} {stats['peak_kib']:>10.0f}")
+
+    if args.output:
+        _write_text_file(args.output, json.dumps(document, indent=2) + "\n")
+        print_info(f"Results saved to {args.output}")
+
+    if baseline is None:
+        return 0
+    regressions = compare_results(document, baseline, threshold=args.threshold)
+    for r in regressions:
+        print_error(f"{r.input} {r.phase}: {r.metric} {r.baseline:g} -> {r.current:g} (x{r.ratio:.2f})")
+    print()
+    if regressions:
+        print_info(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} of {args.baseline}")
+        return 1
+    print_info(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+
 def cmd_deploy(args):
     """Deploy contract to Sui network."""
     import subprocess
@@ -321,13 +652,15 @@ def cmd_deploy(args):
         print_success("Deployment successful!")
         
         if RICH_AVAILABLE:
+            from rich.table import Table
+
             table = Table(title="Deployment Info")
             table.add_column("Key", style="cyan")
             table.add_column("Value", style="green")
             table.add_row("Package ID", package_id)
             table.add_row("Contract ID", contract_id or "N/A")
             table.add_row("Upgrade Cap ID", upgrade_cap_id or "N/A")
-            console.print(table)
+            get_console().print(table)
         else:
             print(f"  Package ID: {package_id}")
             print(f"  Contract ID: {contract_id or 'N/A'}")
@@ -356,6 +689,20 @@ def cmd_deploy(args):
                 output=None,
                 choice_policy="set_once",
                 no_emit_views=False,
+                expr_mode="rpn",
+                symbol_keys=False,
+                share_continuations=False,
+                fold_constants=False,
+                fuse_stages=False,
+                auto_dispatch="call",
+                bytecode_format="v1",
+                verified_eval=False,
+                ast_arena=False,
+                emit_ir=None,
+                jobs=1,
+                force=False,
+                with_bpmn=False,
+                validate=False,
             )
         )
         
@@ -414,10 +761,10 @@ def _derive_bpmn_output_base(spec_file: str, output: Optional[str]) -> tuple[str
     return base_path, bpmn_path
 
 
-def _write_text_file(path: str, content: str) -> None:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
-        f.write(content)
+def _write_text_file(path: str, content: str) -> str:
+    from build_manifest import write_if_changed
+
+    return write_if_changed(path, lambda f: f.write(content))
 
 
 def _convert_svg_to_png(svg_path: str, png_path: str) -> bool:
@@ -451,24 +798,23 @@ def build_bpmn_for_spec(
     emit_svg: bool = False,
     emit_png: bool = False,
     run_validation: bool = False,
+    session: Optional[CompilationSession] = None,
+    outputs: Optional[Dict[str, str]] = None,
 ) -> bool:
-    """Build BPMN artifacts from a single Marlowe spec."""
+    """Build BPMN artifacts from a single Marlowe spec (reusing `session`'s AST and layout if given)."""
     module_name_raw = os.path.splitext(spec_file)[0]
-    json_path = os.path.join(SPECS_DIR, spec_file)
 
     try:
-        with open(json_path, "r") as f:
-            json_data = unwrap_marlowe_payload(json.load(f))
-
-        contract_ast = parse_contract(json_data)
-        bpmn_xml = generate_bpmn_xml(contract_ast, process_name=module_name_raw)
+        session = session or _open_session(spec_file)
+        bpmn_xml = session.bpmn_xml
         base_path, bpmn_path = _derive_bpmn_output_base(spec_file, output)
-        _write_text_file(bpmn_path, bpmn_xml)
+        digest = _write_text_file(bpmn_path, bpmn_xml)
+        if outputs is not None:
+            outputs[bpmn_path] = digest
 
         if emit_svg or emit_png:
             svg_path = f"{base_path}.svg"
-            svg_text = generate_bpmn_svg(contract_ast, process_name=module_name_raw)
-            _write_text_file(svg_path, svg_text)
+            _write_text_file(svg_path, session.bpmn_svg)
             if emit_png:
                 png_path = f"{base_path}.png"
                 if not _convert_svg_to_png(svg_path, png_path):
@@ -476,6 +822,8 @@ def build_bpmn_for_spec(
                     return False
 
         if run_validation:
+            from bpmn_validate import validate_bpmn_xml
+
             errors, warnings = validate_bpmn_xml(bpmn_xml)
             if warnings:
                 for warning in warnings:
@@ -493,6 +841,8 @@ def build_bpmn_for_spec(
 
 def cmd_bpmn(args):
     """Build BPMN XML from Marlowe specs."""
+    from instrumentation import spec_scope
+
     specs = get_specs()
 
     if args.spec:
@@ -518,13 +868,15 @@ def cmd_bpmn(args):
             print_error("--output must be a directory when converting multiple specs")
             return 1
 
-        if build_bpmn_for_spec(
-            spec,
-            output,
-            emit_svg=args.svg or args.png,
-            emit_png=args.png,
-            run_validation=args.validate,
-        ):
+        with spec_scope(name):
+            ok = build_bpmn_for_spec(
+                spec,
+                output,
+                emit_svg=args.svg or args.png,
+                emit_png=args.png,
+                run_validation=args.validate,
+            )
+        if ok:
             print_success(f"Generated BPMN for {name}")
             success_count += 1
         else:
@@ -552,6 +904,8 @@ def cmd_validate_bpmn(args):
             module_name_raw = os.path.splitext(spec)[0]
             targets.append((module_name_raw, os.path.join(BPMN_ARTIFACTS_DIR, f"{module_name_raw}.bpmn")))
 
+    from bpmn_validate import validate_bpmn_file
+
     success_count = 0
     fail_count = 0
     for label, path in targets:
@@ -575,6 +929,127 @@ def cmd_validate_bpmn(args):
     return 0 if fail_count == 0 else 1
 
 
+def _add_lowering_arguments(parser: argparse.ArgumentParser) -> None:
+    """LoweringOptions flags shared by build, watch and bench"""
+    parser.add_argument(
+        "--choice-policy",
+        choices=["set_once", "overwrite"],
+        default="set_once",
+        help="Choice write policy in generated Move (default: set_once)",
+    )
+    parser.add_argument(
+        "--no-emit-views",
+        action="store_true",
+        help="Do not emit debug/view helper functions in generated Move",
+    )
+    parser.add_argument(
+        "--expr-mode",
+        choices=["rpn", "native"],
+        default="rpn",
+        help="Expression lowering: on-chain RPN interpreter or straight-line Move (default: rpn)",
+    )
+    parser.add_argument(
+        "--symbol-keys",
+        action="store_true",
+        help="Key on-chain tables by compile-time u64 ids instead of strings (needs --expr-mode native)",
+    )
+    parser.add_argument(
+        "--share-continuations",
+        action="store_true",
+        help="Emit structurally identical sub-contracts once and jump to the shared stage block",
+    )
+    parser.add_argument(
+        "--fold-constants",
+        action="store_true",
+        help="Fold constant values/observations and prune unreachable If branches before lowering",
+    )
+    parser.add_argument(
+        "--fuse-stages",
+        action="store_true",
+        help="Fuse runs of automatic Pay/Let/Assert/If stages into a single Move function",
+    )
+    parser.add_argument(
+        "--auto-dispatch",
+        choices=["call", "trampoline"],
+        default="call",
+        help="How automatic stages advance: nested direct calls or a run_auto dispatch loop (default: call)",
+    )
+    parser.add_argument(
+        "--bytecode-format",
+        choices=["v1", "compact"],
+        default="v1",
+        help="RPN bytecode encoding: v1 (fixed-width, inline strings) or compact (varints + module constant pool)",
+    )
+    parser.add_argument(
+        "--verified-eval",
+        action="store_true",
+        help="Emit internal_eval without per-op stack underflow checks (all bytecode is verified at build time)",
+    )
+
+
+def _add_build_arguments(parser: argparse.ArgumentParser) -> None:
+    """Lowering / artifact flags shared by build and watch"""
+    _add_lowering_arguments(parser)
+    parser.add_argument(
+        "--emit-ir",
+        nargs="?",
+        const="bin",
+        choices=["bin", "json", "both"],
+        help="Also write the versioned FSM IR to artifacts/ir/<spec>.fsm.bin (json: .fsm.json debug form)",
+    )
+    parser.add_argument(
+        "--ast-arena",
+        action="store_true",
+        help="Parse specs into a columnar array arena instead of one object per AST node (very large specs)",
+    )
+    parser.add_argument(
+        "--with-bpmn",
+        action="store_true",
+        help="Also write artifacts/bpmn/<spec>.bpmn from the same compilation session",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Report spec validation (and BPMN validation with --with-bpmn) from the same session",
+    )
+
+
+def _profiling(args) -> bool:
+    # deploy 以自建的 Namespace 呼叫 cmd_build，沒有這些屬性
+    return bool(getattr(args, "profile", False) or getattr(args, "profile_memory", False) or getattr(args, "profile_dir", None))
+
+
+def _print_profile() -> None:
+    """Phase breakdown collected by --profile"""
+    from instrumentation import REGISTRY, top_phases
+
+    totals = REGISTRY.phase_totals()
+    if not totals:
+        print_info("--profile: no instrumented phases ran")
+        return
+    print()
+    if RICH_AVAILABLE:
+        from rich.table import Table
+
+        table = Table(title="Phase breakdown")
+        table.add_column("Phase", style="cyan")
+        table.add_column("Calls", justify="right")
+        table.add_column("Wall ms", justify="right")
+        table.add_column("CPU ms", justify="right")
+        table.add_column("Alloc KiB", justify="right", style="dim")
+        for total in totals:
+            alloc = f"{total.alloc_kib:.0f}" if total.alloc_kib is not None else "-"
+            table.add_row(total.phase, str(total.calls), f"{total.wall_ms:.2f}", f"{total.cpu_ms:.2f}", alloc)
+        get_console().print(table)
+        for (spec, wall_ms, by_phase) in REGISTRY.slowest_specs():
+            print_info(f"{spec}: {wall_ms:.1f} ms ({top_phases(by_phase)})")
+    else:
+        for line in REGISTRY.format_breakdown():
+            print(line)
+    if REGISTRY.dump_dir:
+        print_info(f"cProfile stats written to {REGISTRY.dump_dir} (python -m pstats {REGISTRY.dump_dir}/<spec>.pstats)")
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="marlowe-cli",
@@ -585,13 +1060,18 @@ Examples:
   %(prog)s list                    List all available specs
   %(prog)s build                   Build all specs
   %(prog)s build --spec swap_ada   Build specific spec
+  %(prog)s watch                   Rebuild specs as they change
   %(prog)s validate                Validate all specs
+  %(prog)s bench --baseline bench.json  Benchmark pipeline phases
   %(prog)s bpmn --spec swap_ada    Generate BPMN for a spec
   %(prog)s validate-bpmn --spec swap_ada
   %(prog)s intent requirements.md  Build from NL requirements
   %(prog)s deploy                  Deploy to Sui network
         """
     )
+    parser.add_argument("--profile", action="store_true", help="Print a per-phase wall / CPU time breakdown")
+    parser.add_argument("--profile-memory", action="store_true", help="Also track allocations with tracemalloc (implies --profile)")
+    parser.add_argument("--profile-dir", help="Write cProfile stats per spec to DIR/<spec>.pstats (implies --profile)")
     
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
     
@@ -621,18 +1101,61 @@ Examples:
     build_parser = subparsers.add_parser("build", help="Build Move contracts from specs")
     build_parser.add_argument("--spec", "-s", help="Specific spec to build")
     build_parser.add_argument("--output", "-o", help="Output directory")
+    _add_build_arguments(build_parser)
     build_parser.add_argument(
-        "--choice-policy",
-        choices=["set_once", "overwrite"],
-        default="set_once",
-        help="Choice write policy in generated Move (default: set_once)",
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Build specs in N worker processes (default: CPU count; 1 builds in-process)",
     )
     build_parser.add_argument(
-        "--no-emit-views",
+        "--force",
         action="store_true",
-        help="Do not emit debug/view helper functions in generated Move",
+        help="Rebuild every spec even if the build manifest says its outputs are up to date",
     )
     build_parser.set_defaults(func=cmd_build)
+
+    # Watch command
+    watch_parser = subparsers.add_parser("watch", help="Rebuild specs whenever they change")
+    watch_parser.add_argument("--spec", "-s", help="Only rebuild this spec")
+    watch_parser.add_argument("--output", "-o", help="Output directory")
+    _add_build_arguments(watch_parser)
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.1,
+        help="Seconds of quiet after a save before rebuilding (default: 0.1)",
+    )
+    watch_parser.add_argument("--poll", action="store_true", help="Poll the specs directory instead of using inotify")
+    watch_parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.25,
+        help="Polling interval in seconds (default: 0.25)",
+    )
+    watch_parser.set_defaults(func=cmd_watch)
+
+    # Bench command
+    bench_parser = subparsers.add_parser("bench", help="Benchmark each pipeline phase (time and memory)")
+    bench_parser.add_argument("--spec", "-s", help="Only benchmark this spec")
+    bench_parser.add_argument("--no-specs", action="store_true", help="Skip specs/ and run only synthetic contracts")
+    bench_parser.add_argument(
+        "--synthetic",
+        default="100,1000",
+        help="Comma-separated stage counts of synthetic contracts (workload_generator); empty to skip (default: 100,1000)",
+    )
+    bench_parser.add_argument("--repeat", "-n", type=int, default=5, help="Timed runs per input (default: 5)")
+    bench_parser.add_argument("--output", "-o", help="Write results as JSON to this file")
+    bench_parser.add_argument("--baseline", help="Compare against a JSON result file; exit 1 on regressions")
+    bench_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Allowed growth of median time / peak memory over the baseline (default: 0.10 = 10%%)",
+    )
+    _add_lowering_arguments(bench_parser)
+    bench_parser.set_defaults(func=cmd_bench)
     
     # Deploy command
     deploy_parser = subparsers.add_parser("deploy", help="Deploy to Sui network")
@@ -660,8 +1183,23 @@ Examples:
     if not args.command:
         parser.print_help()
         return 0
-    
-    return args.func(args)
+
+    if not _profiling(args):
+        return args.func(args)
+
+    from instrumentation import REGISTRY
+
+    REGISTRY.enable(memory=args.profile_memory, dump_dir=args.profile_dir)
+    # intent 以子程序執行 intent_pipeline，經由環境變數開啟
+    os.environ["MARLOWE_PROFILE"] = "1"
+    if args.profile_memory:
+        os.environ["MARLOWE_PROFILE_MEMORY"] = "1"
+    if args.profile_dir:
+        os.environ["MARLOWE_PROFILE_DIR"] = os.path.abspath(args.profile_dir)
+    rc = args.func(args)
+    if args.command != "intent":  # 子程序已自行印出
+        _print_profile()
+    return rc
 
 
 if __name__ == "__main__":
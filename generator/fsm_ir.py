@@ -0,0 +1,347 @@
+"""
+Versioned binary FSM IR (*.fsm.bin)
+
+The linearized stage infos produced by fsm_model.parse_contract_to_infos,
+stored so downstream tools (TS SDK generation, simulators, the BPMN
+renderer) can start from the IR instead of re-running the front end.
+
+Layout, version 1 (every integer is an unsigned LEB128 varint):
+
+    magic       b"MFSM"
+    version     1
+    strings     n, then n x (byte length, UTF-8 bytes)
+    values      n, then n x string id           JSON text of expressions,
+                                                tokens, bounds, timeouts
+    kinds       n, then n x (kind string id, record count, records)
+    stages      n, then n x (stage, kind index, record index)
+    bytecode    n, then n x (value id, byte length, RPN v1 bytecode)
+
+A record is its StageInfo dataclass's fields in declaration order:
+int -> zigzag varint, str -> string id, anything else -> value id.
+The stage table lists every stage's primary record (a When stage points at
+its WhenStageInfo, not at its cases). Bytecode is the verified v1 RPN
+encoding of each Value/Observation the Move module evaluates; expressions
+the RPN lowering rejects (e.g. negative constants) have no entry.
+
+ir_to_json() renders the same content as indented JSON for debugging.
+"""
+
+import json
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from fsm_model import (
+    CASE_KINDS,
+    InfosDict,
+    StageTable,
+    PayStageInfo, DepositStageInfo, ChoiceStageInfo, NotifyStageInfo, CloseStageInfo,
+    IfStageInfo, LetStageInfo, AssertStageInfo, WhenStageInfo,
+)
+
+MAGIC = b"MFSM"
+IR_VERSION = 1
+
+INFO_CLASSES: Dict[str, type] = {
+    "pay": PayStageInfo,
+    "deposit": DepositStageInfo,
+    "choice": ChoiceStageInfo,
+    "notify": NotifyStageInfo,
+    "when": WhenStageInfo,
+    "if": IfStageInfo,
+    "let": LetStageInfo,
+    "assert": AssertStageInfo,
+    "close": CloseStageInfo,
+}
+
+# 鏈上以 RPN 直譯器求值的欄位
+EXPRESSION_FIELDS: Dict[str, str] = {
+    "pay": "amount",
+    "deposit": "value",
+    "notify": "observation",
+    "if": "condition",
+    "let": "value",
+    "assert": "observation",
+}
+
+_INT = 0
+_STR = 1
+_JSON = 2
+
+
+def _field_tag(annotation: Any) -> int:
+    if annotation is int:
+        return _INT
+    if annotation is str:
+        return _STR
+    return _JSON
+
+
+_SCHEMAS: Dict[str, Tuple[Tuple[str, int], ...]] = {
+    kind: tuple((f.name, _field_tag(f.type)) for f in fields(cls))
+    for (kind, cls) in INFO_CLASSES.items()
+}
+
+
+@dataclass
+class FsmIR:
+    """Loaded IR: stage infos, stage table and pre-serialized bytecode"""
+    infos: InfosDict
+    stages: List[Tuple[int, str, int]] = field(default_factory=list)
+    # (kind, record index) -> RPN v1 bytecode of that record's expression
+    bytecode: Dict[Tuple[str, int], bytes] = field(default_factory=dict)
+
+    def stage_lookup(self) -> StageTable:
+        """Indexed stage table over the loaded infos"""
+        return StageTable(self.infos)
+
+
+# --- Encoding ---
+
+def _put(out: bytearray, value: int) -> None:
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+
+class _Interner:
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.items: List[str] = []
+
+    def __call__(self, text: str) -> int:
+        item_id = self.ids.get(text)
+        if item_id is None:
+            item_id = self.ids[text] = len(self.items)
+            self.items.append(text)
+        return item_id
+
+
+def stage_table(infos: InfosDict) -> List[Tuple[int, str, int]]:
+    """(stage, kind, record index) for each stage's primary record (When cases share their When's stage)"""
+    table = [
+        (info.stage, kind, index)
+        for (kind, records) in infos.items() if kind not in CASE_KINDS
+        for (index, info) in enumerate(records)
+    ]
+    table.sort()
+    return table
+
+
+def expression_bytecode(infos: InfosDict) -> Dict[Tuple[str, int], bytes]:
+    """(kind, record index) -> verified RPN v1 bytecode of each lowerable expression"""
+    from move_generator import _serialize_node, verify_bytecode
+
+    cache: Dict[str, Optional[bytes]] = {}
+    out: Dict[Tuple[str, int], bytes] = {}
+    for (kind, field_name) in EXPRESSION_FIELDS.items():
+        for (index, info) in enumerate(infos.get(kind, [])):
+            expr = getattr(info, field_name)
+            text = json.dumps(expr, separators=(",", ":"))
+            if text not in cache:
+                try:
+                    code = _serialize_node(expr)
+                    verify_bytecode(code)
+                    cache[text] = bytes(code)
+                except ValueError:
+                    cache[text] = None
+            if cache[text] is not None:
+                out[(kind, index)] = cache[text]
+    return out
+
+
+def encode_fsm_ir(infos: InfosDict, bytecode: Optional[Dict[Tuple[str, int], bytes]] = None) -> bytes:
+    """Serializes stage infos into the *.fsm.bin format (`bytecode`: precomputed expression_bytecode)"""
+    strings = _Interner()
+    values = _Interner()
+    body = bytearray()
+
+    kinds = [kind for kind in infos if kind in INFO_CLASSES]
+    kind_index = {kind: i for (i, kind) in enumerate(kinds)}
+    value_of: Dict[Tuple[str, int], int] = {}
+
+    _put(body, len(kinds))
+    for kind in kinds:
+        records = infos[kind]
+        _put(body, strings(kind))
+        _put(body, len(records))
+        expr_field = EXPRESSION_FIELDS.get(kind)
+        for (index, info) in enumerate(records):
+            for (name, tag) in _SCHEMAS[kind]:
+                value = getattr(info, name)
+                if tag == _INT and isinstance(value, int) and not isinstance(value, bool):
+                    _put(body, _zigzag(value))
+                elif tag == _STR and isinstance(value, str):
+                    _put(body, strings(value))
+                elif tag == _JSON:
+                    value_id = values(json.dumps(value, separators=(",", ":"), ensure_ascii=False))
+                    if name == expr_field:
+                        value_of[(kind, index)] = value_id
+                    _put(body, value_id)
+                else:
+                    raise ValueError(f"{kind}.{name} has unexpected type {type(value).__name__}")
+
+    table = stage_table(infos)
+    _put(body, len(table))
+    for (stage, kind, index) in table:
+        _put(body, stage)
+        _put(body, kind_index[kind])
+        _put(body, index)
+
+    if bytecode is None:
+        bytecode = expression_bytecode(infos)
+    # 同一 value id 只存一份 bytecode
+    by_value = {value_of[key]: code for (key, code) in bytecode.items()}
+    _put(body, len(by_value))
+    for (value_id, code) in sorted(by_value.items()):
+        _put(body, value_id)
+        _put(body, len(code))
+        body.extend(code)
+
+    value_strings = [strings(text) for text in values.items]
+
+    out = bytearray(MAGIC)
+    _put(out, IR_VERSION)
+    _put(out, len(strings.items))
+    for text in strings.items:
+        raw = text.encode("utf-8")
+        _put(out, len(raw))
+        out.extend(raw)
+    _put(out, len(value_strings))
+    for string_id in value_strings:
+        _put(out, string_id)
+    out.extend(body)
+    return bytes(out)
+
+
+def write_fsm_ir(path: str, infos: InfosDict) -> None:
+    with open(path, "wb") as f:
+        f.write(encode_fsm_ir(infos))
+
+
+# --- Decoding ---
+
+class _Reader:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.pos = 0
+
+    def varint(self) -> int:
+        data = self.data
+        pos = self.pos
+        result = 0
+        shift = 0
+        while True:
+            if pos >= len(data):
+                raise ValueError("Truncated FSM IR")
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                self.pos = pos
+                return result
+            shift += 7
+
+    def raw(self, length: int) -> bytes:
+        end = self.pos + length
+        if end > len(self.data):
+            raise ValueError("Truncated FSM IR")
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return bytes(chunk)
+
+
+def decode_fsm_ir(data: bytes) -> FsmIR:
+    """Rebuilds stage infos (and the stage table / bytecode) from *.fsm.bin bytes"""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an FSM IR file (bad magic)")
+    reader = _Reader(memoryview(data))
+    reader.pos = len(MAGIC)
+    version = reader.varint()
+    if version != IR_VERSION:
+        raise ValueError(f"Unsupported FSM IR version: {version} (expected {IR_VERSION})")
+
+    strings = [reader.raw(reader.varint()).decode("utf-8") for _ in range(reader.varint())]
+    values = [json.loads(strings[reader.varint()]) for _ in range(reader.varint())]
+
+    infos: InfosDict = {}
+    kinds: List[str] = []
+    expr_value: Dict[Tuple[str, int], int] = {}
+    for _ in range(reader.varint()):
+        kind = strings[reader.varint()]
+        if kind not in INFO_CLASSES:
+            raise ValueError(f"Unknown stage kind in FSM IR: {kind}")
+        cls = INFO_CLASSES[kind]
+        schema = _SCHEMAS[kind]
+        expr_field = EXPRESSION_FIELDS.get(kind)
+        records = []
+        for index in range(reader.varint()):
+            kwargs: Dict[str, Any] = {}
+            for (name, tag) in schema:
+                slot = reader.varint()
+                if tag == _INT:
+                    kwargs[name] = (slot >> 1) ^ -(slot & 1)
+                elif tag == _STR:
+                    kwargs[name] = strings[slot]
+                else:
+                    if name == expr_field:
+                        expr_value[(kind, index)] = slot
+                    kwargs[name] = values[slot]
+            records.append(cls(**kwargs))
+        infos[kind] = records
+        kinds.append(kind)
+
+    stages = [
+        (reader.varint(), kinds[reader.varint()], reader.varint())
+        for _ in range(reader.varint())
+    ]
+
+    code_of_value = {}
+    for _ in range(reader.varint()):
+        value_id = reader.varint()
+        code_of_value[value_id] = reader.raw(reader.varint())
+
+    bytecode = {
+        key: code_of_value[value_id]
+        for (key, value_id) in expr_value.items() if value_id in code_of_value
+    }
+
+    return FsmIR(infos=infos, stages=stages, bytecode=bytecode)
+
+
+def load_fsm_ir(path: str) -> FsmIR:
+    with open(path, "rb") as f:
+        return decode_fsm_ir(f.read())
+
+
+def ir_to_json(infos: InfosDict, bytecode: Optional[Dict[Tuple[str, int], bytes]] = None) -> str:
+    """JSON debug form of the IR (same content as *.fsm.bin, human-readable)"""
+    if bytecode is None:
+        bytecode = expression_bytecode(infos)
+    out = {
+        "format": "marlowe-fsm-ir",
+        "version": IR_VERSION,
+        "stages": [
+            {"stage": stage, "kind": kind, "index": index}
+            for (stage, kind, index) in stage_table(infos)
+        ],
+        "infos": {
+            kind: [{f.name: getattr(info, f.name) for f in fields(info)} for info in records]
+            for (kind, records) in infos.items()
+        },
+        "bytecode": [
+            {"kind": kind, "index": index, "code": list(code)}
+            for ((kind, index), code) in sorted(bytecode.items())
+        ],
+    }
+    return json.dumps(out, indent=2, ensure_ascii=False)
@@ -1,8 +1,8 @@
 # (FIXED) Removed incorrect import
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field, fields
 import json
-import os
-from typing import Any, Dict, List, Optional, Tuple
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 # 確保從 marlowe_types 匯入所有需要的類型
 from marlowe_types import (
@@ -23,72 +23,31 @@ from marlowe_types import (
     AndObs, OrObs, NotObs, ChoseSomething,
     ValueGE, ValueGT, ValueLT, ValueLE, ValueEQ,
     # Helpers
-    ChoiceId, Bound
+    ChoiceId, Bound,
+    # Traversal
+    Frame, run_frames,
 )
 
 # 確保您的 parser.py 檔案位於同一目錄或 Python 路徑中
+from instrumentation import traced
 from parser import parse_contract
 from time_utils import normalize_timeout_to_ms
+from token_registry import TOKEN_MAP as BUILTIN_TOKEN_MAP, current_token_registry
 
 # --------------------------
 # (NEW) Token Type Mapping Helper
 # --------------------------
 
-# Global Token Map configuration
-# This can be expanded to include Mainnet addresses.
-TOKEN_MAP = {
-    ":": "sui::sui::SUI",
-    ":SUI": "sui::sui::SUI",
-    "0x2::sui::SUI:SUI": "sui::sui::SUI", # Explicit
-    # Mapping for Swap ADA spec (Mock Dollar)
-    "85bb65085bb65085bb65085bb65085bb65085bb65085bb65085bb650:dollar": "test::mock_dollar::DOLLAR",
-    # Mocks for ETH/USDC
-    "test::mock_eth::ETH:ETH": "test::mock_eth::ETH",
-    "test::mock_usdc::USDC:USDC": "test::mock_usdc::USDC"
-}
-
+# 內建 map、各網路 registry 檔與 env override 由 token_registry 合併
+TOKEN_MAP = BUILTIN_TOKEN_MAP
 
 def load_token_map() -> Dict[str, str]:
-    """Load token map with optional environment overrides."""
-    merged = dict(TOKEN_MAP)
-    inline = os.environ.get("MARLOWE_TOKEN_MAP_JSON", "").strip()
-    if inline:
-        extra = json.loads(inline)
-        if not isinstance(extra, dict):
-            raise ValueError("MARLOWE_TOKEN_MAP_JSON must be a JSON object")
-        for k, v in extra.items():
-            if isinstance(k, str) and isinstance(v, str):
-                merged[k] = v
-            else:
-                raise ValueError("MARLOWE_TOKEN_MAP_JSON entries must be string:string")
-    return merged
+    """Merged token map (built-ins, network registry file, environment overrides)."""
+    return dict(current_token_registry().entries)
 
 def marlowe_token_to_move_type(token_info: Dict[str, str]) -> str:
-    """
-    Converts Marlowe Token JSON representation to a Sui Move type string.
-    Priority:
-    1. Lookup in TOKEN_MAP (Key = "symbol:name")
-    2. Pass-through if symbol looks like a Move type (contains "::")
-    3. Fallback/Error
-    """
-    currency_symbol = token_info.get("currency_symbol", "")
-    token_name = token_info.get("token_name", "")
-    token_map = load_token_map()
-    
-    # 1. Map Lookup
-    map_key = f"{currency_symbol}:{token_name}"
-    if map_key in token_map:
-        return token_map[map_key]
-        
-    # 2. Heuristic: If symbol is already a fully qualified Move type
-    if "::" in currency_symbol:
-         return currency_symbol
-
-    # 3. Fallback / Hardcoded Assumptions
-    if not currency_symbol and not token_name:
-        return "sui::sui::SUI"
-
-    raise ValueError(f"Could not map Marlowe token to Move type: {token_info}")
+    """Converts Marlowe Token JSON representation to a Sui Move type string (see TokenRegistry.resolve)."""
+    return current_token_registry().resolve(token_info)
 
 
 # --------------------------
@@ -149,16 +108,18 @@ class IfStageInfo:
 
 @dataclass
 class LetStageInfo:
-    """Let: 自動執行，下一步總是 stage + 1"""
+    """Let: 自動執行，下一步為 next_stage"""
     stage: int
     name: str
     value: Any
+    next_stage: int
 
 @dataclass
 class AssertStageInfo:
-    """Assert: 自動執行，下一步總是 stage + 1"""
+    """Assert: 自動執行，下一步為 next_stage"""
     stage: int
     observation: Any
+    next_stage: int
 
 @dataclass
 class WhenStageInfo:
@@ -247,13 +208,21 @@ def value_to_json(v: Value) -> Any:
 # --------------------------
 
 InfosDict = Dict[str, List[Any]]
+SubtreeMemo = Dict[Contract, int]
 
+@traced("parse_contract_to_infos")
 def parse_contract_to_infos(
     contract: Contract,
     stage: int,
-    infos: Optional[InfosDict] = None
+    infos: Optional[InfosDict] = None,
+    share_subtrees: bool = False,
 ) -> Tuple[InfosDict, int]:
-    """遞迴地剖析合約，分配 stage 編號，並儲存 token type string"""
+    """遞迴地剖析合約，分配 stage 編號，並儲存 token type string
+
+    With share_subtrees, structurally identical sub-contracts (e.g. the same
+    refund tail after every timeout) are linearized once and every occurrence
+    jumps to that shared stage block.
+    """
 
     if infos is None:
         infos = {
@@ -261,14 +230,42 @@ def parse_contract_to_infos(
             "when": [], "if": [], "let": [], "assert": [], "close": [],
         }
 
+    memo: Optional[SubtreeMemo] = {} if share_subtrees else None
+    (_, next_free) = _linearize(contract, stage, infos, memo)
+    return (infos, next_free)
+
+
+def _linearize(
+    contract: Contract,
+    stage: int,
+    infos: InfosDict,
+    memo: Optional[SubtreeMemo],
+) -> Tuple[int, int]:
+    """Emits stage infos for `contract` starting at `stage`; returns (entry_stage, next_free_stage)."""
+    return run_frames(_linearize_frame(contract, stage, infos, memo))
+
+
+def _linearize_frame(
+    contract: Contract,
+    stage: int,
+    infos: InfosDict,
+    memo: Optional[SubtreeMemo],
+) -> Frame:
+    """_linearize 的單層；子合約以 `yield` 交給 run_frames (不受遞迴上限限制)"""
+    if memo is not None:
+        # AST 節點已 hash-consed：結構相同的子樹即為同一物件
+        if contract in memo:
+            return (memo[contract], stage)
+        memo[contract] = stage
+
     if isinstance(contract, Close):
         infos["close"].append(CloseStageInfo(stage=stage))
-        return (infos, stage + 1)
+        return (stage, stage + 1)
 
     if isinstance(contract, Pay):
         token_info_json = token_to_json(contract.token)
         move_token_type = marlowe_token_to_move_type(token_info_json)
-        infos["pay"].append(PayStageInfo(
+        pay_info = PayStageInfo(
             stage=stage,
             from_account=party_to_str(contract.from_account),
             to=payee_to_str(contract.to),
@@ -276,55 +273,61 @@ def parse_contract_to_infos(
             amount=value_to_json(contract.value),
             next_stage=stage + 1,
             token_type_str=move_token_type
-        ))
-        return parse_contract_to_infos(contract.then, stage + 1, infos)
+        )
+        infos["pay"].append(pay_info)
+        (pay_info.next_stage, next_free) = yield _linearize_frame(contract.then, stage + 1, infos, memo)
+        return (stage, next_free)
 
     if isinstance(contract, Let):
-        infos["let"].append(LetStageInfo(
+        let_info = LetStageInfo(
             stage=stage,
             name=contract.name,
-            value=value_to_json(contract.value)
-        ))
-        return parse_contract_to_infos(contract.then, stage + 1, infos)
+            value=value_to_json(contract.value),
+            next_stage=stage + 1
+        )
+        infos["let"].append(let_info)
+        (let_info.next_stage, next_free) = yield _linearize_frame(contract.then, stage + 1, infos, memo)
+        return (stage, next_free)
 
     if isinstance(contract, Assert):
-        infos["assert"].append(AssertStageInfo(
+        assert_info = AssertStageInfo(
             stage=stage,
-            observation=observation_to_json(contract.obs)
-        ))
-        return parse_contract_to_infos(contract.then, stage + 1, infos)
+            observation=observation_to_json(contract.obs),
+            next_stage=stage + 1
+        )
+        infos["assert"].append(assert_info)
+        (assert_info.next_stage, next_free) = yield _linearize_frame(contract.then, stage + 1, infos, memo)
+        return (stage, next_free)
 
     if isinstance(contract, If):
-        then_stage_start = stage + 1
-        (infos, then_stage_end) = parse_contract_to_infos(contract.then, then_stage_start, infos)
-        else_stage_start = then_stage_end
-        (infos, else_stage_end) = parse_contract_to_infos(contract.else_, else_stage_start, infos)
+        (then_entry, then_stage_end) = yield _linearize_frame(contract.then, stage + 1, infos, memo)
+        (else_entry, else_stage_end) = yield _linearize_frame(contract.else_, then_stage_end, infos, memo)
         infos["if"].append(IfStageInfo(
             stage=stage,
             condition=observation_to_json(contract.cond),
-            then_stage=then_stage_start,
-            else_stage=else_stage_start
+            then_stage=then_entry,
+            else_stage=else_entry
         ))
-        return (infos, else_stage_end)
+        return (stage, else_stage_end)
 
     if isinstance(contract, When):
         normalized_timeout = normalize_timeout_to_ms(contract.timeout)
         next_child_stage = stage + 1
         case_next_stages = []
         for case in contract.cases:
-            case_starts_at = next_child_stage
-            case_next_stages.append(case_starts_at)
-            (infos, case_end_stage) = parse_contract_to_infos(case.then, case_starts_at, infos)
+            (case_entry, case_end_stage) = yield _linearize_frame(case.then, next_child_stage, infos, memo)
+            case_next_stages.append(case_entry)
             next_child_stage = case_end_stage
 
-        timeout_stage_start = next_child_stage
-        (infos, timeout_stage_end) = parse_contract_to_infos(contract.timeout_continuation, timeout_stage_start, infos)
+        (timeout_entry, timeout_stage_end) = yield _linearize_frame(
+            contract.timeout_continuation, next_child_stage, infos, memo
+        )
 
         infos["when"].append(WhenStageInfo(
             stage=stage,
             timeout=normalized_timeout,
             cases_count=len(contract.cases),
-            timeout_stage=timeout_stage_start
+            timeout_stage=timeout_entry
         ))
 
         for i, case in enumerate(contract.cases):
@@ -363,21 +366,218 @@ def parse_contract_to_infos(
                     next_stage=case_next_stage
                 ))
 
-        return (infos, timeout_stage_end)
+        return (stage, timeout_stage_end)
 
     infos.setdefault("unknown", []).append(str(contract))
-    return (infos, stage + 1)
+    return (stage, stage + 1)
+
+
+# --------------------------
+# StageTable: indexed access to linearized stage infos
+# --------------------------
+
+CASE_KINDS = ("deposit", "choice", "notify")
+
+
+class StageTable(Mapping):
+    """
+    stage -> (type, info) 的索引表 (取代逐 When 重掃 cases 的 build_stage_lookup)。
+
+    Mapping 介面與舊的 stage lookup 相同：一般 stage 為 (type, info)，
+    When stage 為 ("when", (when_info, {"deposit": [...], "choice": [...], "notify": [...]}))。
+    另提供 (stage, case_index) 查詢、successor / predecessor 邊與 per-kind views，皆在建表時一次算好。
+    """
+
+    def __init__(self, infos: InfosDict) -> None:
+        self.infos = infos
+        self._by_stage: Dict[int, Tuple[str, Any]] = {}
+        self._cases: Dict[Tuple[int, int], Tuple[str, Any]] = {}
+        self.successors: Dict[int, List[int]] = {}
+        self.predecessors: Dict[int, List[int]] = {}
+
+        for (stage_type, info_list) in infos.items():
+            if stage_type in CASE_KINDS or stage_type in ("when", "unknown"):
+                continue
+            for info in info_list:
+                self._by_stage[info.stage] = (stage_type, info)
+
+        when_cases: Dict[int, Dict[str, List[Any]]] = {}
+        for when_info in infos.get("when", []):
+            when_cases[when_info.stage] = {kind: [] for kind in CASE_KINDS}
+        for kind in CASE_KINDS:
+            for case in infos.get(kind, []):
+                cases = when_cases.get(case.stage)
+                if cases is not None:
+                    cases[kind].append(case)
+                self._cases[(case.stage, case.case_index)] = (kind, case)
+        for when_info in infos.get("when", []):
+            self._by_stage[when_info.stage] = ("when", (when_info, when_cases[when_info.stage]))
+
+        # 每條邊各記一次 (If 的 then/else 指向同一 stage 時算兩個前驅)
+        for (stage, (stage_type, info)) in self._by_stage.items():
+            succs = self._successors_of(stage_type, info)
+            self.successors[stage] = succs
+            for succ in succs:
+                self.predecessors.setdefault(succ, []).append(stage)
+
+    @staticmethod
+    def _successors_of(stage_type: str, info: Any) -> List[int]:
+        if stage_type == "when":
+            (when_info, cases) = info
+            return [when_info.timeout_stage] + [c.next_stage for kind in cases.values() for c in kind]
+        if stage_type == "if":
+            return [info.then_stage, info.else_stage]
+        if stage_type in ("pay", "let", "assert"):
+            return [info.next_stage]
+        return []
+
+    # --- Mapping ---
+
+    def __getitem__(self, stage: int) -> Tuple[str, Any]:
+        return self._by_stage[stage]
+
+    def __iter__(self):
+        return iter(self._by_stage)
+
+    def __len__(self) -> int:
+        return len(self._by_stage)
+
+    def __contains__(self, stage: object) -> bool:
+        return stage in self._by_stage
+
+    # --- Indexed access ---
+
+    def stage_type(self, stage: int) -> Optional[str]:
+        entry = self._by_stage.get(stage)
+        return entry[0] if entry is not None else None
+
+    def when(self, stage: int) -> Optional[WhenStageInfo]:
+        """WhenStageInfo of `stage`, or None if it is not a When stage"""
+        entry = self._by_stage.get(stage)
+        return entry[1][0] if entry is not None and entry[0] == "when" else None
+
+    def cases_at(self, stage: int) -> Dict[str, List[Any]]:
+        entry = self._by_stage.get(stage)
+        if entry is None or entry[0] != "when":
+            return {kind: [] for kind in CASE_KINDS}
+        return entry[1][1]
+
+    def case(self, stage: int, case_index: int) -> Optional[Tuple[str, Any]]:
+        """(kind, info) of the When case at (stage, case_index)"""
+        return self._cases.get((stage, case_index))
+
+    def of_kind(self, kind: str) -> List[Any]:
+        """Per-kind view (the infos list itself; do not mutate)"""
+        return self.infos.get(kind, [])
+
+
+def as_stage_table(infos: Union[InfosDict, StageTable]) -> StageTable:
+    return infos if isinstance(infos, StageTable) else StageTable(infos)
+
+
+# --------------------------
+# Symbol table: dense u64 ids for on-chain keys
+# --------------------------
+
+SYMBOL_KINDS = ("party", "token", "choice", "value")
+SYMBOL_CONST_PREFIX = {"party": "PARTY", "token": "TOKEN", "choice": "CHOICE", "value": "VALUE"}
+
+
+@dataclass
+class SymbolTable:
+    """Compile-time ids for every party, token (Move type), choice ("name:owner") and Let name."""
+    party: Dict[str, int] = field(default_factory=dict)
+    token: Dict[str, int] = field(default_factory=dict)
+    choice: Dict[str, int] = field(default_factory=dict)
+    value: Dict[str, int] = field(default_factory=dict)
+
+    def intern(self, kind: str, key: str) -> int:
+        table: Dict[str, int] = getattr(self, kind)
+        if key not in table:
+            table[key] = len(table)
+        return table[key]
+
+    def const_name(self, kind: str, key: str) -> str:
+        """Move constant holding the id, e.g. PARTY_0 for "Role(Buyer)"."""
+        table: Dict[str, int] = getattr(self, kind)
+        if key not in table:
+            raise ValueError(f"Unknown {kind} symbol: {key}")
+        return f"{SYMBOL_CONST_PREFIX[kind]}_{table[key]}"
+
+
+def payee_party_str(payee: str) -> str:
+    """Strips the Party(...)/Account(...) wrapper produced by payee_to_str."""
+    for prefix in ("Party(", "Account("):
+        if payee.startswith(prefix) and payee.endswith(")"):
+            return payee[len(prefix):-1]
+    return payee
+
+
+def _collect_expr_symbols(node: Any, symbols: SymbolTable) -> None:
+    if isinstance(node, list):
+        for item in node:
+            _collect_expr_symbols(item, symbols)
+        return
+    if not isinstance(node, dict):
+        return
+    if "available_money" in node:
+        am = node["available_money"]
+        symbols.intern("party", am["party"])
+        symbols.intern("token", marlowe_token_to_move_type(am["token"]))
+        return
+    for key in ("choice_value", "chose_something_for"):
+        if key in node and isinstance(node[key], dict):
+            symbols.intern("choice", f"{node[key]['name']}:{node[key]['owner']}")
+            return
+    if "use_value" in node:
+        symbols.intern("value", node["use_value"])
+        return
+    for child in node.values():
+        _collect_expr_symbols(child, symbols)
+
+
+def build_symbol_table(infos: InfosDict) -> SymbolTable:
+    """Assigns ids in stage order so a fixed contract always yields the same table."""
+    symbols = SymbolTable()
+    items = [item for kind, lst in infos.items() if kind != "unknown" for item in lst]
+    items.sort(key=lambda item: (item.stage, getattr(item, "case_index", -1)))
+    for item in items:
+        if isinstance(item, DepositStageInfo):
+            symbols.intern("party", item.party)
+            symbols.intern("party", item.into_account)
+            symbols.intern("token", item.token_type_str)
+            _collect_expr_symbols(item.value, symbols)
+        elif isinstance(item, PayStageInfo):
+            symbols.intern("party", item.from_account)
+            symbols.intern("party", payee_party_str(item.to))
+            symbols.intern("token", item.token_type_str)
+            _collect_expr_symbols(item.amount, symbols)
+        elif isinstance(item, ChoiceStageInfo):
+            symbols.intern("party", item.by)
+            symbols.intern("choice", f"{item.choice_name}:{item.by}")
+        elif isinstance(item, LetStageInfo):
+            symbols.intern("value", item.name)
+            _collect_expr_symbols(item.value, symbols)
+        elif isinstance(item, NotifyStageInfo):
+            _collect_expr_symbols(item.observation, symbols)
+        elif isinstance(item, AssertStageInfo):
+            _collect_expr_symbols(item.observation, symbols)
+        elif isinstance(item, IfStageInfo):
+            _collect_expr_symbols(item.condition, symbols)
+    return symbols
 
 
 # --------------------------
 # JSON output helper
 # --------------------------
 def infos_to_json(infos: InfosDict) -> str:
-    """使用 dataclasses.asdict 進行序列化"""
+    """淺層轉 dict 後序列化 (欄位已是 JSON primitives，不需 asdict 深拷貝)；binary 形式見 fsm_ir"""
     out = {}
     for k, lst in infos.items():
-        # Ensure item is a dataclass instance before calling asdict
-        out[k] = [asdict(item) for item in lst if hasattr(item, '__dataclass_fields__')]
+        out[k] = [
+            {f.name: getattr(item, f.name) for f in fields(item)}
+            for item in lst if hasattr(item, '__dataclass_fields__')
+        ]
     return json.dumps(out, indent=2, ensure_ascii=False)
 
 
@@ -0,0 +1,200 @@
+"""
+Phase-level instrumentation
+
+The parser, fsm_model, the generators and intent_pipeline report spans into
+one process-wide TimingRegistry:
+
+    phase      e.g. "parse_contract", "write_module", "bpmn_layout"
+    spec       spec being processed (set by spec_scope), None outside one
+    wall_ms    time.perf_counter() delta
+    cpu_ms     time.process_time() delta
+    alloc_kib  net tracemalloc delta (None unless memory tracking is on)
+
+Instrumentation is off by default; traced() / span() then cost one flag
+check. `cli.py --profile` (or MARLOWE_PROFILE=1 for scripts) turns it on;
+with a dump directory, spec_scope also runs cProfile and writes
+<dir>/<spec>.pstats for `python -m pstats`.
+"""
+
+import functools
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+_NULL = nullcontext()
+
+
+@dataclass
+class Span:
+    phase: str
+    spec: Optional[str]
+    wall_ms: float
+    cpu_ms: float
+    alloc_kib: Optional[float] = None
+
+
+@dataclass
+class PhaseTotal:
+    phase: str
+    calls: int = 0
+    wall_ms: float = 0.0
+    cpu_ms: float = 0.0
+    alloc_kib: Optional[float] = None
+
+
+class TimingRegistry:
+    """Collected spans plus the current spec / profiling settings"""
+
+    SPEC_PHASE = "spec"
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.memory = False
+        self.dump_dir: Optional[str] = None
+        self.spec: Optional[str] = None
+        self.spans: List[Span] = []
+
+    def enable(self, memory: bool = False, dump_dir: Optional[str] = None) -> None:
+        self.enabled = True
+        self.dump_dir = dump_dir
+        if memory and not self.memory:
+            import tracemalloc
+
+            tracemalloc.start()
+        self.memory = memory or self.memory
+
+    def reset(self) -> None:
+        self.spans = []
+
+    @contextmanager
+    def _record(self, phase: str) -> Iterator[None]:
+        tracemalloc = None
+        if self.memory:
+            import tracemalloc
+            (alloc_start, _) = tracemalloc.get_traced_memory()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall_ms = (time.perf_counter() - wall_start) * 1000
+            cpu_ms = (time.process_time() - cpu_start) * 1000
+            alloc_kib = None
+            if tracemalloc is not None:
+                alloc_kib = (tracemalloc.get_traced_memory()[0] - alloc_start) / 1024
+            self.spans.append(Span(phase, self.spec, wall_ms, cpu_ms, alloc_kib))
+
+    def span(self, phase: str) -> ContextManager[None]:
+        return self._record(phase) if self.enabled else _NULL
+
+    @contextmanager
+    def spec_scope(self, name: str) -> Iterator[None]:
+        """Attributes nested spans to spec `name` and records its total as a "spec" span"""
+        if not self.enabled or self.spec is not None:
+            yield  # 已在某個 spec 內 (例如 build 內的 BPMN)：沿用外層
+            return
+        profiler = None
+        if self.dump_dir:
+            import cProfile
+
+            profiler = cProfile.Profile()
+        self.spec = name
+        try:
+            with self._record(self.SPEC_PHASE):
+                if profiler is None:
+                    yield
+                else:
+                    profiler.enable()
+                    try:
+                        yield
+                    finally:
+                        profiler.disable()
+        finally:
+            self.spec = None
+            if profiler is not None:
+                os.makedirs(self.dump_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.dump_dir, f"{name}.pstats"))
+
+    # --- Reports ---
+
+    def phase_totals(self) -> List[PhaseTotal]:
+        """Per-phase totals in first-seen order ("spec" spans excluded)"""
+        totals: Dict[str, PhaseTotal] = {}
+        for span in self.spans:
+            if span.phase == self.SPEC_PHASE:
+                continue
+            total = totals.setdefault(span.phase, PhaseTotal(span.phase))
+            total.calls += 1
+            total.wall_ms += span.wall_ms
+            total.cpu_ms += span.cpu_ms
+            if span.alloc_kib is not None:
+                total.alloc_kib = (total.alloc_kib or 0.0) + span.alloc_kib
+        return list(totals.values())
+
+    def slowest_specs(self, limit: int = 5) -> List[Tuple[str, float, Dict[str, float]]]:
+        """(spec, total wall ms, phase -> wall ms) for the slowest specs"""
+        totals: Dict[str, float] = {}
+        phases: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            if span.spec is None:
+                continue
+            if span.phase == self.SPEC_PHASE:
+                totals[span.spec] = totals.get(span.spec, 0.0) + span.wall_ms
+            else:
+                by_phase = phases.setdefault(span.spec, {})
+                by_phase[span.phase] = by_phase.get(span.phase, 0.0) + span.wall_ms
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(spec, wall_ms, phases.get(spec, {})) for (spec, wall_ms) in ranked]
+
+    def format_breakdown(self) -> List[str]:
+        """Plain-text phase breakdown (for scripts without rich)"""
+        lines = [f"{'Phase':<28} {'Calls':>6} {'Wall ms':>10} {'CPU ms':>10} {'Alloc KiB':>10}"]
+        for total in self.phase_totals():
+            alloc = f"{total.alloc_kib:.0f}" if total.alloc_kib is not None else "-"
+            lines.append(f"{total.phase:<28} {total.calls:>6} {total.wall_ms:>10.2f} {total.cpu_ms:>10.2f} {alloc:>10}")
+        for (spec, wall_ms, by_phase) in self.slowest_specs():
+            lines.append(f"{spec}: {wall_ms:.1f} ms ({top_phases(by_phase)})")
+        return lines
+
+
+def top_phases(by_phase: Dict[str, float], limit: int = 3) -> str:
+    ranked = sorted(by_phase.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return ", ".join(f"{phase} {ms:.1f}" for (phase, ms) in ranked)
+
+
+REGISTRY = TimingRegistry()
+
+
+def span(phase: str) -> ContextManager[None]:
+    """Context manager recording `phase` into the process-wide registry (no-op when disabled)"""
+    return REGISTRY.span(phase)
+
+
+def spec_scope(name: str) -> ContextManager[None]:
+    return REGISTRY.spec_scope(name)
+
+
+def traced(phase: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of span()"""
+    def decorate(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not REGISTRY.enabled:
+                return fn(*args, **kwargs)
+            with REGISTRY._record(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def enable_from_env() -> bool:
+    """Turns instrumentation on when MARLOWE_PROFILE is set (MARLOWE_PROFILE_DIR: cProfile dumps)"""
+    if os.environ.get("MARLOWE_PROFILE", "").strip() in ("", "0"):
+        return False
+    REGISTRY.enable(
+        memory=os.environ.get("MARLOWE_PROFILE_MEMORY", "").strip() not in ("", "0"),
+        dump_dir=os.environ.get("MARLOWE_PROFILE_DIR") or None,
+    )
+    return True
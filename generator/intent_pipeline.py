@@ -12,6 +12,9 @@ import tempfile
 from pathlib import Path
 from typing import Any
 
+from instrumentation import REGISTRY, enable_from_env, span, spec_scope, traced
+from token_registry import current_token_registry, registry_path
+
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 SPECS_DIR = ROOT_DIR / "specs"
@@ -32,7 +35,8 @@ def to_role(role_name: str) -> dict[str, str]:
 
 
 def run_json_command(cmd: list[str]) -> tuple[int, Any, str, str]:
-    proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    with span(Path(cmd[1]).stem):  # normalize_input / answer_merge / validate_marlowe_json / lower_to_sui_move
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
     stdout = (proc.stdout or "").strip()
     stderr = (proc.stderr or "").strip()
     parsed: Any = None
@@ -238,6 +242,7 @@ def build_fallback_questions(missing_fields: list[dict[str, str]]) -> list[dict[
     return questions
 
 
+@traced("build_fallback_contract")
 def build_fallback_contract(hints: dict[str, Any]) -> dict[str, Any]:
     roles = extract_roles(hints)
     tokens = extract_tokens(hints)
@@ -513,8 +518,16 @@ def main() -> int:
             guidance: list[str] = []
             msg = lowering_payload.get("message")
             if isinstance(msg, str) and "Could not map Marlowe token to Move type" in msg:
+                registry = current_token_registry()
+                unmapped = [
+                    f"{tok['currency_symbol']}:{tok['token_name']}"
+                    for tok in extract_tokens(hints_payload)
+                    if not registry.can_resolve(tok)
+                ]
+                if unmapped:
+                    guidance.append(f"Unmapped tokens: {', '.join(unmapped)}.")
                 guidance.append(
-                    "Set MARLOWE_TOKEN_MAP_JSON before running. "
+                    f"Add them to {registry_path()} or set MARLOWE_TOKEN_MAP_JSON before running. "
                     'Example: export MARLOWE_TOKEN_MAP_JSON=\'{":USDC":"test::mock_usdc::USDC",":SUI":"sui::sui::SUI"}\'.'
                 )
             print(
@@ -559,4 +572,9 @@ def main() -> int:
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    profiling = enable_from_env()
+    with spec_scope("intent_pipeline"):
+        rc = main()
+    if profiling:
+        print("\n".join(REGISTRY.format_breakdown()), file=sys.stderr)
+    raise SystemExit(rc)
@@ -1,15 +1,93 @@
-from dataclasses import dataclass
-from typing import List, Union
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Generator, List, Tuple, Union
+from weakref import WeakValueDictionary
+
+
+# === Hash-consing ===
+# 所有 AST 節點皆為 frozen + __slots__，並經由 intern table 建構：
+# 結構相同的子樹共用同一個物件，因此 == / hash 只需比對 identity (O(1))，
+# 下游 (fsm_model / bpmn_generator / move_generator) 可直接以節點本身做 memo key。
+
+
+class _Interned(type):
+    """Metaclass: 建構後以 (class, 欄位值) 查表，回傳既有的相同節點"""
+
+    def __call__(cls, *args, **kwargs):
+        node = super().__call__(*args, **kwargs)
+        key = (cls,) + tuple((value.__class__, value) for value in node._values())
+        existing = cls._table.get(key)
+        if existing is not None:
+            return existing
+        cls._table[key] = node
+        return node
+
+
+class Node(metaclass=_Interned):
+    """Base for all AST nodes: immutable, slotted, interned"""
+
+    __slots__ = ()
+    _table: "WeakValueDictionary[Tuple[Any, ...], Node]" = WeakValueDictionary()
+
+    def _values(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, f.name) for f in fields(self))
+
+    def __post_init__(self) -> None:
+        # list 欄位 (When.cases / Choice.bounds) 轉為 tuple，才能 hash 並保持不可變
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if isinstance(value, list):
+                object.__setattr__(self, f.name, tuple(value))
+
+    # identity 即結構相等
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def __reduce__(self):
+        # unpickle 時重新經過 intern table
+        return (self.__class__, self._values())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]):
+        return self
+
+
+def _node(cls):
+    return dataclass(frozen=True, slots=True, weakref_slot=True, eq=False)(cls)
+
+
+# === Traversal ===
+# 深度數千層的合約會超過 Python 的遞迴上限。走訪寫成 generator：
+# 需要子結果時 `result = yield child_frame`，由 run_frames 以明確的 stack 驅動。
+
+Frame = Generator[Any, Any, Any]
+
+
+def run_frames(root: Frame) -> Any:
+    """Runs a frame that yields child frames and receives their return values; returns the root's value"""
+    stack: List[Frame] = [root]
+    result: Any = None
+    while stack:
+        try:
+            child = stack[-1].send(result)
+        except StopIteration as done:
+            stack.pop()
+            result = done.value
+            continue
+        stack.append(child)
+        result = None
+    return result
 
 
 # === Contract Variants ===
-@dataclass
-class Close:
+@_node
+class Close(Node):
     kind: str = "close"
 
 
-@dataclass
-class Pay:
+@_node
+class Pay(Node):
     from_account: "Party"
     to: "Payee"
     token: "Token"
@@ -17,29 +95,29 @@ class Pay:
     then: "Contract"
 
 
-@dataclass
-class If:
+@_node
+class If(Node):
     cond: "Observation"
     then: "Contract"
     else_: "Contract"
 
 
-@dataclass
-class When:
-    cases: List["Case"]
+@_node
+class When(Node):
+    cases: Tuple["Case", ...]
     timeout: int
     timeout_continuation: "Contract"
 
 
-@dataclass
-class Let:
+@_node
+class Let(Node):
     name: str
     value: "Value"
     then: "Contract"
 
 
-@dataclass
-class Assert:
+@_node
+class Assert(Node):
     obs: "Observation"
     then: "Contract"
 
@@ -48,71 +126,71 @@ Contract = Union[Close, Pay, If, When, Let, Assert]
 
 # === Case and Actions ===
 
-@dataclass
-class Bound:
+@_node
+class Bound(Node):
     from_value: int
     to_value: int
 
-@dataclass
-class Deposit:
+@_node
+class Deposit(Node):
     into_account: "Party"
     party: "Party"
     token: "Token"
     amount: "Value"
 
 
-@dataclass
-class Choice:
+@_node
+class Choice(Node):
     choice_id: "ChoiceId"
-    bounds: List[Bound]
+    bounds: Tuple[Bound, ...]
 
 
-@dataclass
-class Notify:
+@_node
+class Notify(Node):
     observation: "Observation"
 
 
 Action = Union[Deposit, Choice, Notify]
 
 
-@dataclass
-class Case:
+@_node
+class Case(Node):
     action: Action
     then: Contract
 
 
-@dataclass
-class ChoiceId:
+@_node
+class ChoiceId(Node):
     name: str
     by: "Party"
 
 
-@dataclass
-class Token:
+@_node
+class Token(Node):
     currency_symbol: str
     token_name: str
 
 
-@dataclass
-class AddressParty:
+@_node
+class AddressParty(Node):
     address: str
 
 
-@dataclass
-class RoleParty:
+@_node
+class RoleParty(Node):
     role_token: str
 
 
 Party = Union[AddressParty, RoleParty]
 
 
-@dataclass
-class AccountPayee:
+@_node
+class AccountPayee(Node):
     account: Party
 
 
-@dataclass
-class PartyPayee:
+@_node
+class PartyPayee(Node):
     party: Party
 
 
@@ -122,68 +200,68 @@ Payee = Union[AccountPayee, PartyPayee]
 # === Value AST 節點 ===
 
 
-@dataclass
-class AvailableMoney:
+@_node
+class AvailableMoney(Node):
     token: "Token"
     party: "Party"
 
 
-@dataclass
-class Constant:
+@_node
+class Constant(Node):
     value: int
 
 
-@dataclass
-class NegValue:
+@_node
+class NegValue(Node):
     value: "Value"
 
 
-@dataclass
-class AddValue:
+@_node
+class AddValue(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class SubValue:
+@_node
+class SubValue(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class MulValue:
+@_node
+class MulValue(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class DivValue:
+@_node
+class DivValue(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class ChoiceValue:
+@_node
+class ChoiceValue(Node):
     choice_id: "ChoiceId"
 
 
-@dataclass
-class TimeIntervalStart:
+@_node
+class TimeIntervalStart(Node):
     pass
 
 
-@dataclass
-class TimeIntervalEnd:
+@_node
+class TimeIntervalEnd(Node):
     pass
 
 
-@dataclass
-class UseValue:
+@_node
+class UseValue(Node):
     value_id: str
 
 
-@dataclass
-class Cond:
+@_node
+class Cond(Node):
     condition: "Observation"
     true_value: "Value"
     false_value: "Value"
@@ -208,65 +286,65 @@ Value = Union[
 # === Observation AST 節點 ===
 
 
-@dataclass
-class AndObs:
+@_node
+class AndObs(Node):
     left: "Observation"
     right: "Observation"
 
 
-@dataclass
-class OrObs:
+@_node
+class OrObs(Node):
     left: "Observation"
     right: "Observation"
 
 
-@dataclass
-class NotObs:
+@_node
+class NotObs(Node):
     obs: "Observation"
 
 
-@dataclass
-class ChoseSomething:
+@_node
+class ChoseSomething(Node):
     choice_id: "ChoiceId"
 
 
-@dataclass
-class ValueGE:
+@_node
+class ValueGE(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class ValueGT:
+@_node
+class ValueGT(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class ValueLT:
+@_node
+class ValueLT(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class ValueLE:
+@_node
+class ValueLE(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class ValueEQ:
+@_node
+class ValueEQ(Node):
     lhs: "Value"
     rhs: "Value"
 
 
-@dataclass
-class TrueObs:
+@_node
+class TrueObs(Node):
     pass
 
 
-@dataclass
-class FalseObs:
+@_node
+class FalseObs(Node):
     pass
 
 
@@ -285,8 +363,8 @@ Observation = Union[
 ]
 
 
-@dataclass
-class Condition:
+@_node
+class Condition(Node):
     op: str
     lhs: Value
     rhs: Value
@@ -1,12 +1,16 @@
+import io
 import json
 import re
-from dataclasses import dataclass
-from typing import Dict, List, Any, Tuple, Optional
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Any, TextIO, Tuple, Optional, Union
 import struct # For pack_u64
 
 # (我們假設 fsm_model.py 已被正確修正，包含 case_index)
 from fsm_model import (
     parse_contract_to_infos,
+    marlowe_token_to_move_type,
     DepositStageInfo,
     PayStageInfo,
     ChoiceStageInfo,
@@ -15,14 +19,21 @@ from fsm_model import (
     LetStageInfo,
     AssertStageInfo,
     WhenStageInfo,
-    CloseStageInfo
+    CloseStageInfo,
+    SymbolTable,
+    SYMBOL_KINDS,
+    build_symbol_table,
+    StageTable,
+    as_stage_table,
 )
+from instrumentation import traced
+from token_registry import current_token_registry
 
 # -----------------------------------------------------------------
 # 1. 建立 Stage 查找表 (Code Generation Helper)
 # -----------------------------------------------------------------
 
-StageLookup = Dict[int, Tuple[str, Any]]
+StageLookup = StageTable
 MAX_U64 = 2**64 - 1
 
 
@@ -32,38 +43,80 @@ class LoweringOptions:
 
     choice_write_policy: str = "set_once"  # "set_once" | "overwrite"
     emit_debug_views: bool = True
+    expr_mode: str = "rpn"  # "rpn" | "native"
+    symbol_keys: bool = False  # u64 ids instead of String keys (requires expr_mode="native")
+    share_continuations: bool = False  # 相同的子合約只產生一次 stage 區塊
+    fold_constants: bool = False  # 先以 optimizer 折疊常數並剪除不可能的分支
+    fuse_auto_stages: bool = False  # 連續的自動 stage (Pay/Let/Assert/If) 融合成單一函式
+    auto_dispatch: str = "call"  # "call" (巢狀直接呼叫) | "trampoline" (run_auto 迴圈分派)
+    bytecode_format: str = "v1"  # "v1" | "compact" (varint 常數 + 字串 const 索引 + 共用 bytecode const)
+    verified_eval: bool = False  # bytecode 已在編譯期驗證，internal_eval 省略逐 op 的 stack underflow 檢查
 
     def normalized(self) -> "LoweringOptions":
         policy = self.choice_write_policy.strip().lower()
         if policy not in ("set_once", "overwrite"):
             raise ValueError(f"Unsupported choice_write_policy: {self.choice_write_policy}")
-        return LoweringOptions(choice_write_policy=policy, emit_debug_views=self.emit_debug_views)
-
+        expr_mode = self.expr_mode.strip().lower()
+        if expr_mode not in ("rpn", "native"):
+            raise ValueError(f"Unsupported expr_mode: {self.expr_mode}")
+        auto_dispatch = self.auto_dispatch.strip().lower()
+        if auto_dispatch not in ("call", "trampoline"):
+            raise ValueError(f"Unsupported auto_dispatch: {self.auto_dispatch}")
+        bytecode_format = self.bytecode_format.strip().lower()
+        if bytecode_format not in ("v1", "compact"):
+            raise ValueError(f"Unsupported bytecode_format: {self.bytecode_format}")
+        if bytecode_format == "compact" and expr_mode != "rpn":
+            raise ValueError("bytecode_format=\"compact\" only applies to expr_mode=\"rpn\"")
+        if self.verified_eval and expr_mode != "rpn":
+            raise ValueError("verified_eval only applies to expr_mode=\"rpn\"")
+        if self.symbol_keys and expr_mode != "native":
+            raise ValueError("symbol_keys requires expr_mode=\"native\" (RPN operands are inline strings)")
+        return LoweringOptions(
+            choice_write_policy=policy,
+            emit_debug_views=self.emit_debug_views,
+            expr_mode=expr_mode,
+            symbol_keys=self.symbol_keys,
+            share_continuations=self.share_continuations,
+            fold_constants=self.fold_constants,
+            fuse_auto_stages=self.fuse_auto_stages,
+            auto_dispatch=auto_dispatch,
+            bytecode_format=bytecode_format,
+            verified_eval=self.verified_eval,
+        )
+
+@traced("build_stage_lookup")
 def build_stage_lookup(infos: Dict[str, List[Any]]) -> StageLookup:
-    """建立 stage 編號到 (type, info) 的查找字典"""
-    lookup: StageLookup = {}
-    for stage_type, info_list in infos.items():
-        if stage_type not in ("when", "deposit", "choice", "notify"):
-            for info in info_list:
-                lookup[info.stage] = (stage_type, info)
-
-    for when_info in infos.get("when", []):
-        when_stage = when_info.stage
-        cases = {
-            "deposit": [d for d in infos.get("deposit", []) if d.stage == when_stage],
-            "choice": [c for c in infos.get("choice", []) if c.stage == when_stage],
-            "notify": [n for n in infos.get("notify", []) if n.stage == when_stage],
-        }
-        lookup[when_stage] = ("when", (when_info, cases))
-
-    return lookup
+    """建立 stage 編號到 (type, info) 的查找表 (fsm_model.StageTable，單趟 O(n) 建表)"""
+    return StageTable(infos)
 
 # -----------------------------------------------------------------
 # 2. 自動化鏈 (Automation Chain) 產生器
 # -----------------------------------------------------------------
 
-def generate_automation_tail(next_stage: int, stage_lookup: StageLookup) -> str:
+def tail_dispatch(options: "LoweringOptions", in_auto_stage: bool) -> str:
+    """
+    決定自動 stage 的推進方式:
+    - "call": 直接巢狀呼叫下一個 internal_*_stage_N
+    - "trampoline": 入口函式寫入 stage 後啟動 run_auto 迴圈
+    - "loop": 已在 run_auto 迴圈內，只需寫入 stage 交回分派
+    """
+    if options.auto_dispatch != "trampoline":
+        return "call"
+    return "loop" if in_auto_stage else "trampoline"
+
+
+def generate_automation_tail(
+    next_stage: int,
+    stage_lookup: StageLookup,
+    fusion: Optional["FusionPlan"] = None,
+    dispatch: str = "call",
+) -> str:
     """產生函式結尾的程式碼 (自動呼叫或更新 stage)"""
+    if fusion is not None and next_stage in fusion.inlined:
+        (next_type, next_info) = stage_lookup[next_stage]
+        body = AUTO_STAGE_BODIES[next_type](next_info, stage_lookup, fusion.options, fusion.symbols, fusion, fusion.pool)
+        return f"\n        // 融合 stage {next_stage} ({next_type})：同一交易內直接執行，不寫入中間 stage{body}\n"
+
     if next_stage not in stage_lookup:
         prev_stage_info = stage_lookup.get(next_stage - 1)
         if prev_stage_info and prev_stage_info[0] == 'close':
@@ -75,11 +128,68 @@ def generate_automation_tail(next_stage: int, stage_lookup: StageLookup) -> str:
     (next_type, next_info) = stage_lookup[next_stage]
 
     if next_type in ("pay", "let", "assert", "if"):
+        if dispatch == "loop":
+            return f"\n        // 交回 run_auto 分派下一個自動 stage\n        contract.stage = {next_stage};\n"
+        if dispatch == "trampoline":
+            return f"\n        // 自動呼叫鏈：交由 run_auto 迴圈依序執行 (不巢狀呼叫)\n        contract.stage = {next_stage};\n        run_auto(contract, ctx);\n"
         fn_name = f"internal_{next_type}_stage_{next_stage}"
         return f"\n        // 自動呼叫鏈：執行下一個自動 stage\n        contract.stage = {next_stage};\n        {fn_name}(contract, ctx);\n"
     else: # ("when", "close")
         return f"\n        // 結束：更新 stage 並等待下一個交易\n       contract.stage = {next_stage};\n    "
 
+# -----------------------------------------------------------------
+# 2b. 自動 stage 融合 (Basic-block fusion)
+# -----------------------------------------------------------------
+
+AUTO_STAGE_TYPES = ("pay", "let", "assert", "if")
+# 每個融合函式最多內聯的連續 stage 數；更長的鏈每隔這麼多個 stage 重新開一個函式
+# (產生器以遞迴展開內聯的 stage，也避免單一 Move 函式過大)
+MAX_FUSED_DEPTH = 64
+
+
+@dataclass(frozen=True)
+class FusionPlan:
+    """Automatic stages that are inlined into their only (automatic) predecessor."""
+
+    inlined: FrozenSet[int]
+    options: "LoweringOptions"
+    symbols: Optional[SymbolTable] = None
+    pool: Optional["BytecodePool"] = None
+
+
+def plan_stage_fusion(
+    stage_lookup: StageLookup,
+    options: "LoweringOptions",
+    symbols: Optional[SymbolTable] = None,
+    pool: Optional["BytecodePool"] = None,
+) -> FusionPlan:
+    """
+    找出可以內聯的自動 stage：只有一個前驅且前驅也是自動 stage。
+    這些 stage 的 contract.stage 寫入與 E_WRONG_STAGE 檢查在交易外無法被觀察到，可以省略。
+    """
+    predecessors = stage_lookup.predecessors
+    candidates = {
+        stage
+        for (stage, (stage_type, info)) in stage_lookup.items()
+        if stage_type in AUTO_STAGE_TYPES
+        and len(predecessors.get(stage, [])) == 1
+        and stage_lookup.stage_type(predecessors[stage][0]) in AUTO_STAGE_TYPES
+        and not (stage_type == "pay" and pay_stage_error(info) is not None)
+    }
+    # 內聯深度 = 往前連續幾個 candidate；候選只有單一前驅，沿前驅走即可
+    depth: Dict[int, int] = {}
+    for stage in sorted(candidates):
+        chain = []
+        while stage in candidates and stage not in depth:
+            chain.append(stage)
+            stage = predecessors[stage][0]
+        base = depth.get(stage, 0)
+        for stage in reversed(chain):
+            base = 0 if base + 1 >= MAX_FUSED_DEPTH else base + 1
+            depth[stage] = base
+    inlined = frozenset(stage for stage in candidates if depth[stage] > 0)
+    return FusionPlan(inlined=inlined, options=options, symbols=symbols, pool=pool)
+
 # -----------------------------------------------------------------
 # 3. Move 模組和輔助函式 (Boilerplate)
 # -----------------------------------------------------------------
@@ -89,55 +199,63 @@ def generate_module_header(
     token_name_bytes: str,
     module_name: str = "generated_marlowe",
     options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
+    pool: Optional["BytecodePool"] = None,
 ) -> str:
     """產生 Move 模組標頭，包含狀態讀取 Helper"""
     options = (options or LoweringOptions()).normalized()
+    if options.symbol_keys and symbols is None:
+        raise ValueError("symbol_keys lowering needs the contract SymbolTable")
+
+    # On-chain key type and RoleNFT identity field (String names vs compact u64 ids)
+    key_t = "u64" if symbols else "String"
+    role_field, role_field_t = ("role", "u64") if symbols else ("name", "String")
 
     pay_has_roles = any(p.to.startswith("Role(") or p.from_account.startswith("Role(") for p in infos.get("pay", []))
     deposit_has_roles = any(p.party.startswith("Role(") or p.into_account.startswith("Role(") for p in infos.get("deposit", []))
     choice_has_roles = any(c.by.startswith("Role(") for c in infos.get("choice", []))
     has_roles = pay_has_roles or deposit_has_roles or choice_has_roles
 
-    role_struct = """
-    struct RoleNFT has key, store {
+    role_struct = f"""
+    struct RoleNFT has key, store {{
         id: UID,
         contract_id: ID,
-        name: String
-    }
+        {role_field}: {role_field_t}
+    }}
     
-    struct AdminCap has key, store {
+    struct AdminCap has key, store {{
         id: UID
-    }
+    }}
     """ if has_roles else ""
 
-    role_helpers = """
-    fun assert_role(contract: &Contract, role_nft: &RoleNFT, expected_name: String) {
+    role_helpers = f"""
+    fun assert_role(contract: &Contract, role_nft: &RoleNFT, expected_{role_field}: {role_field_t}) {{
         assert!(role_nft.contract_id == object::id(contract), E_INVALID_ROLE_NFT);
-        assert!(role_nft.name == expected_name, E_WRONG_ROLE);
-    }
+        assert!(role_nft.{role_field} == expected_{role_field}, E_WRONG_ROLE);
+    }}
     
     /// @dev Only Admin can mint roles
     public fun mint_role(
         _: &AdminCap,
         contract: &mut Contract,
-        name: String,
+        {role_field}: {role_field_t},
         recipient: address,
         ctx: &mut TxContext
-    ) {
+    ) {{
         // Keep Role(name) -> recipient synchronized for Pay-to-Role flows.
-        if (table::contains(&contract.role_registry, name)) {
-            *table::borrow_mut(&mut contract.role_registry, name) = recipient;
-        } else {
-            table::add(&mut contract.role_registry, name, recipient);
-        };
+        if (table::contains(&contract.role_registry, {role_field})) {{
+            *table::borrow_mut(&mut contract.role_registry, {role_field}) = recipient;
+        }} else {{
+            table::add(&mut contract.role_registry, {role_field}, recipient);
+        }};
 
-        let role_nft = RoleNFT {
+        let role_nft = RoleNFT {{
             id: object::new(ctx),
             contract_id: object::id(contract),
-            name
-        };
+            {role_field}
+        }};
         transfer::public_transfer(role_nft, recipient);
-    }
+    }}
     """ if has_roles else ""
 
     debug_views = """
@@ -157,7 +275,298 @@ def generate_module_header(
         string::append(&mut choice_name, owner);
         internal_get_choice(contract, choice_name)
     }
-    """ if options.emit_debug_views else ""
+    """
+    if symbols:
+        debug_views = """
+    // --- Debug/View Helpers ---
+    public fun get_current_stage(contract: &Contract): u64 {
+        contract.stage
+    }
+
+    public fun has_choice_value(contract: &Contract, choice: u64): bool {
+        internal_has_choice(contract, choice)
+    }
+
+    public fun get_choice_value_or_zero(contract: &Contract, choice: u64): u64 {
+        internal_get_choice(contract, choice)
+    }
+    """
+    if not options.emit_debug_views:
+        debug_views = ""
+
+    symbol_consts = ""
+    if symbols:
+        lines = ["    // --- Symbol Table (compile-time ids) ---"]
+        for kind in SYMBOL_KINDS:
+            for key in getattr(symbols, kind):
+                lines.append(f"    const {symbols.const_name(kind, key)}: u64 = {getattr(symbols, kind)[key]}; // {key}")
+        symbol_consts = "\n".join(lines) + "\n"
+
+    if symbols:
+        deposit_sig = "contract: &mut Contract, party: u64, token: u64, coin: Coin<T>, ctx: &mut TxContext"
+        pay_sig = "contract: &mut Contract, src: u64, token: u64, recipient: address, amt: u64, ctx: &mut TxContext"
+        token_key_code = ""
+        withdraw_party_code = """        // 2. Role id 即 Party id
+        let party_key = role_nft.role;
+"""
+        withdraw_token_param = "\n        token: u64,"
+        withdraw_pay_args = "party_key, token"
+    else:
+        deposit_sig = "contract: &mut Contract, party: String, coin: Coin<T>, ctx: &mut TxContext"
+        pay_sig = "contract: &mut Contract, src: String, recipient: address, amt: u64, ctx: &mut TxContext"
+        token_key_code = """        let name = type_name::get<T>();
+        let token = string::from_ascii(type_name::into_string(name));
+"""
+        withdraw_party_code = """        // 2. 建構 Party Key: "Role(Name)"
+        let party_key = string::utf8(b"Role(");
+        string::append(&mut party_key, role_nft.name);
+        string::append(&mut party_key, string::utf8(b")"));
+"""
+        withdraw_token_param = ""
+        withdraw_pay_args = "party_key"
+
+    rpn_opcodes = """    // --- Opcodes (RPN) ---
+    const OP_ZW: u8 = 0;
+    const OP_TRUE: u8 = 1;
+    const OP_CONST: u8 = 2; // +8 bytes u64
+    const OP_ADD: u8 = 3;
+    const OP_SUB: u8 = 4;   // Saturating Subtraction
+    const OP_MUL: u8 = 5;
+    const OP_DIV: u8 = 6;   // Safe Div
+    const OP_NEG: u8 = 7;
+    const OP_GET_ACC: u8 = 10; // +len +bytes +len +bytes
+    const OP_GET_CHOICE: u8 = 11; // +len +bytes
+    const OP_USE_VAL: u8 = 12; // +len +bytes
+    const OP_HAS_CHOICE: u8 = 13; // +len +bytes -> bool(u64)
+    const OP_TIME_START: u8 = 20;
+    const OP_TIME_END: u8 = 21;
+    const OP_GT: u8 = 30;
+    const OP_GE: u8 = 31;
+    const OP_EQ: u8 = 32;
+    const OP_LT: u8 = 33;
+    const OP_LE: u8 = 34;
+    const OP_AND: u8 = 40;
+    const OP_OR: u8 = 41;
+    const OP_NOT: u8 = 42;
+    const OP_CJUMP: u8 = 50; // +2 bytes length
+    const OP_DUP: u8 = 60;
+""" if options.expr_mode == "rpn" else ""
+    if options.bytecode_format == "compact":
+        pool = pool or BytecodePool()
+        v1_only = ("OP_CONST:", "OP_GET_ACC:", "OP_GET_CHOICE:", "OP_USE_VAL:", "OP_HAS_CHOICE:")
+        opcode_lines = [line for line in rpn_opcodes.splitlines(keepends=True) if not any(op in line for op in v1_only)]
+        opcode_lines.append("    const OP_VCONST: u8 = 9; // +varint u64\n")
+        if pool.strings:
+            opcode_lines.append("""    const OP_GET_ACC_IDX: u8 = 14; // +varint party idx +varint token idx
+    const OP_GET_CHOICE_IDX: u8 = 15; // +varint idx
+    const OP_USE_VAL_IDX: u8 = 16; // +varint idx
+    const OP_HAS_CHOICE_IDX: u8 = 17; // +varint idx -> bool(u64)
+""")
+        rpn_opcodes = "".join(opcode_lines) + pool.move_consts()
+
+    if options.expr_mode == "native" and symbols:
+        expr_helpers = """    // --- Native Expression Helpers ---
+
+    fun internal_sat_sub(lhs: u64, rhs: u64): u64 {
+        if (rhs > lhs) { 0 } else { lhs - rhs }
+    }
+
+    fun internal_safe_div(lhs: u64, rhs: u64): u64 {
+        if (rhs == 0) { 0 } else { lhs / rhs }
+    }
+
+"""
+    elif options.expr_mode == "native":
+        expr_helpers = """    // --- Native Expression Helpers ---
+
+    fun internal_available_money<T>(contract: &Contract, party: String): u64 {
+        let token = string::from_ascii(type_name::into_string(type_name::get<T>()));
+        internal_get_balance(contract, party, token)
+    }
+
+    fun internal_sat_sub(lhs: u64, rhs: u64): u64 {
+        if (rhs > lhs) { 0 } else { lhs - rhs }
+    }
+
+    fun internal_safe_div(lhs: u64, rhs: u64): u64 {
+        if (rhs == 0) { 0 } else { lhs / rhs }
+    }
+
+"""
+    else:
+        rpn_eval_banner = "    // --- RPN Eval Helper ---\n\n"
+        rpn_eval_support = ""
+        rpn_eval_head = """    {eval_doc}
+    fun internal_eval(contract: &Contract, bytecode: vector<u8>, ctx: &TxContext): u64 {
+        let stack = vector::empty<u64>();
+        let i: u64 = 0;
+        let len = vector::length(&bytecode);
+
+        while (i < len) {
+            let op = *vector::borrow(&bytecode, i);
+            i = i + 1;
+
+            if (op == OP_ZW) {
+                // No-op or False (0)
+                vector::push_back(&mut stack, 0);
+            } else if (op == OP_TRUE) {
+                vector::push_back(&mut stack, 1);
+"""
+        rpn_const_ops = """            } else if (op == OP_CONST) {
+                // 8 bytes Big-Endian
+                let val: u64 = 0;
+                let k = 0;
+                while (k < 8) {
+                    val = (val << 8) | ((*vector::borrow(&bytecode, i + k) as u64));
+                    k = k + 1;
+                };
+                vector::push_back(&mut stack, val);
+                i = i + 8;
+"""
+        rpn_arith_ops = """            } else if (op == OP_ADD) {
+                {check 2}
+                let rhs = vector::pop_back(&mut stack);
+                let lhs = vector::pop_back(&mut stack);
+                vector::push_back(&mut stack, lhs + rhs);
+            } else if (op == OP_SUB) {
+                {check 2}
+                let rhs = vector::pop_back(&mut stack);
+                let lhs = vector::pop_back(&mut stack);
+                if (rhs > lhs) {
+                     vector::push_back(&mut stack, 0);
+                } else {
+                     vector::push_back(&mut stack, lhs - rhs);
+                };
+            } else if (op == OP_MUL) {
+                {check 2}
+                let rhs = vector::pop_back(&mut stack);
+                let lhs = vector::pop_back(&mut stack);
+                vector::push_back(&mut stack, lhs * rhs);
+            } else if (op == OP_DIV) {
+                {check 2}
+                let rhs = vector::pop_back(&mut stack);
+                let lhs = vector::pop_back(&mut stack);
+                // Safe Division
+                if (rhs == 0) {
+                    vector::push_back(&mut stack, 0);
+                } else {
+                    vector::push_back(&mut stack, lhs / rhs);
+                };
+            } else if (op == OP_NEG) {
+                 {check 1}
+                 // Negate (For now just push 0 or -x, but u64 is unsigned)
+                 // Note: u64 is unsigned, so negation is not supported in this MVP.
+                 let _val = vector::pop_back(&mut stack);
+                 vector::push_back(&mut stack, 0);
+"""
+        rpn_string_ops = """            } else if (op == OP_GET_ACC) {
+                // Format: [len, string_bytes..., len, string_bytes...]
+                // Helper to read string from bytecode
+                let p_len = (*vector::borrow(&bytecode, i) as u64);
+                i = i + 1;
+                let party_bytes = vector::empty<u8>();
+                let k = 0;
+                while (k < p_len) { vector::push_back(&mut party_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; };
+                i = i + p_len;
+
+                let t_len = (*vector::borrow(&bytecode, i) as u64);
+                i = i + 1;
+                let token_bytes = vector::empty<u8>();
+                k = 0;
+                while (k < t_len) { vector::push_back(&mut token_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; };
+                i = i + t_len;
+
+                let val = internal_get_balance(contract, string::utf8(party_bytes), string::utf8(token_bytes));
+                vector::push_back(&mut stack, val);
+
+            } else if (op == OP_GET_CHOICE) {
+                let c_len = (*vector::borrow(&bytecode, i) as u64);
+                i = i + 1;
+                let choice_bytes = vector::empty<u8>();
+                let k = 0;
+                while (k < c_len) { vector::push_back(&mut choice_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; };
+                i = i + c_len;
+                let val = internal_get_choice(contract, string::utf8(choice_bytes));
+                vector::push_back(&mut stack, val);
+            } else if (op == OP_HAS_CHOICE) {
+                let c_len = (*vector::borrow(&bytecode, i) as u64);
+                i = i + 1;
+                let choice_bytes = vector::empty<u8>();
+                let k = 0;
+                while (k < c_len) { vector::push_back(&mut choice_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; };
+                i = i + c_len;
+                let has_val = internal_has_choice(contract, string::utf8(choice_bytes));
+                vector::push_back(&mut stack, if (has_val) 1 else 0);
+            } else if (op == OP_USE_VAL) {
+                let v_len = (*vector::borrow(&bytecode, i) as u64);
+                i = i + 1;
+                let use_bytes = vector::empty<u8>();
+                let k = 0;
+                while (k < v_len) { vector::push_back(&mut use_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; };
+                i = i + v_len;
+                let val = internal_get_bound_value(contract, string::utf8(use_bytes));
+                vector::push_back(&mut stack, val);
+"""
+        rpn_eval_tail = """            } else if (op == OP_TIME_START) {
+                vector::push_back(&mut stack, tx_context::epoch_timestamp_ms(ctx));
+            } else if (op == OP_TIME_END) {
+                vector::push_back(&mut stack, tx_context::epoch_timestamp_ms(ctx)); // Sim
+            } else if (op == OP_NOT) {
+                 {check 1}
+                 let lhs = vector::pop_back(&mut stack);
+                 vector::push_back(&mut stack, if (lhs == 0) 1 else 0);
+            } else if (op == OP_CJUMP) {
+                 {check 1}
+                 let cond = vector::pop_back(&mut stack);
+                 // Read 2 bytes length (Big Endian)
+                 let jmp_len: u64 = 0;
+                 jmp_len = (jmp_len << 8) | ((*vector::borrow(&bytecode, i) as u64));
+                 jmp_len = (jmp_len << 8) | ((*vector::borrow(&bytecode, i+1) as u64));
+                 i = i + 2;
+
+                 if (cond == 0) {
+                     // Jump (Skip 'Then' block)
+                     i = i + jmp_len;
+                 };
+                 // Else: Continue execution (Enter 'Then')
+            } else if (op == OP_DUP) {
+                 {check 1}
+                 let top = *vector::borrow(&stack, vector::length(&stack) - 1);
+                 vector::push_back(&mut stack, top);
+            } else {
+                 // Comparisons (GT, GE, etc)
+                 {check 2}
+                 let rhs = vector::pop_back(&mut stack);
+                 let lhs = vector::pop_back(&mut stack);
+                 let res = if (op == OP_GT) { if (lhs > rhs) 1 else 0 }
+                 else if (op == OP_GE) { if (lhs >= rhs) 1 else 0 }
+                 else if (op == OP_EQ) { if (lhs == rhs) 1 else 0 }
+                 else if (op == OP_LT) { if (lhs < rhs) 1 else 0 }
+                 else if (op == OP_LE) { if (lhs <= rhs) 1 else 0 }
+                 else if (op == OP_AND) { if (lhs > 0 && rhs > 0) 1 else 0 }
+                 else if (op == OP_OR) { if (lhs > 0 || rhs > 0) 1 else 0 }
+                 else { 0 };
+                 vector::push_back(&mut stack, res);
+            };
+        };
+
+        {result}
+    }
+
+"""
+        if options.bytecode_format == "compact":
+            # compact 編碼只會出現 varint 常數與字串表索引，不需要 v1 的 8-byte / inline 字串解碼
+            rpn_const_ops = COMPACT_CONST_OPS
+            rpn_string_ops = ""
+            rpn_eval_support = COMPACT_VARINT_HELPER
+            if pool is not None and pool.strings:
+                rpn_string_ops = COMPACT_STRING_OPS
+                rpn_eval_support += pool.move_string_lookup()
+        expr_helpers = _render_eval(
+            rpn_eval_head + rpn_const_ops + rpn_arith_ops + rpn_string_ops + rpn_eval_tail,
+            options.verified_eval,
+        )
+        expr_helpers = rpn_eval_banner + rpn_eval_support + expr_helpers
 
     return f"""
 module test::{module_name} {{
@@ -187,39 +596,18 @@ module test::{module_name} {{
     const E_TIMEOUT_PASSED: u64 = 12;
     const E_CHOICE_ALREADY_MADE: u64 = 13;
 
-    // --- Opcodes (RPN) ---
-    const OP_ZW: u8 = 0;
-    const OP_TRUE: u8 = 1;
-    const OP_CONST: u8 = 2; // +8 bytes u64
-    const OP_ADD: u8 = 3;
-    const OP_SUB: u8 = 4;   // Saturating Subtraction
-    const OP_MUL: u8 = 5;
-    const OP_DIV: u8 = 6;   // Safe Div
-    const OP_NEG: u8 = 7;
-    const OP_GET_ACC: u8 = 10; // +len +bytes +len +bytes
-    const OP_GET_CHOICE: u8 = 11; // +len +bytes
-    const OP_USE_VAL: u8 = 12; // +len +bytes
-    const OP_HAS_CHOICE: u8 = 13; // +len +bytes -> bool(u64)
-    const OP_TIME_START: u8 = 20;
-    const OP_TIME_END: u8 = 21;
-    const OP_GT: u8 = 30;
-    const OP_GE: u8 = 31;
-    const OP_AND: u8 = 40;
-    const OP_OR: u8 = 41;
-    const OP_NOT: u8 = 42;
-    const OP_CJUMP: u8 = 50; // +2 bytes length
-
+{symbol_consts}{rpn_opcodes}
 
     {role_struct}
 
     struct Contract has key {{
         id: UID,
         stage: u64,
-        accounts: Table<String, Table<String, u64>>,
-        vaults: Bag, // Key: TypeName, Value: Balance<T>
-        role_registry: Table<String, address>,
-        choices: Table<String, u64>,
-        bound_values: Table<String, u64>
+        accounts: Table<{key_t}, Table<{key_t}, u64>>,
+        vaults: Bag, // Key: {'token id' if symbols else 'TypeName'}, Value: Balance<T>
+        role_registry: Table<{key_t}, address>,
+        choices: Table<{key_t}, u64>,
+        bound_values: Table<{key_t}, u64>
     }}
 
     fun init(ctx: &mut TxContext) {{
@@ -246,18 +634,18 @@ module test::{module_name} {{
     }}
 
     #[test_only]
-    public fun mint_role_for_testing(contract: &mut Contract, name: String, recipient: address, ctx: &mut TxContext) {{
+    public fun mint_role_for_testing(contract: &mut Contract, {role_field}: {role_field_t}, recipient: address, ctx: &mut TxContext) {{
         // Keep Role(name) -> recipient synchronized for Pay-to-Role flows.
-        if (table::contains(&contract.role_registry, name)) {{
-            *table::borrow_mut(&mut contract.role_registry, name) = recipient;
+        if (table::contains(&contract.role_registry, {role_field})) {{
+            *table::borrow_mut(&mut contract.role_registry, {role_field}) = recipient;
         }} else {{
-            table::add(&mut contract.role_registry, name, recipient);
+            table::add(&mut contract.role_registry, {role_field}, recipient);
         }};
 
         let role_nft = RoleNFT {{
             id: object::new(ctx),
             contract_id: object::id(contract),
-            name
+            {role_field}
         }};
         transfer::public_transfer(role_nft, recipient);
     }}
@@ -266,7 +654,7 @@ module test::{module_name} {{
 
     // --- State Access Helpers (For generated expressions) ---
     
-    fun internal_get_balance(contract: &Contract, party: String, token: String): u64 {{
+    fun internal_get_balance(contract: &Contract, party: {key_t}, token: {key_t}): u64 {{
         if (table::contains(&contract.accounts, party)) {{
             let party_book = table::borrow(&contract.accounts, party);
             if (table::contains(party_book, token)) {{
@@ -275,17 +663,17 @@ module test::{module_name} {{
         }} else {{ 0 }}
     }}
 
-    fun internal_get_choice(contract: &Contract, choice_key: String): u64 {{
+    fun internal_get_choice(contract: &Contract, choice_key: {key_t}): u64 {{
         if (table::contains(&contract.choices, choice_key)) {{
             *table::borrow(&contract.choices, choice_key)
         }} else {{ 0 }}
     }}
 
-    fun internal_has_choice(contract: &Contract, choice_key: String): bool {{
+    fun internal_has_choice(contract: &Contract, choice_key: {key_t}): bool {{
         table::contains(&contract.choices, choice_key)
     }}
 
-    fun internal_get_bound_value(contract: &Contract, value_id: String): u64 {{
+    fun internal_get_bound_value(contract: &Contract, value_id: {key_t}): u64 {{
         if (table::contains(&contract.bound_values, value_id)) {{
             *table::borrow(&contract.bound_values, value_id)
         }} else {{ 0 }}
@@ -295,15 +683,13 @@ module test::{module_name} {{
 
     // --- Core Logic Helpers ---
 
-    fun internal_deposit<T>(contract: &mut Contract, party: String, coin: Coin<T>, ctx: &mut TxContext) {{
-        let name = type_name::get<T>();
-        let token = string::from_ascii(type_name::into_string(name));
-        let amount = coin::value(&coin);
+    fun internal_deposit<T>({deposit_sig}) {{
+{token_key_code}        let amount = coin::value(&coin);
         
         if (!bag::contains(&contract.vaults, token)) {{
             bag::add(&mut contract.vaults, token, coin::into_balance(coin));
         }} else {{
-            let vault = bag::borrow_mut<String, Balance<T>>(&mut contract.vaults, token);
+            let vault = bag::borrow_mut<{key_t}, Balance<T>>(&mut contract.vaults, token);
             balance::join(vault, coin::into_balance(coin));
         }};
         
@@ -319,188 +705,35 @@ module test::{module_name} {{
         }};
     }}
 
-    fun internal_pay<T>(contract: &mut Contract, src: String, recipient: address, amt: u64, ctx: &mut TxContext) {{
-        let name = type_name::get<T>();
-        let token = string::from_ascii(type_name::into_string(name));
-        
+    fun internal_pay<T>({pay_sig}) {{
+{token_key_code}        
         // Partial Payment Logic
         if (!table::contains(&contract.accounts, src)) {{
             return
         }};
-        let accs = table::borrow_mut(&mut contract.accounts, src);
-        
-        if (!table::contains(accs, token)) {{
-            return
-        }};
-
-        let b = table::borrow_mut(accs, token);
-        let available = *b;
-        
-        let pay_amt = if (available >= amt) {{ amt }} else {{ available }};
-
-        if (pay_amt > 0) {{
-            // Deduct Logic Balance
-            *b = available - pay_amt;
-
-            // Deduct Actual Vault
-            let vault = bag::borrow_mut<String, Balance<T>>(&mut contract.vaults, token);
-            assert!(balance::value(vault) >= pay_amt, E_INSUFFICIENT_FUNDS); 
-            transfer::public_transfer(coin::from_balance(balance::split(vault, pay_amt), ctx), recipient);
-        }};
-    }}
-
-    // --- RPN Eval Helper ---
-
-    fun internal_eval(contract: &Contract, bytecode: vector<u8>, ctx: &TxContext): u64 {{
-        let stack = vector::empty<u64>();
-        let i: u64 = 0;
-        let len = vector::length(&bytecode);
-
-        while (i < len) {{
-            let op = *vector::borrow(&bytecode, i);
-            i = i + 1;
-
-            if (op == OP_ZW) {{
-                // No-op or False (0)
-                vector::push_back(&mut stack, 0);
-            }} else if (op == OP_TRUE) {{
-                vector::push_back(&mut stack, 1);
-            }} else if (op == OP_CONST) {{
-                // 8 bytes Big-Endian
-                let val: u64 = 0;
-                let k = 0;
-                while (k < 8) {{
-                    val = (val << 8) | ((*vector::borrow(&bytecode, i + k) as u64));
-                    k = k + 1;
-                }};
-                vector::push_back(&mut stack, val);
-                i = i + 8;
-            }} else if (op == OP_ADD) {{
-                assert!(vector::length(&stack) >= 2, E_STACK_UNDERFLOW);
-                let rhs = vector::pop_back(&mut stack);
-                let lhs = vector::pop_back(&mut stack);
-                vector::push_back(&mut stack, lhs + rhs);
-            }} else if (op == OP_SUB) {{
-                assert!(vector::length(&stack) >= 2, E_STACK_UNDERFLOW);
-                let rhs = vector::pop_back(&mut stack);
-                let lhs = vector::pop_back(&mut stack);
-                if (rhs > lhs) {{
-                     vector::push_back(&mut stack, 0);
-                }} else {{
-                     vector::push_back(&mut stack, lhs - rhs);
-                }};
-            }} else if (op == OP_MUL) {{
-                assert!(vector::length(&stack) >= 2, E_STACK_UNDERFLOW);
-                let rhs = vector::pop_back(&mut stack);
-                let lhs = vector::pop_back(&mut stack);
-                vector::push_back(&mut stack, lhs * rhs);
-            }} else if (op == OP_DIV) {{
-                assert!(vector::length(&stack) >= 2, E_STACK_UNDERFLOW);
-                let rhs = vector::pop_back(&mut stack);
-                let lhs = vector::pop_back(&mut stack);
-                // Safe Division
-                if (rhs == 0) {{
-                    vector::push_back(&mut stack, 0);
-                }} else {{
-                    vector::push_back(&mut stack, lhs / rhs);
-                }};
-            }} else if (op == OP_NEG) {{
-                 assert!(vector::length(&stack) >= 1, E_STACK_UNDERFLOW);
-                 // Negate (For now just push 0 or -x, but u64 is unsigned)
-                 // Note: u64 is unsigned, so negation is not supported in this MVP.
-                 let _val = vector::pop_back(&mut stack);
-                 vector::push_back(&mut stack, 0);
-            }} else if (op == OP_GET_ACC) {{
-                // Format: [len, string_bytes..., len, string_bytes...]
-                // Helper to read string from bytecode
-                let p_len = (*vector::borrow(&bytecode, i) as u64);
-                i = i + 1;
-                let party_bytes = vector::empty<u8>();
-                let k = 0;
-                while (k < p_len) {{ vector::push_back(&mut party_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; }};
-                i = i + p_len;
-
-                let t_len = (*vector::borrow(&bytecode, i) as u64);
-                i = i + 1;
-                let token_bytes = vector::empty<u8>();
-                k = 0;
-                while (k < t_len) {{ vector::push_back(&mut token_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; }};
-                i = i + t_len;
-
-                let val = internal_get_balance(contract, string::utf8(party_bytes), string::utf8(token_bytes));
-                vector::push_back(&mut stack, val);
-
-            }} else if (op == OP_GET_CHOICE) {{
-                let c_len = (*vector::borrow(&bytecode, i) as u64);
-                i = i + 1;
-                let choice_bytes = vector::empty<u8>();
-                let k = 0;
-                while (k < c_len) {{ vector::push_back(&mut choice_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; }};
-                i = i + c_len;
-                let val = internal_get_choice(contract, string::utf8(choice_bytes));
-                vector::push_back(&mut stack, val);
-            }} else if (op == OP_HAS_CHOICE) {{
-                let c_len = (*vector::borrow(&bytecode, i) as u64);
-                i = i + 1;
-                let choice_bytes = vector::empty<u8>();
-                let k = 0;
-                while (k < c_len) {{ vector::push_back(&mut choice_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; }};
-                i = i + c_len;
-                let has_val = internal_has_choice(contract, string::utf8(choice_bytes));
-                vector::push_back(&mut stack, if (has_val) 1 else 0);
-            }} else if (op == OP_USE_VAL) {{
-                let v_len = (*vector::borrow(&bytecode, i) as u64);
-                i = i + 1;
-                let use_bytes = vector::empty<u8>();
-                let k = 0;
-                while (k < v_len) {{ vector::push_back(&mut use_bytes, *vector::borrow(&bytecode, i+k)); k = k + 1; }};
-                i = i + v_len;
-                let val = internal_get_bound_value(contract, string::utf8(use_bytes));
-                vector::push_back(&mut stack, val);
-            }} else if (op == OP_TIME_START) {{
-                vector::push_back(&mut stack, tx_context::epoch_timestamp_ms(ctx));
-            }} else if (op == OP_TIME_END) {{
-                vector::push_back(&mut stack, tx_context::epoch_timestamp_ms(ctx)); // Sim
-            }} else if (op == OP_NOT) {{
-                 assert!(vector::length(&stack) >= 1, E_STACK_UNDERFLOW);
-                 let lhs = vector::pop_back(&mut stack);
-                 vector::push_back(&mut stack, if (lhs == 0) 1 else 0);
-            }} else if (op == OP_CJUMP) {{
-                 assert!(vector::length(&stack) >= 1, E_STACK_UNDERFLOW);
-                 let cond = vector::pop_back(&mut stack);
-                 // Read 2 bytes length (Big Endian)
-                 let jmp_len: u64 = 0;
-                 jmp_len = (jmp_len << 8) | ((*vector::borrow(&bytecode, i) as u64));
-                 jmp_len = (jmp_len << 8) | ((*vector::borrow(&bytecode, i+1) as u64));
-                 i = i + 2;
-
-                 if (cond == 0) {{
-                     // Jump (Skip 'Then' block)
-                     i = i + jmp_len;
-                 }};
-                 // Else: Continue execution (Enter 'Then')
-            }} else {{
-                 // Comparisons (GT, GE, etc)
-                 assert!(vector::length(&stack) >= 2, E_STACK_UNDERFLOW);
-                 let rhs = vector::pop_back(&mut stack);
-                 let lhs = vector::pop_back(&mut stack);
-                 let res = if (op == OP_GT) {{ if (lhs > rhs) 1 else 0 }}
-                 else if (op == OP_GE) {{ if (lhs >= rhs) 1 else 0 }}
-                 else if (op == OP_AND) {{ if (lhs > 0 && rhs > 0) 1 else 0 }}
-                 else if (op == OP_OR) {{ if (lhs > 0 || rhs > 0) 1 else 0 }}
-                 else {{ 0 }};
-                 vector::push_back(&mut stack, res);
-            }};
-        }};
+        let accs = table::borrow_mut(&mut contract.accounts, src);
+        
+        if (!table::contains(accs, token)) {{
+            return
+        }};
 
-        if (vector::length(&stack) > 0) {{
-            vector::pop_back(&mut stack)
-        }} else {{
-            0
-        }}
+        let b = table::borrow_mut(accs, token);
+        let available = *b;
+        
+        let pay_amt = if (available >= amt) {{ amt }} else {{ available }};
+
+        if (pay_amt > 0) {{
+            // Deduct Logic Balance
+            *b = available - pay_amt;
+
+            // Deduct Actual Vault
+            let vault = bag::borrow_mut<{key_t}, Balance<T>>(&mut contract.vaults, token);
+            assert!(balance::value(vault) >= pay_amt, E_INSUFFICIENT_FUNDS); 
+            transfer::public_transfer(coin::from_balance(balance::split(vault, pay_amt), ctx), recipient);
+        }};
     }}
 
-    /// @dev 允許 Address 類型的參與者提款
+{expr_helpers}    /// @dev 允許 Address 類型的參與者提款
     public fun withdraw_by_address<T>(
         contract: &mut Contract,
         amount: u64,
@@ -524,22 +757,18 @@ module test::{module_name} {{
     /// @dev 透過 Role NFT 提款 (最推薦的方式)
     public fun withdraw_by_role<T>(
         contract: &mut Contract,
-        role_nft: &RoleNFT,
+        role_nft: &RoleNFT,{withdraw_token_param}
         amount: u64,
         ctx: &mut TxContext
     ) {{
         // 1. 驗證 Role 歸屬
         assert!(role_nft.contract_id == object::id(contract), E_INVALID_ROLE_NFT);
         
-        // 2. 建構 Party Key: "Role(Name)"
-        let party_key = string::utf8(b"Role(");
-        string::append(&mut party_key, role_nft.name);
-        string::append(&mut party_key, string::utf8(b")"));
-
+{withdraw_party_code}
         // 3. 執行內部支付邏輯 (從合約轉給 Caller)
         let caller = tx_context::sender(ctx);
         // Note: internal_pay checks logic balance AND vault balance
-        internal_pay<T>(contract, party_key, caller, amount, ctx);
+        internal_pay<T>(contract, {withdraw_pay_args}, caller, amount, ctx);
     }}
 """
 
@@ -607,10 +836,22 @@ OP_TIME_START = 20
 OP_TIME_END = 21
 OP_GT = 30
 OP_GE = 31
+OP_EQ = 32
+OP_LT = 33
+OP_LE = 34
 OP_AND = 40
 OP_OR = 41
 OP_NOT = 42
 OP_CJUMP = 50
+OP_DUP = 60
+# compact 編碼 (bytecode_format="compact")
+OP_VCONST = 9
+OP_GET_ACC_IDX = 14
+OP_GET_CHOICE_IDX = 15
+OP_USE_VAL_IDX = 16
+OP_HAS_CHOICE_IDX = 17
+
+MAX_JUMP = 0xFFFF  # OP_CJUMP 的跳躍長度為 2 bytes
 
 def pack_u64(val: int) -> List[int]:
     """Packs a u64 into 8 bytes (Big Endian)"""
@@ -620,66 +861,361 @@ def pack_string(s: str) -> List[int]:
     b = s.encode('utf-8')
     return [len(b)] + list(b)
 
-def generate_bytecode(node) -> str:
-    """Serializes a Value or Observation node into a Move vector<u8> string."""
-    bytes_list = _serialize_node(node)
+_EVAL_MARKER = re.compile(r"^( *)\{(check (\d+)|result|eval_doc)\}\n", re.MULTILINE)
+
+
+def _render_eval(template: str, verified: bool) -> str:
+    """
+    展開 internal_eval 樣板中的標記 (每個標記獨佔一行，保留其縮排)：
+      {check n}   stack 至少要有 n 個值；verified 時省略
+      {result}    回傳 stack 頂端；未驗證時空 stack 回傳 0
+      {eval_doc}  verified 時說明為何沒有 underflow 檢查
+    verified_eval 的 bytecode 都經過 verify_bytecode (stack 平衡、結束時恰好一個值)，
+    所以執行期的檢查與空 stack 的 fallback 都不再需要。
+    """
+    def expand(match: "re.Match[str]") -> str:
+        (indent, marker, count) = match.groups()
+        if count is not None:
+            lines = [] if verified else [f"assert!(vector::length(&stack) >= {count}, E_STACK_UNDERFLOW);"]
+        elif marker == "result":
+            lines = ["vector::pop_back(&mut stack)"] if verified else [
+                "if (vector::length(&stack) > 0) {",
+                "    vector::pop_back(&mut stack)",
+                "} else {",
+                "    0",
+                "}",
+            ]
+        else:
+            lines = ["/// @dev bytecode 已由產生器靜態驗證 (verify_bytecode)，此處不做 stack underflow 檢查"] if verified else []
+        return "".join(f"{indent}{line}\n" for line in lines)
+
+    return _EVAL_MARKER.sub(expand, template)
+
+
+COMPACT_VARINT_HELPER = """    /// @dev 讀取 LEB128 varint，回傳 (數值, 下一個位置)
+    fun internal_read_varint(bytecode: &vector<u8>, start: u64): (u64, u64) {
+        let val: u64 = 0;
+        let shift: u8 = 0;
+        let i = start;
+        loop {
+            let b = *vector::borrow(bytecode, i);
+            i = i + 1;
+            val = val | (((b & 0x7f) as u64) << shift);
+            if (b < 0x80) break;
+            shift = shift + 7;
+        };
+        (val, i)
+    }
+
+"""
+
+COMPACT_CONST_OPS = """            } else if (op == OP_VCONST) {
+                let (val, next) = internal_read_varint(&bytecode, i);
+                i = next;
+                vector::push_back(&mut stack, val);
+"""
+
+COMPACT_STRING_OPS = """            } else if (op == OP_GET_ACC_IDX) {
+                let (p_idx, next) = internal_read_varint(&bytecode, i);
+                let (t_idx, next2) = internal_read_varint(&bytecode, next);
+                i = next2;
+                let party = internal_string(p_idx);
+                let token = internal_string(t_idx);
+                vector::push_back(&mut stack, internal_get_balance(contract, party, token));
+            } else if (op == OP_GET_CHOICE_IDX) {
+                let (c_idx, next) = internal_read_varint(&bytecode, i);
+                i = next;
+                let val = internal_get_choice(contract, internal_string(c_idx));
+                vector::push_back(&mut stack, val);
+            } else if (op == OP_USE_VAL_IDX) {
+                let (v_idx, next) = internal_read_varint(&bytecode, i);
+                i = next;
+                let val = internal_get_bound_value(contract, internal_string(v_idx));
+                vector::push_back(&mut stack, val);
+            } else if (op == OP_HAS_CHOICE_IDX) {
+                let (c_idx, next) = internal_read_varint(&bytecode, i);
+                i = next;
+                let has_val = internal_has_choice(contract, internal_string(c_idx));
+                vector::push_back(&mut stack, if (has_val) 1 else 0);
+"""
+
+
+def pack_varint(val: int) -> List[int]:
+    """Packs a u64 as unsigned LEB128 (7 bits per byte, MSB = continuation)"""
+    out = []
+    while True:
+        byte = val & 0x7F
+        val >>= 7
+        if val:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return out
+
+
+def _move_bytes_literal(data: bytes) -> str:
+    """可讀的 ASCII 用 b"..."，其餘用 x"..." """
+    if all(0x20 <= c < 0x7F and c not in (0x22, 0x5C) for c in data):
+        return f'b"{data.decode("ascii")}"'
+    return f'x"{data.hex()}"'
+
+
+@dataclass
+class BytecodePool:
+    """compact 編碼的模組層級常數池：字串表 + 共用的表達式 bytecode const"""
+
+    strings: Dict[str, int] = field(default_factory=dict)
+    expressions: Dict[bytes, str] = field(default_factory=dict)
+
+    def string_index(self, s: str) -> List[int]:
+        index = self.strings.setdefault(s, len(self.strings))
+        return pack_varint(index)
+
+    def expression_const(self, code: List[int]) -> str:
+        key = bytes(code)
+        if key not in self.expressions:
+            self.expressions[key] = f"EXPR_{len(self.expressions)}"
+        return self.expressions[key]
+
+    def move_consts(self) -> str:
+        lines = ["    // --- Constant Pool (compact bytecode) ---"]
+        # 每個字串一個 const：Move 的 const 在每次使用時都會重新建構，
+        # 整張 vector<vector<u8>> 表會讓每次 internal_eval 都複製全部字串
+        for (s, index) in self.strings.items():
+            lines.append(f"    const STR_{index}: vector<u8> = {_move_bytes_literal(s.encode('utf-8'))};")
+        for (code, name) in self.expressions.items():
+            lines.append(f'    const {name}: vector<u8> = x"{code.hex()}";')
+        return "\n".join(lines) + "\n"
+
+
+    def move_string_lookup(self) -> str:
+        """internal_string(idx)：以二分 if 樹選出 STR_idx，只建構被讀到的那一個 const"""
+        def branch(lo: int, hi: int, indent: str) -> str:
+            if hi - lo == 1:
+                return f"{indent}string::utf8(STR_{lo})\n"
+            mid = (lo + hi) // 2
+            inner = indent + "    "
+            return (
+                f"{indent}if (idx < {mid}) {{\n" + branch(lo, mid, inner)
+                + f"{indent}}} else {{\n" + branch(mid, hi, inner)
+                + f"{indent}}}\n"
+            )
+
+        return (
+            "    /// @dev 字串表索引 -> String (索引已由 verify_bytecode 檢查在範圍內)\n"
+            "    fun internal_string(idx: u64): String {\n"
+            + branch(0, len(self.strings), "        ")
+            + "    }\n\n"
+        )
+
+
+def pack_jump(length: int) -> List[int]:
+    """Packs a forward jump length into 2 bytes (Big Endian)"""
+    return list(struct.pack('>H', length))
+
+def _short_circuit(lhs: List[int], rhs: List[int], op: int) -> List[int]:
+    """
+    both/either 的短路求值：
+      both:   lhs DUP CJUMP(len) rhs AND          (lhs == 0 時跳過 rhs，留下 0)
+      either: lhs DUP NOT CJUMP(len) rhs OR       (lhs != 0 時跳過 rhs，留下 lhs)
+    跳躍距離超過 2 bytes 時退回逐一求值。
+    """
+    tail = rhs + [op]
+    if len(tail) > MAX_JUMP:
+        return lhs + tail
+    guard = [OP_DUP] if op == OP_AND else [OP_DUP, OP_NOT]
+    return lhs + guard + [OP_CJUMP] + pack_jump(len(tail)) + tail
+
+# (pops, pushes) of every opcode without immediate operands
+_STACK_EFFECTS = {
+    OP_ZW: (0, 1), OP_TRUE: (0, 1),
+    OP_ADD: (2, 1), OP_SUB: (2, 1), OP_MUL: (2, 1), OP_DIV: (2, 1), OP_NEG: (1, 1),
+    OP_TIME_START: (0, 1), OP_TIME_END: (0, 1),
+    OP_GT: (2, 1), OP_GE: (2, 1), OP_EQ: (2, 1), OP_LT: (2, 1), OP_LE: (2, 1),
+    OP_AND: (2, 1), OP_OR: (2, 1), OP_NOT: (1, 1),
+    OP_DUP: (1, 2),
+}
+
+
+def _read_varint(code: List[int], pc: int) -> Tuple[int, int]:
+    """Decodes an unsigned LEB128 value; returns (value, next pc)."""
+    val = 0
+    for (k, shift) in enumerate(range(0, 70, 7)):
+        if pc + k >= len(code):
+            raise ValueError(f"Truncated varint at byte {pc}")
+        byte = code[pc + k]
+        val |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            if val > MAX_U64:
+                raise ValueError(f"Varint at byte {pc} exceeds u64 range")
+            return (val, pc + k + 1)
+    raise ValueError(f"Varint at byte {pc} is longer than 10 bytes")
+
+
+def _read_string(code: List[int], pc: int) -> int:
+    """Checks a length-prefixed UTF-8 operand; returns the next pc."""
+    if pc >= len(code):
+        raise ValueError(f"Missing string length at byte {pc}")
+    end = pc + 1 + code[pc]
+    if end > len(code):
+        raise ValueError(f"String at byte {pc} declares {code[pc]} bytes but only {len(code) - pc - 1} remain")
+    try:
+        bytes(code[pc + 1:end]).decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"String at byte {pc} is not valid UTF-8: {e}") from e
+    return end
+
+
+def _decode_instruction(
+    code: List[int],
+    pc: int,
+    string_count: Optional[int] = None,
+) -> Tuple[int, int, int, Optional[int]]:
+    """Decodes one instruction; returns (next pc, pops, pushes, jump target or None)."""
+    op = code[pc]
+    start = pc
+    pc += 1
+    if op in _STACK_EFFECTS:
+        (pops, pushes) = _STACK_EFFECTS[op]
+        return (pc, pops, pushes, None)
+    if op == OP_CONST:
+        if pc + 8 > len(code):
+            raise ValueError(f"OP_CONST at byte {start} needs 8 operand bytes")
+        return (pc + 8, 0, 1, None)
+    if op in (OP_GET_ACC, OP_GET_CHOICE, OP_USE_VAL, OP_HAS_CHOICE):
+        pc = _read_string(code, pc)
+        if op == OP_GET_ACC:
+            pc = _read_string(code, pc)
+        return (pc, 0, 1, None)
+    if op in (OP_VCONST, OP_GET_ACC_IDX, OP_GET_CHOICE_IDX, OP_USE_VAL_IDX, OP_HAS_CHOICE_IDX):
+        for _ in range(2 if op == OP_GET_ACC_IDX else 1):
+            (val, pc) = _read_varint(code, pc)
+            if op != OP_VCONST and string_count is not None and val >= string_count:
+                raise ValueError(f"String index {val} at byte {start} is outside the string table")
+        return (pc, 0, 1, None)
+    if op == OP_CJUMP:
+        if pc + 2 > len(code):
+            raise ValueError(f"OP_CJUMP at byte {start} needs 2 operand bytes")
+        return (pc + 2, 1, 0, pc + 2 + (code[pc] << 8 | code[pc + 1]))
+    raise ValueError(f"Unknown opcode {op} at byte {start}")
+
+
+def verify_bytecode(code: List[int], string_count: Optional[int] = None) -> int:
+    """
+    靜態驗證 internal_eval 的 bytecode，回傳執行時的最大 stack 深度；不合法時 raise ValueError。
+
+    檢查：opcode 合法、運算元 (u64 / varint / 字串長度 / 字串表索引) 不越界、
+    CJUMP 目標落在指令邊界上、每個位置在所有路徑上的 stack 深度一致且不會 underflow，
+    以及程式結束時 stack 上恰好留下一個值。
+
+    internal_eval 不依此預先配置 stack：Move 的 vector 沒有 reserve / with_capacity，
+    先填 n 個 0 本身就是 n 次 push_back，之後還要改成以索引寫入，不會比直接 push 省。
+    """
+    # 1. 線性解碼 (跳躍只會往前，所以從 0 開始即可涵蓋所有指令)
+    instructions: Dict[int, Tuple[int, int, int, Optional[int]]] = {}
+    pc = 0
+    while pc < len(code):
+        instructions[pc] = _decode_instruction(code, pc, string_count)
+        pc = instructions[pc][0]
+
+    for (start, (_, _, _, target)) in instructions.items():
+        if target is not None and target not in instructions and target != len(code):
+            raise ValueError(f"OP_CJUMP at byte {start} targets byte {target}, which is not an instruction boundary")
+
+    # 2. 沿所有路徑推導 stack 深度
+    depth_at: Dict[int, int] = {0: 0}
+    max_depth = 0
+    worklist = [0]
+    while worklist:
+        pc = worklist.pop()
+        depth = depth_at[pc]
+        if pc == len(code):
+            if depth != 1:
+                raise ValueError(f"Program ends with stack depth {depth} (expected 1)")
+            continue
+        (next_pc, pops, pushes, target) = instructions[pc]
+        if depth < pops:
+            raise ValueError(f"Stack underflow at byte {pc} (depth {depth}, opcode {code[pc]})")
+        depth = depth - pops + pushes
+        max_depth = max(max_depth, depth)
+        for succ in (next_pc, target):
+            if succ is None:
+                continue
+            if succ in depth_at:
+                if depth_at[succ] != depth:
+                    raise ValueError(f"Inconsistent stack depth at byte {succ}: {depth_at[succ]} vs {depth}")
+            else:
+                depth_at[succ] = depth
+                worklist.append(succ)
+    return max_depth
+
+
+def generate_bytecode(node, pool: Optional[BytecodePool] = None) -> str:
+    """Serializes a Value or Observation node into a Move vector<u8> string (or a pooled const name)."""
+    bytes_list = _serialize_node(node, pool)
+    verify_bytecode(bytes_list, len(pool.strings) if pool is not None else None)
+    if pool is not None:
+        return pool.expression_const(bytes_list)
     return f"vector[{', '.join(map(str, bytes_list))}]"
 
-def _serialize_node(node) -> List[int]:
+def _serialize_node(node, pool: Optional[BytecodePool] = None) -> List[int]:
     if isinstance(node, int):
         if node < 0:
             raise ValueError(f"Negative integers are unsupported in current Move lowering: {node}")
         if node > MAX_U64:
             raise ValueError(f"Integer exceeds u64 range: {node}")
+        if pool is not None:
+            if node in (0, 1):
+                return [OP_TRUE] if node else [OP_ZW]
+            return [OP_VCONST] + pack_varint(node)
         return [OP_CONST] + pack_u64(node)
     if isinstance(node, bool):
         return [OP_TRUE] if node else [OP_ZW]
     
     if isinstance(node, dict):
-        if "add" in node: return _serialize_node(node['add'][0]) + _serialize_node(node['add'][1]) + [OP_ADD]
-        if "sub" in node: return _serialize_node(node['sub'][0]) + _serialize_node(node['sub'][1]) + [OP_SUB]
-        if "mul" in node: return _serialize_node(node['mul'][0]) + _serialize_node(node['mul'][1]) + [OP_MUL]
-        if "div" in node: return _serialize_node(node['div'][0]) + _serialize_node(node['div'][1]) + [OP_DIV]
+        if "add" in node: return _serialize_node(node['add'][0], pool) + _serialize_node(node['add'][1], pool) + [OP_ADD]
+        if "sub" in node: return _serialize_node(node['sub'][0], pool) + _serialize_node(node['sub'][1], pool) + [OP_SUB]
+        if "mul" in node: return _serialize_node(node['mul'][0], pool) + _serialize_node(node['mul'][1], pool) + [OP_MUL]
+        if "div" in node: return _serialize_node(node['div'][0], pool) + _serialize_node(node['div'][1], pool) + [OP_DIV]
         if "negate" in node:
             raise ValueError("negate is not supported in current Move lowering")
         
         if "available_money" in node:
             am = node["available_money"]
-            t_str = "SUI"
-            if isinstance(am['token'], dict) and am['token'].get('token_name'):
-                 t_str = am['token']['token_name']
+            t_str = current_token_registry().balance_key(am['token'])
+            if pool is not None:
+                return [OP_GET_ACC_IDX] + pool.string_index(am['party']) + pool.string_index(t_str)
             return [OP_GET_ACC] + pack_string(am['party']) + pack_string(t_str)
 
         if "choice_value" in node:
             cv = node["choice_value"]
             key = f"{cv['name']}:{cv['owner']}"
+            if pool is not None:
+                return [OP_GET_CHOICE_IDX] + pool.string_index(key)
             return [OP_GET_CHOICE] + pack_string(key)
             
         if "use_value" in node:
+            if pool is not None:
+                return [OP_USE_VAL_IDX] + pool.string_index(node['use_value'])
             return [OP_USE_VAL] + pack_string(node['use_value'])
             
-        if "both" in node: return _serialize_node(node['both']) + _serialize_node(node['and']) + [OP_AND]
-        if "either" in node: return _serialize_node(node['either']) + _serialize_node(node['or']) + [OP_OR]
-        if "not" in node: return _serialize_node(node['not']) + [OP_NOT]
+        if "both" in node: return _short_circuit(_serialize_node(node['both'], pool), _serialize_node(node['and'], pool), OP_AND)
+        if "either" in node: return _short_circuit(_serialize_node(node['either'], pool), _serialize_node(node['or'], pool), OP_OR)
+        if "not" in node: return _serialize_node(node['not'], pool) + [OP_NOT]
             
-        if "ge_than" in node: return _serialize_node(node['value']) + _serialize_node(node['ge_than']) + [OP_GE]
-        if "gt" in node: return _serialize_node(node['value']) + _serialize_node(node['gt']) + [OP_GT]
-        if "lt" in node: return _serialize_node(node['lt']) + _serialize_node(node['value']) + [OP_GT] # A < B <=> B > A
-        if "le_than" in node: return _serialize_node(node['le_than']) + _serialize_node(node['value']) + [OP_GE] # A <= B <=> B >= A
-        if "equal_to" in node: 
-            # A == B <=> (A >= B) && (B >= A)
-            val_a = _serialize_node(node['value'])
-            val_b = _serialize_node(node['equal_to'])
-            # We need to duplicate side effects? Values are side-effect free in Marlowe (mostly, except time reads).
-            # But calculating twice is inefficient. 
-            # Ideally we have OP_EQ. For MVP:
-            return val_a + val_b + [OP_GE] + val_b + val_a + [OP_GE] + [OP_AND]
+        if "ge_than" in node: return _serialize_node(node['value'], pool) + _serialize_node(node['ge_than'], pool) + [OP_GE]
+        if "gt" in node: return _serialize_node(node['value'], pool) + _serialize_node(node['gt'], pool) + [OP_GT]
+        if "lt" in node: return _serialize_node(node['value'], pool) + _serialize_node(node['lt'], pool) + [OP_LT]
+        if "le_than" in node: return _serialize_node(node['value'], pool) + _serialize_node(node['le_than'], pool) + [OP_LE]
+        if "equal_to" in node: return _serialize_node(node['value'], pool) + _serialize_node(node['equal_to'], pool) + [OP_EQ]
 
         if "chose_something_for" in node:
             choice_obj = node["chose_something_for"]
             if not isinstance(choice_obj, dict):
                 raise ValueError(f"Invalid chose_something_for payload: {choice_obj}")
             key = f"{choice_obj['name']}:{choice_obj['owner']}"
+            if pool is not None:
+                return [OP_HAS_CHOICE_IDX] + pool.string_index(key)
             return [OP_HAS_CHOICE] + pack_string(key)
 
     if node == "time_interval_start": return [OP_TIME_START]
@@ -687,11 +1223,126 @@ def _serialize_node(node) -> List[int]:
 
     raise ValueError(f"Unsupported node for bytecode lowering: {node}")
 
+# -----------------------------------------------------------------
+# 4b. Native Expression Lowering (expr_mode="native")
+# -----------------------------------------------------------------
+
+def _move_str(s: str) -> str:
+    return f"string::utf8(b\"{s}\")"
+
+def key_expr(kind: str, key: str, symbols: Optional[SymbolTable] = None) -> str:
+    """On-chain table key: a symbol-table constant, or the legacy String literal."""
+    if symbols is not None:
+        return symbols.const_name(kind, key)
+    return _move_str(key)
+
+def role_key_expr(role_name: str, symbols: Optional[SymbolTable] = None) -> str:
+    """Key carried by RoleNFT / role_registry: the party id of Role(name), or the bare name."""
+    if symbols is not None:
+        return symbols.const_name("party", f"Role({role_name})")
+    return _move_str(role_name)
+
+def _native_u64(node: int) -> str:
+    if node < 0:
+        raise ValueError(f"Negative integers are unsupported in current Move lowering: {node}")
+    if node > MAX_U64:
+        raise ValueError(f"Integer exceeds u64 range: {node}")
+    return str(node)
+
+def native_value_expr(node, symbols: Optional[SymbolTable] = None) -> str:
+    """Lowers a Value JSON node into a straight-line Move u64 expression."""
+    if isinstance(node, bool):
+        return "1" if node else "0"
+    if isinstance(node, int):
+        return _native_u64(node)
+
+    if isinstance(node, dict):
+        if "add" in node: return f"({native_value_expr(node['add'][0], symbols)} + {native_value_expr(node['add'][1], symbols)})"
+        if "sub" in node: return f"internal_sat_sub({native_value_expr(node['sub'][0], symbols)}, {native_value_expr(node['sub'][1], symbols)})"
+        if "mul" in node: return f"({native_value_expr(node['mul'][0], symbols)} * {native_value_expr(node['mul'][1], symbols)})"
+        if "div" in node: return f"internal_safe_div({native_value_expr(node['div'][0], symbols)}, {native_value_expr(node['div'][1], symbols)})"
+        if "negate" in node:
+            raise ValueError("negate is not supported in current Move lowering")
+
+        if "available_money" in node:
+            am = node["available_money"]
+            move_type = marlowe_token_to_move_type(am["token"])
+            if symbols is not None:
+                party = symbols.const_name("party", am["party"])
+                return f"internal_get_balance(contract, {party}, {symbols.const_name('token', move_type)})"
+            return f"internal_available_money<{move_type}>(contract, {_move_str(am['party'])})"
+
+        if "choice_value" in node:
+            cv = node["choice_value"]
+            key = f"{cv['name']}:{cv['owner']}"
+            return f"internal_get_choice(contract, {key_expr('choice', key, symbols)})"
+
+        if "use_value" in node:
+            return f"internal_get_bound_value(contract, {key_expr('value', node['use_value'], symbols)})"
+
+        if "if" in node:
+            return (
+                f"(if ({native_observation_expr(node['if'], symbols)}) {native_value_expr(node['then'], symbols)} "
+                f"else {native_value_expr(node['else'], symbols)})"
+            )
+
+    if node in ("time_interval_start", "time_interval_end"):
+        return "tx_context::epoch_timestamp_ms(ctx)"
+
+    raise ValueError(f"Unsupported value for native lowering: {node}")
+
+def native_observation_expr(node, symbols: Optional[SymbolTable] = None) -> str:
+    """Lowers an Observation JSON node into a short-circuiting Move bool expression."""
+    if isinstance(node, bool):
+        return "true" if node else "false"
+
+    if isinstance(node, dict):
+        if "both" in node: return f"({native_observation_expr(node['both'], symbols)} && {native_observation_expr(node['and'], symbols)})"
+        if "either" in node: return f"({native_observation_expr(node['either'], symbols)} || {native_observation_expr(node['or'], symbols)})"
+        if "not" in node: return f"!{native_observation_expr(node['not'], symbols)}"
+
+        if "chose_something_for" in node:
+            choice_obj = node["chose_something_for"]
+            if not isinstance(choice_obj, dict):
+                raise ValueError(f"Invalid chose_something_for payload: {choice_obj}")
+            key = f"{choice_obj['name']}:{choice_obj['owner']}"
+            return f"internal_has_choice(contract, {key_expr('choice', key, symbols)})"
+
+        comparisons = (("ge_than", ">="), ("gt", ">"), ("lt", "<"), ("le_than", "<="), ("equal_to", "=="))
+        for key, op in comparisons:
+            if key in node:
+                return f"({native_value_expr(node['value'], symbols)} {op} {native_value_expr(node[key], symbols)})"
+
+    raise ValueError(f"Unsupported observation for native lowering: {node}")
+
+def lower_value(
+    node,
+    options: LoweringOptions,
+    symbols: Optional[SymbolTable] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """Move expression evaluating a Value node to u64 under the selected expr_mode."""
+    if options.expr_mode == "native":
+        return native_value_expr(node, symbols)
+    return f"internal_eval(contract, {generate_bytecode(node, pool)}, ctx)"
+
+def lower_observation(
+    node,
+    options: LoweringOptions,
+    symbols: Optional[SymbolTable] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """Move expression evaluating an Observation node to bool under the selected expr_mode."""
+    if options.expr_mode == "native":
+        return native_observation_expr(node, symbols)
+    return f"internal_eval(contract, {generate_bytecode(node, pool)}, ctx) == 1"
+
 
 def generate_choice_function(
     choice: ChoiceStageInfo,
     stage_lookup: StageLookup,
     options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
 ) -> str:
     """產生 Choice function"""
     options = (options or LoweringOptions()).normalized()
@@ -704,17 +1355,14 @@ def generate_choice_function(
     assertions = [f"assert!(contract.stage == {choice.stage}, E_WRONG_STAGE);"]
 
     # 0. Timeout Check
-    if choice.stage in stage_lookup:
-        (st_type, st_data) = stage_lookup[choice.stage]
-        if st_type == "when":
-            (when_info, _) = st_data
-            if when_info.timeout and when_info.timeout > 0:
-                 assertions.append(f"assert!(tx_context::epoch_timestamp_ms(ctx) < {when_info.timeout}, E_TIMEOUT_PASSED);")
+    when_info = stage_lookup.when(choice.stage)
+    if when_info is not None and when_info.timeout and when_info.timeout > 0:
+        assertions.append(f"assert!(tx_context::epoch_timestamp_ms(ctx) < {when_info.timeout}, E_TIMEOUT_PASSED);")
 
     # 驗證 Caller
     if party_type == "role":
         sig_params.insert(1, f"role_nft: &RoleNFT")
-        assertions.append(f"assert_role(contract, role_nft, string::utf8(b\"{party_id_raw}\"));")
+        assertions.append(f"assert_role(contract, role_nft, {role_key_expr(party_id_raw, symbols)});")
     elif party_type == "address":
          assertions.append(f"assert!(tx_context::sender(ctx) == @{party_id_raw}, E_WRONG_CALLER);")
 
@@ -736,7 +1384,7 @@ def generate_choice_function(
     # Actually, in `generate_value_expr`, we used `cv['owner']` from JSON which is "Role(X)" or "Address(X)".
     # `choice.by` in ChoiceStageInfo is stored as string "Role(X)" by `fsm_model.py`.
     # So using `choice.by` directly is correct.
-    choice_key_str = f"string::utf8(b\"{choice.choice_name}:{choice.by}\")"
+    choice_key_str = key_expr("choice", f"{choice.choice_name}:{choice.by}", symbols)
     
     if options.choice_write_policy == "set_once":
         write_state = f"""
@@ -753,7 +1401,7 @@ def generate_choice_function(
     """
 
     sig_params.append("ctx: &mut TxContext")
-    automation_tail = generate_automation_tail(choice.next_stage, stage_lookup)
+    automation_tail = generate_automation_tail(choice.next_stage, stage_lookup, dispatch=tail_dispatch(options, False))
 
     return f"""
     /// @dev Stage {choice.stage} / Case {choice.case_index}: Choice {choice.choice_name} by {choice.by}
@@ -771,28 +1419,32 @@ def generate_choice_function(
     }}
 """
 
-def generate_notify_function(notify: NotifyStageInfo, stage_lookup: StageLookup) -> str:
+def generate_notify_function(
+    notify: NotifyStageInfo,
+    stage_lookup: StageLookup,
+    options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
     """產生 Notify function"""
+    options = (options or LoweringOptions()).normalized()
     fn_name = f"notify_stage_{notify.stage}_case_{notify.case_index}"
     
     # Notify 任何人都可以呼叫，只要 Observation 為真
     sig_params = ["contract: &mut Contract", "ctx: &mut TxContext"]
     
-    obs_bytecode = generate_bytecode(notify.observation)
+    obs_expr = lower_observation(notify.observation, options, symbols, pool)
     assertions = [
         f"assert!(contract.stage == {notify.stage}, E_WRONG_STAGE);",
-        f"assert!(internal_eval(contract, {obs_bytecode}, ctx) == 1, E_ASSERT_FAILED);" # Notify fails if obs is false
+        f"assert!({obs_expr}, E_ASSERT_FAILED);" # Notify fails if obs is false
     ]
     
     # Timeout Check
-    if notify.stage in stage_lookup:
-        (st_type, st_data) = stage_lookup[notify.stage]
-        if st_type == "when":
-            (when_info, _) = st_data
-            if when_info.timeout and when_info.timeout > 0:
-                 assertions.append(f"assert!(tx_context::epoch_timestamp_ms(ctx) < {when_info.timeout}, E_TIMEOUT_PASSED);")
+    when_info = stage_lookup.when(notify.stage)
+    if when_info is not None and when_info.timeout and when_info.timeout > 0:
+        assertions.append(f"assert!(tx_context::epoch_timestamp_ms(ctx) < {when_info.timeout}, E_TIMEOUT_PASSED);")
 
-    automation_tail = generate_automation_tail(notify.next_stage, stage_lookup)
+    automation_tail = generate_automation_tail(notify.next_stage, stage_lookup, dispatch=tail_dispatch(options, False))
 
     return f"""
     /// @dev Stage {notify.stage} / Case {notify.case_index}: Notify
@@ -807,8 +1459,16 @@ def generate_notify_function(notify: NotifyStageInfo, stage_lookup: StageLookup)
     }}
 """
 
-def generate_test_module(infos: Dict[str, List[Any]], package_name: str = "generated_marlowe") -> str:
+@traced("generate_test_module")
+def generate_test_module(
+    infos: Union[Dict[str, List[Any]], StageTable],
+    package_name: str = "generated_marlowe",
+    options: Optional[LoweringOptions] = None,
+) -> str:
     """Generates a Move test module with specific Role/Choice steps."""
+    options = (options or LoweringOptions()).normalized()
+    table = as_stage_table(infos)
+    symbols = build_symbol_table(table.infos) if options.symbol_keys else None
     package_name = sanitize_module_name(package_name)
     test_module_name = f"{sanitize_module_name(package_name)}_tests"
     
@@ -818,12 +1478,10 @@ def generate_test_module(infos: Dict[str, List[Any]], package_name: str = "gener
     
     target_choice = None
     
-    # Check 'choice' list for Stage 0
-    if "choice" in infos:
-        for choice_info in infos["choice"]:
-            if choice_info.stage == 0:
-                target_choice = choice_info
-                break
+    # Check Stage 0's choice cases
+    stage0_choices = table.cases_at(0)["choice"]
+    if stage0_choices:
+        target_choice = stage0_choices[0]
     
     if target_choice:
         # target_choice is ChoiceStageInfo
@@ -836,11 +1494,12 @@ def generate_test_module(infos: Dict[str, List[Any]], package_name: str = "gener
         fn_call_name = f"choice_stage_{target_choice.stage}_case_{target_choice.case_index}"
 
         if party_type == "role":
+            role_arg = str(symbols.party[target_choice.by]) if symbols else f'std::string::utf8(b"{party_name}")'
             setup_steps += f"""
         // Mint Role '{party_name}' to user
         {{
             let contract = test_scenario::take_shared<Contract>(scenario);
-            {package_name}::mint_role_for_testing(&mut contract, std::string::utf8(b"{party_name}"), user, test_scenario::ctx(scenario));
+            {package_name}::mint_role_for_testing(&mut contract, {role_arg}, user, test_scenario::ctx(scenario));
             test_scenario::return_shared(contract);
         }};
         test_scenario::next_tx(scenario, user);
@@ -905,17 +1564,25 @@ module test::{test_module_name} {{
 # (Deprecated: generate_value_expr and generate_observation_expr removed)
 
 
-def generate_deposit_function(dep: DepositStageInfo, stage_lookup: StageLookup, token_type: str = "sui::sui::SUI") -> str:
+def generate_deposit_function(
+    dep: DepositStageInfo,
+    stage_lookup: StageLookup,
+    token_type: str = "sui::sui::SUI",
+    options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
     """產生 deposit function, 使用 case_index 命名"""
+    options = (options or LoweringOptions()).normalized()
 
     token_name = dep.token_type_str
     (party_type, party_id_raw) = parse_party_str(dep.party)
     fn_name = f"deposit_stage_{dep.stage}_case_{dep.case_index}"
 
     sig_params = ["contract: &mut Contract", f"deposit_coin: Coin<{token_name}>"]
-    expected_amount_bytecode = generate_bytecode(dep.value)
+    expected_amount_expr = lower_value(dep.value, options, symbols, pool)
     # Compare coin value with evaluated amount
-    amount_check = f"assert!(coin::value(&deposit_coin) == internal_eval(contract, {expected_amount_bytecode}, ctx), E_WRONG_AMOUNT);"
+    amount_check = f"assert!(coin::value(&deposit_coin) == {expected_amount_expr}, E_WRONG_AMOUNT);"
 
     assertions = [
         f"assert!(contract.stage == {dep.stage}, E_WRONG_STAGE);",
@@ -923,17 +1590,16 @@ def generate_deposit_function(dep: DepositStageInfo, stage_lookup: StageLookup,
     ]
 
     # Timeout Check
-    if dep.stage in stage_lookup:
-        (st_type, st_data) = stage_lookup[dep.stage]
-        if st_type == "when":
-            (when_info, _) = st_data
-            if when_info.timeout and when_info.timeout > 0:
-                 assertions.append(f"assert!(tx_context::epoch_timestamp_ms(ctx) < {when_info.timeout}, E_TIMEOUT_PASSED);")
-    party_id_str_for_logic = f"string::utf8(b\"{dep.party}\")"
+    when_info = stage_lookup.when(dep.stage)
+    if when_info is not None and when_info.timeout and when_info.timeout > 0:
+        assertions.append(f"assert!(tx_context::epoch_timestamp_ms(ctx) < {when_info.timeout}, E_TIMEOUT_PASSED);")
+    party_id_str_for_logic = key_expr("party", dep.party, symbols)
+    if symbols is not None:
+        party_id_str_for_logic += f", {symbols.const_name('token', token_name)}"
 
     if party_type == "role":
         sig_params.insert(1, f"role_nft: &RoleNFT")
-        assertions.append(f"assert_role(contract, role_nft, string::utf8(b\"{party_id_raw}\"));")
+        assertions.append(f"assert_role(contract, role_nft, {role_key_expr(party_id_raw, symbols)});")
     elif party_type == "address":
         if not (party_id_raw.startswith("0x") and len(party_id_raw) > 10):
              return f"\n    // 錯誤 (Stage {dep.stage}): Deposit Party Address 不是一個合法的地址: '{party_id_raw}'\n"
@@ -942,7 +1608,7 @@ def generate_deposit_function(dep: DepositStageInfo, stage_lookup: StageLookup,
         return f"\n    // 錯誤：無法解析的 party type: {dep.party}\n"
 
     sig_params.append("ctx: &mut TxContext")
-    automation_tail = generate_automation_tail(dep.next_stage, stage_lookup)
+    automation_tail = generate_automation_tail(dep.next_stage, stage_lookup, dispatch=tail_dispatch(options, False))
 
     return f"""
     /// @dev Stage {dep.stage} / Case {dep.case_index}: {dep.party} 存款
@@ -959,58 +1625,88 @@ def generate_deposit_function(dep: DepositStageInfo, stage_lookup: StageLookup,
     }}
 """
 
-def generate_pay_function(pay: PayStageInfo, stage_lookup: StageLookup) -> str:
-    """(FIXED) 產生 pay function, 支援 Pay to Role, 臨時處理 mul value"""
+def pay_stage_error(pay: PayStageInfo) -> Optional[str]:
+    """若 Payee 無法 lowering，回傳要輸出的錯誤註解"""
+    (to_party_type, to_party_id_raw) = parse_party_str(pay.to)
+    if to_party_type == "address":
+        if not (to_party_id_raw.startswith("0x") and len(to_party_id_raw) > 10):
+             return f"\n    // 錯誤 (Stage {pay.stage}): Pay.to.Address 不是一個合法的地址: '{to_party_id_raw}'\n"
+    elif to_party_type == "Account":
+        return f"\n    // TODO (Stage {pay.stage}): 尚未支援 Pay to Account (內部轉帳).\n"
+    elif to_party_type != "role":
+         return f"\n    // 錯誤 (Stage {pay.stage}): 無法解析的 Payee: {pay.to}\n"
+    return None
 
-    fn_name = f"internal_pay_stage_{pay.stage}"
-    (from_party_type, from_party_id_raw) = parse_party_str(pay.from_account)
+
+def pay_stage_body(
+    pay: PayStageInfo,
+    stage_lookup: StageLookup,
+    options: LoweringOptions,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """Pay stage 的函式主體 (不含 stage 驗證)，供一般函式與融合內聯共用"""
     (to_party_type, to_party_id_raw) = parse_party_str(pay.to)
     token_name = pay.token_type_str
 
-    receiver_code = ""
     if to_party_type == "address":
-        if not (to_party_id_raw.startswith("0x") and len(to_party_id_raw) > 10):
-             return f"\n    // 錯誤 (Stage {pay.stage}): Pay.to.Address 不是一個合法的地址: '{to_party_id_raw}'\n"
         receiver_code = f"let receiver_addr = @{to_party_id_raw};"
-    elif to_party_type == "role":
-        role_name_str = f"string::utf8(b\"{to_party_id_raw}\")"
+    else:
+        role_name_str = role_key_expr(to_party_id_raw, symbols)
         receiver_code = f"""
         // 從註冊表查找 Role 的地址
         assert!(table::contains(&contract.role_registry, {role_name_str}), E_ROLE_NOT_FOUND);
         let receiver_addr = *table::borrow(&contract.role_registry, {role_name_str});
         """
-    elif to_party_type == "Account":
-        return f"\n    // TODO (Stage {pay.stage}): 尚未支援 Pay to Account (內部轉帳).\n"
-    else:
-         return f"\n    // 錯誤 (Stage {pay.stage}): 無法解析的 Payee: {pay.to}\n"
 
-    amount_bytecode = generate_bytecode(pay.amount)
-    amount_code = f"let amount = internal_eval(contract, {amount_bytecode}, ctx);"
+    amount_code = f"let amount = {lower_value(pay.amount, options, symbols, pool)};"
 
-    from_party_id_str_for_logic = f"string::utf8(b\"{pay.from_account}\")"
-    # Ensure next stage exists before generating tail
-    next_stage_for_pay = pay.stage + 1
-    automation_tail = generate_automation_tail(next_stage_for_pay, stage_lookup)
+    from_party_id_str_for_logic = key_expr("party", pay.from_account, symbols)
+    pay_key_args = "from_party_id"
+    if symbols is not None:
+        pay_key_args += f", {symbols.const_name('token', token_name)}"
+    automation_tail = generate_automation_tail(pay.next_stage, stage_lookup, fusion, tail_dispatch(options, True))
 
     return f"""
-    /// @dev Stage {pay.stage}: 自動支付 (from {pay.from_account} to {pay.to})
-    fun {fn_name}(
-        contract: &mut Contract,
-        ctx: &mut TxContext
-    ) {{
-        // 1. 驗證
-        assert!(contract.stage == {pay.stage}, E_WRONG_STAGE);
-
         // 2. 求值/查找收款人
         {amount_code}
         let from_party_id = {from_party_id_str_for_logic};
         {receiver_code}
 
         // 3. 執行支付
-        internal_pay<{token_name}>(contract, from_party_id, receiver_addr, amount, ctx);
+        internal_pay<{token_name}>(contract, {pay_key_args}, receiver_addr, amount, ctx);
 
         // 4. 推進狀態機
-        {automation_tail}
+        {automation_tail}"""
+
+
+def generate_pay_function(
+    pay: PayStageInfo,
+    stage_lookup: StageLookup,
+    options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """(FIXED) 產生 pay function, 支援 Pay to Role, 臨時處理 mul value"""
+    options = (options or LoweringOptions()).normalized()
+
+    fn_name = f"internal_pay_stage_{pay.stage}"
+    error = pay_stage_error(pay)
+    if error is not None:
+        return error
+    body = pay_stage_body(pay, stage_lookup, options, symbols, fusion, pool)
+
+    return f"""
+    /// @dev Stage {pay.stage}: 自動支付 (from {pay.from_account} to {pay.to})
+    fun {fn_name}(
+        contract: &mut Contract,
+        ctx: &mut TxContext
+    ) {{
+        // 1. 驗證
+        assert!(contract.stage == {pay.stage}, E_WRONG_STAGE);
+{body}
     }}
 """
 
@@ -1036,56 +1732,80 @@ def generate_close_function(close: CloseStageInfo, stage_lookup: StageLookup) ->
     }}
 """
 
-def generate_if_function(if_info: IfStageInfo, stage_lookup: StageLookup) -> str:
-    """產生 If (條件) 函式 (保持不變)"""
-
-    condition_str = generate_bytecode(if_info.condition)
-    then_tail = generate_automation_tail(if_info.then_stage, stage_lookup)
-    else_tail = generate_automation_tail(if_info.else_stage, stage_lookup)
+def if_stage_body(
+    if_info: IfStageInfo,
+    stage_lookup: StageLookup,
+    options: LoweringOptions,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """If stage 的函式主體 (不含 stage 驗證)"""
+    if options.expr_mode == "native":
+        condition_code = f"let condition = {lower_observation(if_info.condition, options, symbols, pool)};"
+    else:
+        condition_code = (
+            f"let condition_bytecode = {generate_bytecode(if_info.condition, pool)};\n"
+            "        let condition = (internal_eval(contract, condition_bytecode, ctx) == 1);"
+        )
+    then_tail = generate_automation_tail(if_info.then_stage, stage_lookup, fusion, tail_dispatch(options, True))
+    else_tail = generate_automation_tail(if_info.else_stage, stage_lookup, fusion, tail_dispatch(options, True))
 
     return f"""
-    /// @dev Stage {if_info.stage}: 條件分支
-    fun internal_if_stage_{if_info.stage}(
-        contract: &mut Contract,
-        ctx: &mut TxContext
-    ) {{
-        assert!(contract.stage == {if_info.stage}, E_WRONG_STAGE);
-
         // 1. 求值 Observation
-        let condition_bytecode = {condition_str};
-        let condition = (internal_eval(contract, condition_bytecode, ctx) == 1);
+        {condition_code}
 
         // 2. 根據條件推進狀態機
         if (condition) {{
             {then_tail}
         }} else {{
             {else_tail}
-        }}
+        }}"""
+
+
+def generate_if_function(
+    if_info: IfStageInfo,
+    stage_lookup: StageLookup,
+    options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """產生 If (條件) 函式"""
+    options = (options or LoweringOptions()).normalized()
+    body = if_stage_body(if_info, stage_lookup, options, symbols, fusion, pool)
+
+    return f"""
+    /// @dev Stage {if_info.stage}: 條件分支
+    fun internal_if_stage_{if_info.stage}(
+        contract: &mut Contract,
+        ctx: &mut TxContext
+    ) {{
+        assert!(contract.stage == {if_info.stage}, E_WRONG_STAGE);
+{body}
     }}
 """
 
-def generate_let_function(let_info: LetStageInfo, stage_lookup: StageLookup) -> str:
-    """產生 Let (變數綁定) 函式"""
-    fn_name = f"internal_let_stage_{let_info.stage}"
-    
+def let_stage_body(
+    let_info: LetStageInfo,
+    stage_lookup: StageLookup,
+    options: LoweringOptions,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """Let stage 的函式主體 (不含 stage 驗證)"""
     # 1. 生成數值表達式
-    value_bytecode = generate_bytecode(let_info.value)
+    value_expr = lower_value(let_info.value, options, symbols, pool)
     
     # 2. 綁定到變數 ID
-    value_id_str = f"string::utf8(b\"{let_info.name}\")"
+    value_id_str = key_expr("value", let_info.name, symbols)
     
-    automation_tail = generate_automation_tail(let_info.stage + 1, stage_lookup)
+    automation_tail = generate_automation_tail(let_info.next_stage, stage_lookup, fusion, tail_dispatch(options, True))
 
     return f"""
-    /// @dev Stage {let_info.stage}: Let "{let_info.name}" = {let_info.value}
-    fun {fn_name}(
-        contract: &mut Contract,
-        ctx: &mut TxContext
-    ) {{
-        assert!(contract.stage == {let_info.stage}, E_WRONG_STAGE);
-
         // 1. 計算數值
-        let val = internal_eval(contract, {value_bytecode}, ctx);
+        let val = {value_expr};
         let val_id = {value_id_str};
 
         // 2. 存入 bound_values
@@ -1096,18 +1816,67 @@ def generate_let_function(let_info: LetStageInfo, stage_lookup: StageLookup) ->
         }};
 
         // 3. 推進狀態機
-        {automation_tail}
+        {automation_tail}"""
+
+
+def generate_let_function(
+    let_info: LetStageInfo,
+    stage_lookup: StageLookup,
+    options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """產生 Let (變數綁定) 函式"""
+    options = (options or LoweringOptions()).normalized()
+    fn_name = f"internal_let_stage_{let_info.stage}"
+    body = let_stage_body(let_info, stage_lookup, options, symbols, fusion, pool)
+
+    return f"""
+    /// @dev Stage {let_info.stage}: Let "{let_info.name}" = {let_info.value}
+    fun {fn_name}(
+        contract: &mut Contract,
+        ctx: &mut TxContext
+    ) {{
+        assert!(contract.stage == {let_info.stage}, E_WRONG_STAGE);
+{body}
     }}
 """
 
-def generate_assert_function(assert_info: AssertStageInfo, stage_lookup: StageLookup) -> str:
-    """產生 Assert (斷言) 函式"""
-    fn_name = f"internal_assert_stage_{assert_info.stage}"
-    
+def assert_stage_body(
+    assert_info: AssertStageInfo,
+    stage_lookup: StageLookup,
+    options: LoweringOptions,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """Assert stage 的函式主體 (不含 stage 驗證)"""
     # 1. 生成觀察表達式
-    obs_bytecode = generate_bytecode(assert_info.observation)
+    obs_expr = lower_observation(assert_info.observation, options, symbols, pool)
     
-    automation_tail = generate_automation_tail(assert_info.stage + 1, stage_lookup)
+    automation_tail = generate_automation_tail(assert_info.next_stage, stage_lookup, fusion, tail_dispatch(options, True))
+
+    return f"""
+        // 1. 驗證條件
+        assert!({obs_expr}, E_ASSERT_FAILED);
+
+        // 2. 推進狀態機
+        {automation_tail}"""
+
+
+def generate_assert_function(
+    assert_info: AssertStageInfo,
+    stage_lookup: StageLookup,
+    options: Optional[LoweringOptions] = None,
+    symbols: Optional[SymbolTable] = None,
+    fusion: Optional[FusionPlan] = None,
+    pool: Optional[BytecodePool] = None,
+) -> str:
+    """產生 Assert (斷言) 函式"""
+    options = (options or LoweringOptions()).normalized()
+    fn_name = f"internal_assert_stage_{assert_info.stage}"
+    body = assert_stage_body(assert_info, stage_lookup, options, symbols, fusion, pool)
 
     return f"""
     /// @dev Stage {assert_info.stage}: Assert
@@ -1116,17 +1885,25 @@ def generate_assert_function(assert_info: AssertStageInfo, stage_lookup: StageLo
         ctx: &mut TxContext
     ) {{
         assert!(contract.stage == {assert_info.stage}, E_WRONG_STAGE);
-
-        // 1. 驗證條件
-        assert!(internal_eval(contract, {obs_bytecode}, ctx) == 1, E_ASSERT_FAILED);
-
-        // 2. 推進狀態機
-        {automation_tail}
+{body}
     }}
 """
 
-def generate_timeout_function(when_info: WhenStageInfo, stage_lookup: StageLookup) -> str:
+
+AUTO_STAGE_BODIES = {
+    "pay": pay_stage_body,
+    "let": let_stage_body,
+    "assert": assert_stage_body,
+    "if": if_stage_body,
+}
+
+def generate_timeout_function(
+    when_info: WhenStageInfo,
+    stage_lookup: StageLookup,
+    options: Optional[LoweringOptions] = None,
+) -> str:
     """產生 Timeout 處理函式"""
+    options = (options or LoweringOptions()).normalized()
     # 這是每個 When stage 的「逃生門」。
     # 當區塊時間超過 timeout 時，任何人都可以呼叫此函式來推進狀態機。
     
@@ -1135,7 +1912,9 @@ def generate_timeout_function(when_info: WhenStageInfo, stage_lookup: StageLooku
     # Marlowe 的 timeout 是 Unix Timestamp (毫秒)
     timeout_ms = when_info.timeout
     
-    automation_tail = generate_automation_tail(when_info.timeout_stage, stage_lookup)
+    automation_tail = generate_automation_tail(
+        when_info.timeout_stage, stage_lookup, dispatch=tail_dispatch(options, False)
+    )
 
     return f"""
     /// @dev Stage {when_info.stage}: 處理超時 (Timeout: {timeout_ms})
@@ -1156,6 +1935,53 @@ def generate_timeout_function(when_info: WhenStageInfo, stage_lookup: StageLooku
     }}
 """
 
+def _dispatch_tree(ranges: List[Tuple[int, Optional[str]]], indent: str) -> str:
+    """以二分搜尋展開 (range 起點, 目標函式) 列表；目標為 None 表示離開迴圈"""
+    if len(ranges) == 1:
+        target = ranges[0][1]
+        return f"{target}(contract, ctx)" if target else "return"
+    mid = len(ranges) // 2
+    inner = indent + "    "
+    return (
+        f"if (stage < {ranges[mid][0]}) {{\n"
+        f"{inner}{_dispatch_tree(ranges[:mid], inner)}\n"
+        f"{indent}}} else {{\n"
+        f"{inner}{_dispatch_tree(ranges[mid:], inner)}\n"
+        f"{indent}}}"
+    )
+
+
+def generate_run_auto_function(stage_lookup: StageLookup, skip_stages: FrozenSet[int] = frozenset()) -> str:
+    """
+    產生 run_auto trampoline：依 contract.stage 分派自動 stage，直到抵達 When / Close。
+    分派表由 stage_lookup 建成 range 列表 (連續的非自動 stage 合併為一個 return 區段)，
+    以二分搜尋比較，每一步的成本為 O(log N)，與自動鏈長度無關。
+    """
+    ranges: List[Tuple[int, Optional[str]]] = [(0, None)]
+    for stage in sorted(stage_lookup):
+        (stage_type, _) = stage_lookup[stage]
+        if stage_type not in AUTO_STAGE_TYPES or stage in skip_stages:
+            continue
+        if ranges[-1] == (stage, None):
+            ranges.pop()
+        ranges.append((stage, f"internal_{stage_type}_stage_{stage}"))
+        # 每個自動 stage 只佔一格，其後回到 return 區段
+        ranges.append((stage + 1, None))
+
+    indent = "            "
+    return f"""
+    /// @dev 自動 stage trampoline：迴圈分派 Pay/Let/Assert/If，取代巢狀呼叫
+    fun run_auto(
+        contract: &mut Contract,
+        ctx: &mut TxContext
+    ) {{
+        loop {{
+            let stage = contract.stage;
+            {_dispatch_tree(ranges, indent)};
+        }}
+    }}
+"""
+
 # -----------------------------------------------------------------
 # 5. 主產生器
 # -----------------------------------------------------------------
@@ -1180,47 +2006,87 @@ def extract_token_name(token_type: str) -> str:
         return token_type.split("::")[-1]
     return token_type
 
-def generate_module(
+# compact 模式下函式主體暫存於記憶體的上限，超過即改寫入暫存檔
+EMIT_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+@traced("write_module")
+def write_module(
+    out: TextIO,
     infos: Dict[str, List[Any]],
     stage_lookup: StageLookup,
     module_name: str = "generated_marlowe",
     options: Optional[LoweringOptions] = None,
-) -> str:
-    """整合所有 function 生成一個 Move module"""
+) -> None:
+    """整合所有 function 生成一個 Move module，逐個函式寫入 `out`"""
     options = (options or LoweringOptions()).normalized()
     module_name = sanitize_module_name(module_name)
 
     token_type = get_contract_token_type(infos)
     token_name_simple = extract_token_name(token_type) # e.g. "SUI" or "USDC"
     
-    header = generate_module_header(infos, token_type, token_name_simple, module_name, options)
-    body = ""
+    symbols = build_symbol_table(infos) if options.symbol_keys else None
+    # compact 編碼的常數池在產生函式主體時填入，header 最後才產生：
+    # 主體先寫入暫存檔 (超過 EMIT_SPOOL_BYTES 才落地)，其餘模式直接串流到 out
+    pool = BytecodePool() if options.bytecode_format == "compact" else None
+    if pool is None:
+        out.write(generate_module_header(infos, token_type, token_name_simple, module_name, options, symbols))
+        body = out
+    else:
+        body = tempfile.SpooledTemporaryFile(max_size=EMIT_SPOOL_BYTES, mode="w+", encoding="utf-8")
 
     # Generate functions based on the order they appear in infos keys
     # Order matters for potential dependencies, though less critical with stage lookup
 
     # Entry points for user actions
     for dep in infos.get("deposit", []):
-        body += generate_deposit_function(dep, stage_lookup, token_type)
+        body.write(generate_deposit_function(dep, stage_lookup, token_type, options, symbols, pool))
     for choice in infos.get("choice", []):
-        body += generate_choice_function(choice, stage_lookup, options)
+        body.write(generate_choice_function(choice, stage_lookup, options, symbols))
     for notify in infos.get("notify", []):
-        body += generate_notify_function(notify, stage_lookup)
+        body.write(generate_notify_function(notify, stage_lookup, options, symbols, pool))
     for when_info in infos.get("when", []):
-        body += generate_timeout_function(when_info, stage_lookup)
+        body.write(generate_timeout_function(when_info, stage_lookup, options))
     # Internal, automatically called functions
+    # (融合模式下，被內聯的 stage 不再產生獨立函式)
+    fusion = plan_stage_fusion(stage_lookup, options, symbols, pool) if options.fuse_auto_stages else None
+    inlined = fusion.inlined if fusion is not None else frozenset()
     for pay in infos.get("pay", []):
-        body += generate_pay_function(pay, stage_lookup)
+        if pay.stage not in inlined:
+            body.write(generate_pay_function(pay, stage_lookup, options, symbols, fusion, pool))
     for if_info in infos.get("if", []):
-        body += generate_if_function(if_info, stage_lookup)
+        if if_info.stage not in inlined:
+            body.write(generate_if_function(if_info, stage_lookup, options, symbols, fusion, pool))
     for let_info in infos.get("let", []):
-        body += generate_let_function(let_info, stage_lookup)
+        if let_info.stage not in inlined:
+            body.write(generate_let_function(let_info, stage_lookup, options, symbols, fusion, pool))
     for assert_info in infos.get("assert", []):
-        body += generate_assert_function(assert_info, stage_lookup)
+        if assert_info.stage not in inlined:
+            body.write(generate_assert_function(assert_info, stage_lookup, options, symbols, fusion, pool))
+    if options.auto_dispatch == "trampoline":
+        skip_stages = inlined | {pay.stage for pay in infos.get("pay", []) if pay_stage_error(pay) is not None}
+        if any(t in AUTO_STAGE_TYPES and st not in skip_stages for (st, (t, _)) in stage_lookup.items()):
+            body.write(generate_run_auto_function(stage_lookup, frozenset(skip_stages)))
 
     # Entry points for closing
     for close in infos.get("close", []):
-        body += generate_close_function(close, stage_lookup)
+        body.write(generate_close_function(close, stage_lookup))
 
-    footer = "\n}\n"
-    return header + body + footer
+    if body is not out:
+        with body:
+            out.write(generate_module_header(infos, token_type, token_name_simple, module_name, options, symbols, pool))
+            body.seek(0)
+            shutil.copyfileobj(body, out)
+    out.write("\n}\n")
+
+
+def generate_module(
+    infos: Dict[str, List[Any]],
+    stage_lookup: StageLookup,
+    module_name: str = "generated_marlowe",
+    options: Optional[LoweringOptions] = None,
+) -> str:
+    """write_module into a string"""
+    out = io.StringIO()
+    write_module(out, infos, stage_lookup, module_name, options)
+    return out.getvalue()
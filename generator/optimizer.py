@@ -0,0 +1,321 @@
+"""
+Marlowe AST optimizer
+
+Runs between parser.parse_contract and fsm_model.parse_contract_to_infos:
+folds constant Value/Observation subtrees, applies algebraic identities and
+prunes If/Assert/Notify branches whose condition is statically known.
+
+Folding follows the on-chain semantics of the generated Move code (u64,
+saturating sub, safe div returning 0), so an expression is only replaced
+when the result is representable as a u64 constant.
+"""
+
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Any, Tuple
+
+from marlowe_types import (
+    Contract, Pay, If, When, Let, Assert, Case,
+    Deposit, Notify,
+    Value, Constant, AddValue, SubValue, MulValue, DivValue, Cond,
+    AvailableMoney, ChoiceValue, UseValue, TimeIntervalStart, TimeIntervalEnd,
+    Frame, run_frames,
+    Observation, TrueObs, FalseObs, AndObs, OrObs, NotObs, ChoseSomething,
+    ValueGE, ValueGT, ValueLT, ValueLE, ValueEQ,
+)
+
+MAX_U64 = 2**64 - 1
+
+
+@dataclass
+class OptimizationReport:
+    """before/after 節點數量統計"""
+    nodes_before: int
+    nodes_after: int
+    folded_values: int = 0
+    folded_observations: int = 0
+    pruned_branches: int = 0
+
+    @property
+    def nodes_removed(self) -> int:
+        return self.nodes_before - self.nodes_after
+
+    def summary(self) -> str:
+        return (
+            f"{self.nodes_before} -> {self.nodes_after} nodes "
+            f"(values folded: {self.folded_values}, observations folded: {self.folded_observations}, "
+            f"branches pruned: {self.pruned_branches})"
+        )
+
+
+def count_nodes(node: Any) -> int:
+    """計算 AST 節點數 (Contract / Case / Action / Value / Observation / helpers)"""
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (list, tuple)):  # When.cases / Choice.bounds 為 tuple
+            stack.extend(node)
+        elif is_dataclass(node):
+            count += 1
+            stack.extend(getattr(node, f.name) for f in fields(node))
+    return count
+
+
+def _u64_const(node: Value) -> Any:
+    """回傳 u64 範圍內的常數值，否則 None"""
+    if isinstance(node, Constant) and isinstance(node.value, int) and 0 <= node.value <= MAX_U64:
+        return node.value
+    return None
+
+
+def _cannot_abort(node: Any) -> bool:
+    """整個 Value / Observation 子樹在鏈上求值都不會 abort (add/mul 可能 u64 溢位，
+    sub 為 saturating、div 為 safe div，故只要運算元安全即安全)"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Constant):
+            if _u64_const(node) is None:
+                return False
+        elif isinstance(node, (SubValue, DivValue, ValueGE, ValueGT, ValueLT, ValueLE, ValueEQ)):
+            stack += (node.lhs, node.rhs)
+        elif isinstance(node, Cond):
+            stack += (node.condition, node.true_value, node.false_value)
+        elif isinstance(node, (AndObs, OrObs)):
+            stack += (node.left, node.right)
+        elif isinstance(node, NotObs):
+            stack.append(node.obs)
+        elif not isinstance(node, (
+            AvailableMoney, ChoiceValue, UseValue, TimeIntervalStart, TimeIntervalEnd,
+            ChoseSomething, TrueObs, FalseObs,
+        )):
+            return False
+    return True
+
+
+def _obs_cannot_abort(node: Observation) -> bool:
+    """Observation 版的 _cannot_abort：被丟棄的條件只有在這裡為 True 時才能省略"""
+    return _cannot_abort(node)
+
+
+class _Optimizer:
+    """各 _value / _observation / _contract 為 run_frames 的 frame：子樹以 `yield` 走訪，不受遞迴上限限制"""
+
+    def __init__(self, report: OptimizationReport) -> None:
+        self.report = report
+
+    def contract(self, node: Contract) -> Contract:
+        return run_frames(self._contract(node))
+
+    # --- Value ---
+
+    def _value(self, node: Value) -> Frame:
+        if isinstance(node, (AddValue, SubValue, MulValue, DivValue)):
+            lhs = yield self._value(node.lhs)
+            rhs = yield self._value(node.rhs)
+            folded = self._fold_arith(type(node), lhs, rhs)
+            if folded is not None:
+                self.report.folded_values += 1
+                return folded
+            return type(node)(lhs, rhs)
+
+        if isinstance(node, Cond):
+            cond = yield self._observation(node.condition)
+            true_value = yield self._value(node.true_value)
+            false_value = yield self._value(node.false_value)
+            if isinstance(cond, TrueObs):
+                self.report.folded_values += 1
+                return true_value
+            if isinstance(cond, FalseObs) or (true_value == false_value and _obs_cannot_abort(cond)):
+                self.report.folded_values += 1
+                return false_value
+            return Cond(cond, true_value, false_value)
+
+        return node
+
+    def _fold_arith(self, kind: type, lhs: Value, rhs: Value) -> Any:
+        a = _u64_const(lhs)
+        b = _u64_const(rhs)
+
+        if a is not None and b is not None:
+            if kind is AddValue:
+                result = a + b
+            elif kind is SubValue:
+                result = max(a - b, 0)  # internal_sat_sub
+            elif kind is MulValue:
+                result = a * b
+            else:
+                result = a // b if b != 0 else 0  # internal_safe_div
+            # 溢位時保留原式，讓鏈上行為 (abort) 不變
+            return Constant(result) if result <= MAX_U64 else None
+
+        # Algebraic identities。會丟掉另一個運算元的規則只在它不可能 abort 時套用，
+        # 否則 (例如溢位的乘法) 鏈上原本會 abort 的交易會變成成功
+        if kind is AddValue:
+            if a == 0: return rhs
+            if b == 0: return lhs
+        elif kind is SubValue:
+            if b == 0: return lhs
+            if a == 0 and _cannot_abort(rhs): return Constant(0)
+        elif kind is MulValue:
+            if a == 1: return rhs
+            if b == 1: return lhs
+            if (a == 0 and _cannot_abort(rhs)) or (b == 0 and _cannot_abort(lhs)): return Constant(0)
+        elif kind is DivValue:
+            if b == 1: return lhs
+            if (a == 0 and _cannot_abort(rhs)) or (b == 0 and _cannot_abort(lhs)): return Constant(0)
+        return None
+
+    # --- Observation ---
+
+    def _observation(self, node: Observation) -> Frame:
+        if isinstance(node, AndObs):
+            left = yield self._observation(node.left)
+            right = yield self._observation(node.right)
+            # 丟掉另一側前先確認它不會 abort (短路跳躍過長時兩側都會被求值)
+            if (isinstance(left, FalseObs) and _obs_cannot_abort(right)) or \
+                    (isinstance(right, FalseObs) and _obs_cannot_abort(left)):
+                return self._folded_obs(FalseObs())
+            if isinstance(left, TrueObs):
+                return self._folded_obs(right)
+            if isinstance(right, TrueObs):
+                return self._folded_obs(left)
+            return AndObs(left, right)
+
+        if isinstance(node, OrObs):
+            left = yield self._observation(node.left)
+            right = yield self._observation(node.right)
+            if (isinstance(left, TrueObs) and _obs_cannot_abort(right)) or \
+                    (isinstance(right, TrueObs) and _obs_cannot_abort(left)):
+                return self._folded_obs(TrueObs())
+            if isinstance(left, FalseObs):
+                return self._folded_obs(right)
+            if isinstance(right, FalseObs):
+                return self._folded_obs(left)
+            return OrObs(left, right)
+
+        if isinstance(node, NotObs):
+            inner = yield self._observation(node.obs)
+            if isinstance(inner, TrueObs):
+                return self._folded_obs(FalseObs())
+            if isinstance(inner, FalseObs):
+                return self._folded_obs(TrueObs())
+            if isinstance(inner, NotObs):
+                return self._folded_obs(inner.obs)
+            return NotObs(inner)
+
+        if isinstance(node, (ValueGE, ValueGT, ValueLT, ValueLE, ValueEQ)):
+            lhs = yield self._value(node.lhs)
+            rhs = yield self._value(node.rhs)
+            a = _u64_const(lhs)
+            b = _u64_const(rhs)
+            if a is not None and b is not None:
+                holds = {
+                    ValueGE: a >= b, ValueGT: a > b, ValueLT: a < b,
+                    ValueLE: a <= b, ValueEQ: a == b,
+                }[type(node)]
+                return self._folded_obs(TrueObs() if holds else FalseObs())
+            return type(node)(lhs, rhs)
+
+        return node
+
+    def _folded_obs(self, node: Observation) -> Observation:
+        self.report.folded_observations += 1
+        return node
+
+    # --- Contract ---
+
+    def _contract(self, node: Contract) -> Frame:
+        if isinstance(node, Pay):
+            value = yield self._value(node.value)
+            then = yield self._contract(node.then)
+            return Pay(node.from_account, node.to, node.token, value, then)
+
+        if isinstance(node, Let):
+            value = yield self._value(node.value)
+            then = yield self._contract(node.then)
+            return Let(node.name, value, then)
+
+        if isinstance(node, Assert):
+            obs = yield self._observation(node.obs)
+            then = yield self._contract(node.then)
+            if isinstance(obs, TrueObs):
+                self.report.pruned_branches += 1
+                return then
+            return Assert(obs, then)
+
+        if isinstance(node, If):
+            cond = yield self._observation(node.cond)
+            # 不可能走到的分支不再產生 stage
+            if isinstance(cond, TrueObs):
+                self.report.pruned_branches += 1
+                return (yield self._contract(node.then))
+            if isinstance(cond, FalseObs):
+                self.report.pruned_branches += 1
+                return (yield self._contract(node.else_))
+            then = yield self._contract(node.then)
+            else_ = yield self._contract(node.else_)
+            if then == else_ and _obs_cannot_abort(cond):
+                self.report.pruned_branches += 1
+                return then
+            return If(cond, then, else_)
+
+        if isinstance(node, When):
+            cases = []
+            for case in node.cases:
+                action = case.action
+                if isinstance(action, Deposit):
+                    amount = yield self._value(action.amount)
+                    action = Deposit(action.into_account, action.party, action.token, amount)
+                elif isinstance(action, Notify):
+                    observation = yield self._observation(action.observation)
+                    action = Notify(observation)
+                    if isinstance(action.observation, FalseObs):
+                        # Notify(false) 永遠無法觸發
+                        self.report.pruned_branches += 1
+                        continue
+                then = yield self._contract(case.then)
+                cases.append(Case(action, then))
+            timeout_continuation = yield self._contract(node.timeout_continuation)
+            return When(cases, node.timeout, timeout_continuation)
+
+        return node
+
+
+def optimize_contract(contract: Contract) -> Tuple[Contract, OptimizationReport]:
+    """Folds constants and prunes dead branches; returns (optimized AST, report)."""
+    report = OptimizationReport(nodes_before=count_nodes(contract), nodes_after=0)
+    optimized = _Optimizer(report).contract(contract)
+    report.nodes_after = count_nodes(optimized)
+    return (optimized, report)
+
+
+def _check_node_counts(contract: Contract) -> None:
+    """count_nodes 必須走進每個 tuple 欄位：與同內容的 list 計數一致"""
+    stack = [contract]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (list, tuple)):
+            stack.extend(node)
+            continue
+        if not is_dataclass(node):
+            continue
+        for f in fields(node):
+            value = getattr(node, f.name)
+            if isinstance(value, tuple) and count_nodes(value) != count_nodes(list(value)):
+                raise AssertionError(f"count_nodes skips {type(node).__name__}.{f.name}")
+            stack.append(value)
+
+
+if __name__ == "__main__":
+    # python generator/optimizer.py specs/complex_contract.json ...
+    import json
+    import sys
+
+    from parser import parse_contract
+
+    for path in sys.argv[1:]:
+        with open(path, "r") as f:
+            ast = parse_contract(json.load(f))
+        _check_node_counts(ast)
+        print(f"{path}: {optimize_contract(ast)[1].summary()}")
@@ -0,0 +1,257 @@
+"""
+On-disk parse/IR cache
+
+Repeated CLI / TUI / editor invocations on an unchanged spec re-read the
+JSON and re-run parse_contract + parse_contract_to_infos every time. This
+cache stores the parsed AST and stage infos (zlib-compressed pickle) under
+
+    <cache dir>/<sha256(spec bytes, generator version, parse options, token map)>.bin
+
+and evicts least-recently-used entries once the directory exceeds its size
+budget. Hits skip JSON decoding and parsing entirely. Only the options that
+change the AST / stage infos (PARSE_OPTION_FIELDS) are part of the key;
+codegen-only flags share entries.
+
+The cache directory is trusted: entries are unpickled, and pickle can run
+arbitrary code. Each file starts with a header holding its key and the
+payload's sha256, which are checked before pickle.loads, so misfiled,
+truncated or foreign files are discarded. Reads are skipped entirely when
+the directory is writable by other users or owned by someone else.
+
+Environment:
+    MARLOWE_CACHE_DIR        cache directory (default: <repo>/.cache/parse)
+    MARLOWE_CACHE_MAX_BYTES  size budget in bytes (default: 64 MiB)
+    MARLOWE_PARSE_CACHE=0    disable the cache
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fsm_model import parse_contract_to_infos
+from instrumentation import span
+from optimizer import OptimizationReport, optimize_contract
+from parser import parse_contract
+from token_registry import current_token_registry
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_DIR = os.path.join(ROOT_DIR, ".cache", "parse")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# 產生 AST / stage infos 的原始碼；內容改變即視為新版 generator
+_VERSIONED_SOURCES = ("marlowe_types.py", "parser.py", "optimizer.py", "fsm_model.py", "time_utils.py", "token_registry.py", "parse_cache.py")
+_generator_version: Optional[str] = None
+
+# LoweringOptions 中會改變 AST / stage infos 的欄位；其餘只影響 codegen
+PARSE_OPTION_FIELDS = ("fold_constants", "share_continuations")
+
+_ENTRY_MAGIC = b"MPC1"  # + 32 bytes key + 32 bytes sha256(payload) + payload
+
+
+def source_digest(names: Tuple[str, ...]) -> str:
+    """Digest of the named generator source files"""
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in names:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(name.encode() + b"\0" + f.read())
+    return digest.hexdigest()[:16]
+
+
+def generator_version() -> str:
+    """Digest of the generator sources that shape cached entries"""
+    global _generator_version
+    if _generator_version is None:
+        _generator_version = source_digest(_VERSIONED_SOURCES)
+    return _generator_version
+
+
+@dataclass
+class ParsedSpec:
+    """Parse result: AST (optimized when fold_constants), stage infos, optimizer report"""
+    ast: Any
+    infos: Optional[Dict[str, List[Any]]] = None
+    report: Optional[OptimizationReport] = None
+    cached: bool = False
+
+
+class ParseCache:
+    """Content-addressed, size-bounded LRU cache directory"""
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None) -> None:
+        self.directory = directory or os.environ.get("MARLOWE_CACHE_DIR") or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("MARLOWE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+        self._trusted: Optional[bool] = None
+
+    def trusted(self) -> bool:
+        """False when another user could have planted entries (group/world-writable or foreign-owned directory)"""
+        if self._trusted is None:
+            try:
+                stat = os.stat(self.directory)
+            except OSError:
+                return True  # 尚未建立：之後由本 process 建立
+            owner_ok = not hasattr(os, "getuid") or stat.st_uid == os.getuid()
+            self._trusted = owner_ok and not (stat.st_mode & 0o022)
+        return self._trusted
+
+    @staticmethod
+    def key(spec_bytes: bytes, options: Any = None, with_infos: bool = True, unwrap: bool = False) -> str:
+        digest = hashlib.sha256()
+        digest.update(spec_bytes)
+        digest.update(b"\0" + generator_version().encode())
+        digest.update(b"\0" + repr(tuple(getattr(options, name, False) for name in PARSE_OPTION_FIELDS)).encode())
+        digest.update(b"\0infos" if with_infos else b"\0ast")
+        digest.update(b"\0unwrap" if unwrap else b"\0raw")
+        if with_infos:
+            # stage infos 內含已解析的 Move token type
+            digest.update(b"\0" + current_token_registry().fingerprint().encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key: str) -> Optional[ParsedSpec]:
+        if not self.trusted():
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        header = _ENTRY_MAGIC + bytes.fromhex(key)
+        payload = data[len(header) + 32:]
+        if not data.startswith(header) or data[len(header):len(header) + 32] != hashlib.sha256(payload).digest():
+            self._remove(path)  # 舊格式、損毀或不屬於這個 key
+            return None
+        try:
+            entry = pickle.loads(zlib.decompress(payload))
+        except Exception:
+            # 損毀或舊格式的 entry 直接丟棄
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # LRU: mtime 即最近使用時間
+        except OSError:
+            pass
+        entry.cached = True
+        return entry
+
+    def put(self, key: str, entry: ParsedSpec) -> None:
+        try:
+            payload = zlib.compress(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        except (RecursionError, pickle.PicklingError):
+            return  # 過深的 AST 不快取
+        if len(payload) > self.max_bytes:
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_ENTRY_MAGIC + bytes.fromhex(key) + hashlib.sha256(payload).digest() + payload)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes least-recently-used entries until the directory fits the budget"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for (_, size, path) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin"):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cache_enabled() -> bool:
+    return os.environ.get("MARLOWE_PARSE_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def parse_spec_file(
+    json_path: str,
+    options: Any = None,
+    with_infos: bool = True,
+    unwrap: Optional[Callable[[Any], Any]] = None,
+    cache: Optional[ParseCache] = None,
+) -> ParsedSpec:
+    """Reads, parses and (optionally) linearizes a spec file, going through the parse cache.
+
+    `options` is a LoweringOptions (fold_constants / share_continuations are
+    honoured); errors (JSONDecodeError, ValueError, ...) propagate as before.
+    """
+    with open(json_path, "rb") as f:
+        spec_bytes = f.read()
+    return parse_spec_bytes(spec_bytes, options, with_infos, unwrap, cache)
+
+
+def parse_spec_bytes(
+    spec_bytes: bytes,
+    options: Any = None,
+    with_infos: bool = True,
+    unwrap: Optional[Callable[[Any], Any]] = None,
+    cache: Optional[ParseCache] = None,
+) -> ParsedSpec:
+    """parse_spec_file for in-memory JSON (e.g. a payload received on stdin)"""
+    if cache is None and cache_enabled():
+        cache = ParseCache()
+    key = ParseCache.key(spec_bytes, options, with_infos, unwrap is not None) if cache is not None else None
+    if cache is not None:
+        with span("parse_cache_get"):
+            hit = cache.get(key)
+        if hit is not None:
+            return hit
+
+    json_data = json.loads(spec_bytes)
+    if unwrap is not None:
+        json_data = unwrap(json_data)
+    entry = ParsedSpec(ast=parse_contract(json_data))
+    if getattr(options, "fold_constants", False):
+        (entry.ast, entry.report) = optimize_contract(entry.ast)
+    if with_infos:
+        (entry.infos, _) = parse_contract_to_infos(
+            entry.ast,
+            stage=0,
+            share_subtrees=bool(getattr(options, "share_continuations", False)),
+        )
+
+    if cache is not None:
+        try:
+            with span("parse_cache_put"):
+                cache.put(key, entry)
+        except OSError:
+            pass  # 唯讀或無空間時照常回傳
+    return entry
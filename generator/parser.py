@@ -1,4 +1,6 @@
 import json
+from typing import Any, Callable, Dict, List, Tuple
+
 from marlowe_types import (
     # Contract Types
     Contract,
@@ -59,6 +61,8 @@ from marlowe_types import (
     ChoiceId,           # ADDED
     Bound               # ADDED
 )
+from ast_arena import ContractArena
+from instrumentation import traced
 
 # === ADDED Helper Parsers ===
 
@@ -76,43 +80,6 @@ def parse_bound(data: dict) -> Bound:
         to_value=data["to"]
     )
 
-# === Observation Parser (FIXED) ===
-def parse_observation(data) -> Observation:
-    """Parses any Observation type """
-    if data is True:
-        return TrueObs()
-    elif data is False:
-        return FalseObs()
-
-    if isinstance(data, dict):
-        # Logical Ops
-        if "both" in data and "and" in data:
-            return AndObs(parse_observation(data["both"]), parse_observation(data["and"]))
-        if "either" in data and "or" in data:
-            return OrObs(parse_observation(data["either"]), parse_observation(data["or"]))
-        if "not" in data:
-            return NotObs(parse_observation(data["not"]))
-
-        # Choice
-        if "chose_something_for" in data:
-            return ChoseSomething(parse_choice_id(data["chose_something_for"]))
-
-        # Value Comparisons
-        if "value" in data:
-            val_lhs = parse_value(data["value"])
-            if "ge_than" in data:
-                return ValueGE(val_lhs, parse_value(data["ge_than"]))
-            if "gt" in data:
-                return ValueGT(val_lhs, parse_value(data["gt"]))
-            if "lt" in data:
-                return ValueLT(val_lhs, parse_value(data["lt"]))
-            if "le_than" in data:
-                return ValueLE(val_lhs, parse_value(data["le_than"]))
-            if "equal_to" in data:
-                return ValueEQ(val_lhs, parse_value(data["equal_to"]))
-
-    raise ValueError(f"Unsupported observation: {data}")
-
 # === Core Parsers (Party, Payee, Token are OK) ===
 
 def parse_party(data: dict) -> Party:
@@ -137,139 +104,276 @@ def parse_token(data: dict) -> Token:
         token_name=data.get("token_name", ""),
     )
 
-# === Action Parser (FIXED) ===
+# === Iterative parsing engine ===
+# Contract / Value / Observation 互相巢狀，深度可達數百層；改用顯式 stack 而非遞迴。
+# 每個節點的 dispatch 回傳 (builder, children)：children 依原本遞迴版本的求值順序排列，
+# 並以 (kind, container, key) 延後取值，因此錯誤訊息與觸發順序 (含 KeyError) 完全相同。
+# builder 透過 make(cls, **fields) 建構節點：物件模式直接呼叫 class，arena 模式寫入 ContractArena。
 
-def parse_action(data: dict):
-    if "deposits" in data:
-        return Deposit(
-            party=parse_party(data["party"]),
-            into_account=parse_party(data["into_account"]),
-            token=parse_token(data["of_token"]),
-            amount=parse_value(data["deposits"]), # Correct, 'deposits' is a Value [cite: 1893]
-        )
-    elif "for_choice" in data:  # CHANGED: Key is "for_choice" [cite: 1895]
-        return Choice(
-            choice_id= parse_choice_id(data["for_choice"]), # CHANGED: Must parse ChoiceId
-            bounds=[parse_bound(b) for b in data["choose_between"]] # CHANGED: Key is "choose_between" [cite: 1896, 1907]
-        )
-    elif "notify_if" in data: # CHANGED: Key is "notify_if"
-        return Notify(observation=parse_observation(data["notify_if"]))
-    else:
-        raise ValueError(f"Unsupported action: {data}")
+_Child = Tuple[str, Any, Any]
+_Step = Tuple[Callable[..., Any], List[_Child]]
 
+_PARSE = 0
+_BUILD = 1
 
-def parse_case(data: dict) -> Case:
-    return Case(action=parse_action(data["case"]), then=parse_contract(data["then"]))
 
-# === Value Parser (FIXED) ===
+def _leaf(cls: type, **values: Any) -> _Step:
+    return (lambda make: make(cls, **values), [])
 
-def parse_value(data) -> "Value":
-    """Parses any Value type [cite: 1643-1690]"""
+
+def _node(cls: type, *names: str, **values: Any) -> Callable[..., Any]:
+    """builder: 依序將 children 結果填入 `names` 欄位"""
+    return lambda make, *args: make(cls, **values, **dict(zip(names, args)))
+
+
+def _construct(cls: type, **values: Any) -> Any:
+    return cls(**values)
+
+
+def _select_form(data: dict, table: Dict[str, Tuple[int, Tuple[str, ...], Callable[[dict], _Step]]]):
+    """依鑑別 key 查表；多個候選時取優先序最高 (與原本 if 串的順序一致) 且必要 key 齊全者"""
+    best = None
+    for key in data:
+        form = table.get(key)
+        if form is not None and (best is None or form[0] < best[0]) and all(k in data for k in form[1]):
+            best = form
+    return best[2] if best is not None else None
+
+
+def _forms(*entries) -> Dict[str, Tuple[int, Tuple[str, ...], Callable[[dict], _Step]]]:
+    """(鑑別 key, 其餘必要 key, handler) 依優先序排列"""
+    return {key: (priority, required, handler) for (priority, (key, required, handler)) in enumerate(entries)}
+
+
+def _parse(kind: str, data: Any, make: Callable[..., Any] = _construct) -> Any:
+    tasks: List[Tuple[int, Any, Any]] = [(_PARSE, kind, (data, None))]
+    results: List[Any] = []
+    while tasks:
+        (tag, head, arg) = tasks.pop()
+        if tag == _BUILD:
+            if arg:
+                args = results[-arg:]
+                del results[-arg:]
+                results.append(head(make, *args))
+            else:
+                results.append(head(make))
+            continue
+
+        (container, key) = arg
+        node_data = container if key is None else container[key]
+        (build, children) = _DISPATCH[head](node_data)
+        if not children:
+            results.append(build(make))
+            continue
+        tasks.append((_BUILD, build, len(children)))
+        for (child_kind, child_container, child_key) in reversed(children):
+            tasks.append((_PARSE, child_kind, (child_container, child_key)))
+    return results[0]
+
+
+# --- Observation ---
+
+def _obs_comparison(data: dict) -> _Step:
+    for (key, cls) in _COMPARISONS:
+        if key in data:
+            return (_node(cls, "lhs", "rhs"), [("value", data, "value"), ("value", data, key)])
+
+    def unsupported(_make, _lhs):
+        raise ValueError(f"Unsupported observation: {data}")
+    # 原本的遞迴版本會先解析 lhs 再報錯
+    return (unsupported, [("value", data, "value")])
+
+
+_COMPARISONS = (
+    ("ge_than", ValueGE),
+    ("gt", ValueGT),
+    ("lt", ValueLT),
+    ("le_than", ValueLE),
+    ("equal_to", ValueEQ),
+)
+
+_OBSERVATION_FORMS = _forms(
+    ("both", ("and",), lambda d: (_node(AndObs, "left", "right"), [("observation", d, "both"), ("observation", d, "and")])),
+    ("either", ("or",), lambda d: (_node(OrObs, "left", "right"), [("observation", d, "either"), ("observation", d, "or")])),
+    ("not", (), lambda d: (_node(NotObs, "obs"), [("observation", d, "not")])),
+    ("chose_something_for", (), lambda d: _leaf(ChoseSomething, choice_id=parse_choice_id(d["chose_something_for"]))),
+    ("value", (), _obs_comparison),
+)
+
+
+def _dispatch_observation(data) -> _Step:
+    if data is True:
+        return _leaf(TrueObs)
+    elif data is False:
+        return _leaf(FalseObs)
+
+    if isinstance(data, dict):
+        handler = _select_form(data, _OBSERVATION_FORMS)
+        if handler is not None:
+            return handler(data)
+
+    raise ValueError(f"Unsupported observation: {data}")
+
+
+# --- Value ---
+
+_VALUE_FORMS = _forms(
+    ("amount_of_token", ("in_account",), lambda d: _leaf(
+        AvailableMoney,
+        token=parse_token(d["amount_of_token"]),
+        party=parse_party(d["in_account"])
+    )),
+    ("value_of_choice", (), lambda d: _leaf(ChoiceValue, choice_id=parse_choice_id(d["value_of_choice"]))),
+    ("add", ("and",), lambda d: (_node(AddValue, "lhs", "rhs"), [("value", d, "add"), ("value", d, "and")])),
+    ("value", ("minus",), lambda d: (_node(SubValue, "lhs", "rhs"), [("value", d, "value"), ("value", d, "minus")])),
+    ("multiply", ("times",), lambda d: (_node(MulValue, "lhs", "rhs"), [("value", d, "multiply"), ("value", d, "times")])),
+    ("divide", ("by",), lambda d: (_node(DivValue, "lhs", "rhs"), [("value", d, "divide"), ("value", d, "by")])),
+    ("negate", (), lambda d: (_node(NegValue, "value"), [("value", d, "negate")])),
+    ("constant", (), lambda d: _leaf(Constant, value=d["constant"])),
+    ("use_value", (), lambda d: _leaf(UseValue, value_id=d["use_value"])),
+    ("if", ("then", "else"), lambda d: (
+        _node(Cond, "condition", "true_value", "false_value"),
+        [("observation", d, "if"), ("value", d, "then"), ("value", d, "else")],
+    )),
+)
+
+
+def _dispatch_value(data) -> _Step:
     if isinstance(data, int):
-        return Constant(data)
+        return _leaf(Constant, value=data)
 
-    if isinstance(data, str): # ADDED: Handle string constants
+    if isinstance(data, str):
         if data == "time_interval_start":
-            return TimeIntervalStart()
+            return _leaf(TimeIntervalStart)
         if data == "time_interval_end":
-            return TimeIntervalEnd()
+            return _leaf(TimeIntervalEnd)
 
     if isinstance(data, dict):
-        if "amount_of_token" in data and "in_account" in data:
-            # CHANGED: Must parse inner objects
-            return AvailableMoney(
-                token=parse_token(data["amount_of_token"]),
-                party=parse_party(data["in_account"])
-            )
-        if "value_of_choice" in data:
-            # CHANGED: Must parse ChoiceId
-            return ChoiceValue(parse_choice_id(data["value_of_choice"]))
-
-        # Arithmetic
-        if "add" in data and "and" in data:
-            # CHANGED: Arguments were swapped
-            return AddValue(parse_value(data["add"]), parse_value(data["and"]))
-        if "value" in data and "minus" in data:
-            # CHANGED: Keys were "sub" and list
-            return SubValue(parse_value(data["value"]), parse_value(data["minus"]))
-        if "multiply" in data and "times" in data:
-            # CHANGED: Arguments were swapped and not recursive
-            return MulValue(parse_value(data["multiply"]), parse_value(data["times"]))
-        if "divide" in data and "by" in data:
-            # CHANGED: Keys were "div" and list
-            return DivValue(parse_value(data["divide"]), parse_value(data["by"]))
-        if "negate" in data:
-            return NegValue(parse_value(data["negate"]))
-
-        # Other
-        if "constant" in data:
-            return Constant(data["constant"])
-        if "use_value" in data:
-            return UseValue(data["use_value"])
-        if "if" in data and "then" in data and "else" in data:
-            # CHANGED: Structure was nested under "cond"
-            return Cond(
-                condition=parse_observation(data["if"]),
-                true_value=parse_value(data["then"]),
-                false_value=parse_value(data["else"]),
-            )
+        handler = _select_form(data, _VALUE_FORMS)
+        if handler is not None:
+            return handler(data)
 
     raise ValueError(f"Unsupported value: {data}")
 
-# === Contract Parser (FIXED) ===
 
-def parse_contract(data) -> Contract:
+# --- Action / Case ---
+
+def _dispatch_action(data) -> _Step:
+    if "deposits" in data:
+        party = parse_party(data["party"])
+        into_account = parse_party(data["into_account"])
+        token = parse_token(data["of_token"])
+        return (
+            _node(Deposit, "amount", party=party, into_account=into_account, token=token),
+            [("value", data, "deposits")],
+        )
+    elif "for_choice" in data:
+        return _leaf(
+            Choice,
+            choice_id=parse_choice_id(data["for_choice"]),
+            bounds=[parse_bound(b) for b in data["choose_between"]]
+        )
+    elif "notify_if" in data:
+        return (_node(Notify, "observation"), [("observation", data, "notify_if")])
+    else:
+        raise ValueError(f"Unsupported action: {data}")
+
+
+def _dispatch_case(data) -> _Step:
+    return (_node(Case, "action", "then"), [("action", data, "case"), ("contract", data, "then")])
+
+
+# --- Contract ---
+
+def _contract_pay(data: dict) -> _Step:
+    from_account = parse_party(data["from_account"])
+    to = parse_payee(data["to"])
+    token = parse_token(data["token"])
+    return (
+        _node(Pay, "value", "then", from_account=from_account, to=to, token=token),
+        [("value", data, "pay"), ("contract", data, "then")],
+    )
+
+
+def _contract_when(data: dict) -> _Step:
+    cases = data["when"]
+    children = [("case", cases, i) for i in range(len(cases))]
+    timeout = data["timeout"]
+
+    def build(make, *args):
+        return make(When, cases=list(args[:-1]), timeout=timeout, timeout_continuation=args[-1])
+    return (build, children + [("contract", data, "timeout_continuation")])
+
+
+_CONTRACT_FORMS = _forms(
+    ("if", ("then", "else"), lambda d: (
+        _node(If, "cond", "then", "else_"),
+        [("observation", d, "if"), ("contract", d, "then"), ("contract", d, "else")],
+    )),
+    ("let", ("then", "be"), lambda d: (
+        _node(Let, "value", "then", name=d["let"]),
+        [("value", d, "be"), ("contract", d, "then")],
+    )),
+    ("assert", ("then",), lambda d: (
+        _node(Assert, "obs", "then"),
+        [("observation", d, "assert"), ("contract", d, "then")],
+    )),
+    ("pay", ("token", "to", "then", "from_account"), _contract_pay),
+    ("when", ("timeout", "timeout_continuation"), _contract_when),
+)
+
+
+def _dispatch_contract(data) -> _Step:
     if isinstance(data, str):
         if data == "close":
-            return Close()
+            return _leaf(Close)
         else:
             raise ValueError(f"Unknown contract shorthand: {data}")
 
     if not isinstance(data, dict):
         raise ValueError(f"Invalid contract data: {data}")
 
-    if "if" in data and "then" in data and "else" in data:
-        return If(
-            cond=parse_observation(data["if"]),
-            then=parse_contract(data["then"]),
-            else_=parse_contract(data["else"]),
-        )
-    if "then" in data and "let" in data and "be" in data:
-        return Let(
-            name=data["let"],
-            value=parse_value(data["be"]),
-            then=parse_contract(data["then"]),
-        )
+    handler = _select_form(data, _CONTRACT_FORMS)
+    if handler is not None:
+        return handler(data)
 
-    # ADDED: Missing Assert contract [cite: 2038-2042, 2063-2064]
-    if "assert" in data and "then" in data:
-        return Assert(
-            obs=parse_observation(data["assert"]),
-            then=parse_contract(data["then"])
-        )
+    raise ValueError(f"Unrecognized contract structure: {data}")
 
-    if (
-        "token" in data
-        and "to" in data
-        and "then" in data
-        and "pay" in data
-        and "from_account" in data
-    ):
-        return Pay(
-            from_account=parse_party(data["from_account"]),
-            to=parse_payee(data["to"]),
-            token=parse_token(data["token"]),
-            value=parse_value(data["pay"]),
-            then=parse_contract(data["then"]),
-        )
-    if "when" in data and "timeout" in data and "timeout_continuation" in data:
-        return When(
-            cases=[parse_case(c) for c in data["when"]],
-            timeout=data["timeout"],
-            timeout_continuation=parse_contract(data["timeout_continuation"]),
-        )
 
-    raise ValueError(f"Unrecognized contract structure: {data}")
+_DISPATCH: Dict[str, Callable[[Any], _Step]] = {
+    "contract": _dispatch_contract,
+    "case": _dispatch_case,
+    "action": _dispatch_action,
+    "value": _dispatch_value,
+    "observation": _dispatch_observation,
+}
+
+
+# === Public parsers ===
+
+def parse_observation(data) -> Observation:
+    """Parses any Observation type """
+    return _parse("observation", data)
+
+def parse_value(data) -> "Value":
+    """Parses any Value type [cite: 1643-1690]"""
+    return _parse("value", data)
+
+def parse_action(data: dict):
+    return _parse("action", data)
+
+def parse_case(data: dict) -> Case:
+    return _parse("case", data)
+
+@traced("parse_contract")
+def parse_contract(data) -> Contract:
+    return _parse("contract", data)
+
+@traced("parse_contract_arena")
+def parse_contract_arena(data) -> ContractArena:
+    """Parses straight into a columnar ContractArena (no per-node objects for the tree)"""
+    arena = ContractArena()
+    return arena.seal(_parse("contract", data, arena.add))
 
 
 # === Example usage ===
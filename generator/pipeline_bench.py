@@ -0,0 +1,252 @@
+"""
+Pipeline benchmark (`cli.py bench`)
+
+Times every phase of the compiler on each input and reports, per phase,
+
+    median_ms / p95_ms   wall time over `repeat` runs (nearest-rank p95)
+    peak_kib             peak tracemalloc allocation above the phase's
+                         starting point, from one extra traced run
+
+Phases run in pipeline order on fresh objects every repetition:
+
+    json -> parse_contract -> parse_contract_to_infos -> build_stage_lookup
+         -> generate_module / generate_test_module / generate_ts_sdk
+         -> generate_bpmn_xml / generate_bpmn_svg -> validate_bpmn_xml
+
+Inputs are spec files and synthetic contracts from workload_generator.
+Results are plain JSON (BENCH_FORMAT, BENCH_VERSION); compare_results()
+flags phases whose median time or peak memory grew past a threshold
+relative to a stored baseline.
+"""
+
+import gc
+import json
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from bpmn_generator import generate_bpmn_svg, generate_bpmn_xml
+from bpmn_validate import validate_bpmn_xml
+from fsm_model import parse_contract_to_infos
+from move_generator import LoweringOptions, build_stage_lookup, generate_module, generate_test_module
+from parser import parse_contract
+from ts_generator import generate_ts_sdk
+from workload_generator import WorkloadShape, generate_contract
+
+BENCH_FORMAT = "marlowe-bench"
+BENCH_VERSION = 1
+
+PHASES = (
+    "json",
+    "parse_contract",
+    "parse_contract_to_infos",
+    "build_stage_lookup",
+    "generate_module",
+    "generate_test_module",
+    "generate_ts_sdk",
+    "generate_bpmn_xml",
+    "generate_bpmn_svg",
+    "validate_bpmn_xml",
+)
+
+PhaseTimer = Callable[[str], ContextManager[None]]
+
+
+@dataclass
+class BenchInput:
+    """One benchmarked contract: display name, suite ("specs" / "synthetic-N") and raw JSON bytes"""
+    name: str
+    suite: str
+    spec_bytes: bytes
+    unwrap: Optional[Callable[[Any], Any]] = None
+
+
+def synthetic_input(stages: int, seed: int = 0) -> BenchInput:
+    """Default-shape workload_generator contract of about `stages` stages"""
+    (contract, _) = generate_contract(WorkloadShape(stages=stages, seed=seed))
+    return BenchInput(name=f"synthetic_{stages}", suite=f"synthetic-{stages}", spec_bytes=json.dumps(contract).encode())
+
+
+# --- Running ---
+
+def run_pipeline(
+    item: BenchInput,
+    options: LoweringOptions,
+    deployment_path: str,
+    phase: PhaseTimer,
+) -> int:
+    """Runs every phase once under `phase(name)`; returns the stage count"""
+    with phase("json"):
+        data = json.loads(item.spec_bytes)
+        if item.unwrap is not None:
+            data = item.unwrap(data)
+    with phase("parse_contract"):
+        ast = parse_contract(data)
+    with phase("parse_contract_to_infos"):
+        (infos, stage_count) = parse_contract_to_infos(ast, stage=0, share_subtrees=options.share_continuations)
+    with phase("build_stage_lookup"):
+        stage_lookup = build_stage_lookup(infos)
+    with phase("generate_module"):
+        generate_module(infos, stage_lookup, module_name="bench", options=options)
+    with phase("generate_test_module"):
+        generate_test_module(stage_lookup, package_name="bench", options=options)
+    with phase("generate_ts_sdk"):
+        generate_ts_sdk(stage_lookup, deployment_path=deployment_path, module_name="bench", options=options)
+    with phase("generate_bpmn_xml"):
+        bpmn_xml = generate_bpmn_xml(ast, item.name)
+    with phase("generate_bpmn_svg"):
+        generate_bpmn_svg(ast, item.name)
+    with phase("validate_bpmn_xml"):
+        validate_bpmn_xml(bpmn_xml)
+    return stage_count
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def bench_input(item: BenchInput, options: LoweringOptions, deployment_path: str, repeat: int) -> Dict[str, Any]:
+    """Per-phase median / p95 (ms) and tracemalloc peak (KiB) for one input"""
+    samples: Dict[str, List[float]] = {name: [] for name in PHASES}
+
+    @contextmanager
+    def timed(name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        yield
+        samples[name].append((time.perf_counter() - start) * 1000)
+
+    peaks: Dict[str, int] = {}
+
+    @contextmanager
+    def traced(name: str) -> Iterator[None]:
+        tracemalloc.reset_peak()
+        (base, _) = tracemalloc.get_traced_memory()
+        yield
+        (_, peak) = tracemalloc.get_traced_memory()
+        peaks[name] = max(peak - base, 0)
+
+    result: Dict[str, Any] = {"suite": item.suite, "bytes": len(item.spec_bytes)}
+    try:
+        run_pipeline(item, options, deployment_path, lambda name: nullcontext())  # 暖機：lazy 初始化、intern table
+        for _ in range(repeat):
+            gc.collect()  # 前一輪的 AST / 字串不計入下一輪
+            result["stages"] = run_pipeline(item, options, deployment_path, timed)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run_pipeline(item, options, deployment_path, traced)
+        finally:
+            tracemalloc.stop()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    result["phases"] = {
+        name: {
+            "median_ms": round(statistics.median(samples[name]), 4),
+            "p95_ms": round(percentile(samples[name], 95), 4),
+            "peak_kib": round(peaks[name] / 1024, 1),
+        }
+        for name in PHASES
+    }
+    return result
+
+
+def run_bench(
+    inputs: List[BenchInput],
+    options: LoweringOptions,
+    deployment_path: str,
+    repeat: int = 5,
+    on_input: Optional[Callable[[BenchInput], None]] = None,
+) -> Dict[str, Any]:
+    """Benchmarks every input; returns the JSON-serializable result document"""
+    results: Dict[str, Any] = {}
+    for item in inputs:
+        if on_input is not None:
+            on_input(item)
+        results[item.name] = bench_input(item, options, deployment_path, repeat)
+    return {
+        "format": BENCH_FORMAT,
+        "version": BENCH_VERSION,
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "options": repr(options),
+        "results": results,
+    }
+
+
+def suite_totals(document: Dict[str, Any]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """suite -> phase -> summed median / p95 and max peak over the suite's inputs"""
+    totals: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for result in document["results"].values():
+        if "phases" not in result:
+            continue
+        suite = totals.setdefault(result["suite"], {})
+        for (name, stats) in result["phases"].items():
+            total = suite.setdefault(name, {"median_ms": 0.0, "p95_ms": 0.0, "peak_kib": 0.0})
+            total["median_ms"] += stats["median_ms"]
+            total["p95_ms"] += stats["p95_ms"]
+            total["peak_kib"] = max(total["peak_kib"], stats["peak_kib"])
+    return totals
+
+
+# --- Baseline comparison ---
+
+@dataclass
+class Regression:
+    input: str
+    phase: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else math.inf
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        document = json.load(f)
+    if not isinstance(document, dict) or document.get("format") != BENCH_FORMAT:
+        raise ValueError(f"{path} is not a {BENCH_FORMAT} result file")
+    if document.get("version") != BENCH_VERSION:
+        raise ValueError(f"{path}: unsupported bench version {document.get('version')} (expected {BENCH_VERSION})")
+    return document
+
+
+def compare_results(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float = 0.10,
+    min_ms: float = 0.1,
+    min_kib: float = 16.0,
+) -> List[Regression]:
+    """Phases whose median time / peak memory exceeds baseline * (1 + threshold).
+
+    Differences below `min_ms` / `min_kib` are treated as noise. Inputs or
+    phases missing from either side are not compared.
+    """
+    floors = {"median_ms": min_ms, "peak_kib": min_kib}
+    regressions: List[Regression] = []
+    for (name, result) in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or "phases" not in result or "phases" not in base:
+            continue
+        for (phase, stats) in result["phases"].items():
+            base_stats = base["phases"].get(phase)
+            if base_stats is None:
+                continue
+            for (metric, floor) in floors.items():
+                (old, new) = (base_stats[metric], stats[metric])
+                if new > old * (1 + threshold) and new - old > floor:
+                    regressions.append(Regression(name, phase, metric, old, new))
+    return regressions
+
@@ -4,7 +4,7 @@
 import json
 import sys
 
-from parser import parse_contract
+from parse_cache import parse_spec_bytes
 from bpmn_generator import generate_bpmn_xml, generate_bpmn_svg
 from bpmn_validate import validate_bpmn_xml
 
@@ -22,7 +22,7 @@ def main() -> int:
         process_name = request.get("process_name") or "Marlowe Contract"
 
         contract_json = unwrap_marlowe_payload(payload)
-        contract_ast = parse_contract(contract_json)
+        contract_ast = parse_spec_bytes(json.dumps(contract_json).encode(), with_infos=False).ast
 
         bpmn_xml = generate_bpmn_xml(contract_ast, process_name=process_name)
         svg = generate_bpmn_svg(contract_ast, process_name=process_name)
@@ -0,0 +1,188 @@
+"""
+Compilation session: one spec, every artifact
+
+validate / build / bpmn used to each open, parse and linearize the same spec,
+and the BPMN XML and SVG each re-ran the converter over the AST. A
+CompilationSession reads the spec once and derives everything lazily, each
+stage computed at most once:
+
+    spec bytes -> AST -> stage infos -> stage lookup -> Move / tests / SDK
+                               \\-> expression bytecode -> FSM IR
+               -> BPMN layout -> BPMN XML / SVG
+
+Back-end modules (TS SDK, FSM IR, BPMN / xml.etree) are imported by the
+artifact that needs them, so validating a spec loads only the front end.
+Parsing goes through the parse cache (parse_spec_bytes) unless `ast_arena`
+is set. `timings` accumulates wall time per phase in milliseconds (parse,
+lookup, move, tests, sdk, ir, bpmn), excluding the phases each one depends on.
+"""
+
+import io
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, TextIO, Tuple
+
+from fsm_model import StageTable, parse_contract_to_infos
+from move_generator import LoweringOptions, build_stage_lookup, generate_test_module, sanitize_module_name, write_module
+from optimizer import OptimizationReport
+from parse_cache import ParsedSpec, parse_spec_bytes
+from parser import parse_contract_arena
+
+if TYPE_CHECKING:
+    from bpmn_generator import MarloweToBpmnConverter
+
+
+class CompilationSession:
+    """Lazily computed, memoized artifacts of one spec"""
+
+    def __init__(
+        self,
+        spec_path: str,
+        options: Optional[LoweringOptions] = None,
+        unwrap: Optional[Callable[[Any], Any]] = None,
+        ast_arena: bool = False,
+        name: Optional[str] = None,
+    ) -> None:
+        self.spec_path = spec_path
+        self.options = (options or LoweringOptions()).normalized()
+        self.unwrap = unwrap
+        self.ast_arena = ast_arena
+        self.name = name or os.path.splitext(os.path.basename(spec_path))[0]
+        self.module_name = sanitize_module_name(self.name)
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def _phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    # --- Front end ---
+
+    @cached_property
+    def spec_bytes(self) -> bytes:
+        with open(self.spec_path, "rb") as f:
+            return f.read()
+
+    @cached_property
+    def parsed(self) -> ParsedSpec:
+        """AST (optimized when fold_constants) + stage infos + optimizer report"""
+        spec_bytes = self.spec_bytes
+        with self._phase("parse"):
+            if not self.ast_arena:
+                return parse_spec_bytes(spec_bytes, self.options, unwrap=self.unwrap)
+            # 大型 spec：AST 存在 columnar arena，fsm_model 透過 ArenaNode view 走訪 (不經 parse cache)
+            json_data = json.loads(spec_bytes)
+            if self.unwrap is not None:
+                json_data = self.unwrap(json_data)
+            ast = parse_contract_arena(json_data).view()
+            (infos, _) = parse_contract_to_infos(ast, stage=0, share_subtrees=self.options.share_continuations)
+            return ParsedSpec(ast=ast, infos=infos)
+
+    @property
+    def ast(self) -> Any:
+        return self.parsed.ast
+
+    @property
+    def infos(self) -> Dict[str, Any]:
+        return self.parsed.infos
+
+    @property
+    def report(self) -> Optional[OptimizationReport]:
+        return self.parsed.report
+
+    @cached_property
+    def source_ast(self) -> Any:
+        """AST as written in the spec (BPMN projects this, not the constant-folded tree)"""
+        # 已 parse 過 (未折疊) 就共用；否則只 parse 不 linearize (BPMN 不需要 token 對應)
+        if self.ast_arena or ("parsed" in self.__dict__ and not self.options.fold_constants):
+            return self.ast
+        spec_bytes = self.spec_bytes
+        with self._phase("parse"):
+            return parse_spec_bytes(spec_bytes, with_infos=False, unwrap=self.unwrap).ast
+
+    @cached_property
+    def stage_lookup(self) -> StageTable:
+        infos = self.infos
+        with self._phase("lookup"):
+            return build_stage_lookup(infos)
+
+    @cached_property
+    def bytecode(self) -> Dict[Tuple[str, int], bytes]:
+        from fsm_ir import expression_bytecode
+
+        infos = self.infos
+        with self._phase("ir"):
+            return expression_bytecode(infos)
+
+    # --- Back ends ---
+
+    def write_move(self, out: TextIO) -> None:
+        stage_lookup = self.stage_lookup
+        with self._phase("move"):
+            write_module(out, self.infos, stage_lookup, module_name=self.module_name, options=self.options)
+
+    def move_source(self) -> str:
+        out = io.StringIO()
+        self.write_move(out)
+        return out.getvalue()
+
+    @cached_property
+    def test_source(self) -> str:
+        stage_lookup = self.stage_lookup
+        with self._phase("tests"):
+            return generate_test_module(stage_lookup, package_name=self.module_name, options=self.options)
+
+    def write_ts(self, out: TextIO, deployment_path: str) -> None:
+        from ts_generator import write_ts_sdk
+
+        stage_lookup = self.stage_lookup
+        with self._phase("sdk"):
+            write_ts_sdk(
+                out,
+                stage_lookup,
+                deployment_path=deployment_path,
+                module_name=self.module_name,
+                options=self.options,
+            )
+
+    @cached_property
+    def ir_bytes(self) -> bytes:
+        from fsm_ir import encode_fsm_ir
+
+        bytecode = self.bytecode
+        with self._phase("ir"):
+            return encode_fsm_ir(self.infos, bytecode)
+
+    @cached_property
+    def ir_json(self) -> str:
+        from fsm_ir import ir_to_json
+
+        bytecode = self.bytecode
+        with self._phase("ir"):
+            return ir_to_json(self.infos, bytecode)
+
+    @cached_property
+    def bpmn_layout(self) -> "MarloweToBpmnConverter":
+        from bpmn_generator import MarloweToBpmnConverter
+
+        ast = self.source_ast
+        with self._phase("bpmn"):
+            return MarloweToBpmnConverter().layout(ast)
+
+    @cached_property
+    def bpmn_xml(self) -> str:
+        layout = self.bpmn_layout
+        with self._phase("bpmn"):
+            return layout.render_xml(self.name)
+
+    @cached_property
+    def bpmn_svg(self) -> str:
+        layout = self.bpmn_layout
+        with self._phase("bpmn"):
+            return layout.render_svg(self.name)
@@ -0,0 +1,126 @@
+"""
+Spec directory watcher for `cli.py watch`
+
+InotifyWatcher uses Linux inotify through ctypes (no extra dependency);
+PollingWatcher compares (mtime, size) snapshots and is used everywhere else
+or when inotify is unavailable. Both report the *.json file names that were
+written, created or moved into the directory since the previous call.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, Optional, Set, Tuple
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def _is_spec(name: str) -> bool:
+    return name.endswith(".json")
+
+
+class InotifyWatcher:
+    """Directory watch backed by inotify (Linux only)"""
+
+    def __init__(self, directory: str) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        # 編輯器常以「寫暫存檔再 rename」存檔，所以同時監看 MOVED_TO
+        wd = libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"inotify_add_watch({directory}): {os.strerror(errno)}")
+        self.directory = directory
+        self.fd = fd
+
+    def changes(self, timeout: Optional[float]) -> Set[str]:
+        """Spec names touched within `timeout` seconds (None: block until something changes)"""
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        names: Set[str] = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + _EVENT_HEADER.size <= len(data):
+                (_, _, _, length) = _EVENT_HEADER.unpack_from(data, pos)
+                pos += _EVENT_HEADER.size
+                name = data[pos:pos + length].rstrip(b"\0").decode(errors="replace")
+                pos += length
+                if _is_spec(name):
+                    names.add(name)
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: rescans the directory every `interval` seconds"""
+
+    def __init__(self, directory: str, interval: float = 0.25) -> None:
+        self.directory = directory
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot: Dict[str, Tuple[int, int]] = {}
+        for entry in os.scandir(self.directory):
+            if _is_spec(entry.name) and entry.is_file():
+                stat = entry.stat()
+                snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self, timeout: Optional[float]) -> Set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._scan()
+            names = {name for (name, sig) in current.items() if self._snapshot.get(name) != sig}
+            self._snapshot = current
+            if names:
+                return names
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            wait = self.interval if deadline is None else min(self.interval, max(deadline - time.monotonic(), 0))
+            time.sleep(wait)
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(directory: str, polling: bool = False, interval: float = 0.25):
+    """inotify when available, polling otherwise"""
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            pass  # 非 Linux 或 libc 無 inotify
+    return PollingWatcher(directory, interval)
+
+
+def wait_for_changes(watcher, debounce: float) -> Set[str]:
+    """Blocks for the next change, then keeps collecting until `debounce` seconds pass quietly"""
+    changed = watcher.changes(None)
+    while True:
+        more = watcher.changes(debounce)
+        if not more:
+            return changed
+        changed |= more
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+CLI startup benchmark
+
+The TUI and shell completions run `cli.py` for every refresh, so the import
+work done before a subcommand produces output matters as much as compile
+speed. This script runs each checked subcommand under `python -X importtime`
+and asserts
+
+    forbidden   heavy modules the subcommand must not load at all
+                (codegen, BPMN / xml.etree, process pool, watcher)
+    budget      median cumulative import time (ms) of everything cli.py
+                loads beyond bare interpreter startup
+
+Exit status is 1 when any check fails; .github/workflows/startup-budget.yml
+runs it on every change under generator/:
+
+    python generator/startup_bench.py [--repeat 5] [--scale 2.0]
+
+Budgets are about 2.5x the slowest median seen on a developer machine, so
+they only catch gross regressions (a heavy module pulled back into the
+startup path). The forbidden-module checks are the precise signal and do
+not depend on machine speed. `--scale` multiplies every budget for unusually
+slow runners.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPTS_DIR)
+CLI_SCRIPT = os.path.join(SCRIPTS_DIR, "cli.py")
+
+# 只有 build / bpmn / watch 等子命令才需要的模組
+BACKEND_MODULES = (
+    "ts_generator",
+    "bpmn_generator",
+    "bpmn_validate",
+    "xml.etree.ElementTree",
+    "fsm_ir",
+    "spec_watch",
+    "concurrent.futures.process",
+    "rich.progress",
+)
+COMPILER_MODULES = BACKEND_MODULES + ("session", "parse_cache", "fsm_model", "move_generator", "build_manifest")
+
+
+@dataclass(frozen=True)
+class StartupCheck:
+    name: str
+    argv: Tuple[str, ...]
+    budget_ms: float
+    forbidden: Tuple[str, ...]
+
+
+CHECKS = (
+    # 本機 median：--help 9-13 ms、list 52-68 ms、validate 85-170 ms
+    StartupCheck("--help", ("--help",), 40.0, COMPILER_MODULES + ("rich.console",)),
+    StartupCheck("list", ("list",), 175.0, COMPILER_MODULES),
+    StartupCheck("validate", ("validate", "--spec", "swap_ada"), 400.0, BACKEND_MODULES),
+)
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """(name as printed, self us, cumulative us) per `-X importtime` line; nesting is kept as leading spaces"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # 表頭 "self [us] | cumulative | imported package"
+        rows.append((parts[2].rstrip()[1:], int(parts[0]), int(parts[1])))
+    return rows
+
+
+def _run_importtime(argv: List[str]) -> Tuple[int, str]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *argv],
+        cwd=ROOT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+    return (proc.returncode, proc.stderr)
+
+
+def interpreter_modules() -> Set[str]:
+    """Modules a bare `python -c pass` already imports (site, encodings, ...)"""
+    (_, stderr) = _run_importtime(["-c", "pass"])
+    return {name.strip() for (name, _, _) in parse_importtime(stderr)}
+
+
+def measure(check: StartupCheck, baseline: Set[str]) -> Tuple[float, Set[str], Optional[str]]:
+    """One run: (import ms beyond the interpreter baseline, modules loaded, error)"""
+    (returncode, stderr) = _run_importtime([CLI_SCRIPT, *check.argv])
+    rows = parse_importtime(stderr)
+    loaded = {name.strip() for (name, _, _) in rows}
+    # 只加總最外層 import (巢狀的已含在 cumulative 內)
+    total_us = sum(cumulative for (name, _, cumulative) in rows if not name.startswith(" ") and name not in baseline)
+    error = None
+    if "Traceback" in stderr or returncode not in (0, 1):
+        error = stderr.strip().splitlines()[-1] if stderr.strip() else f"exit status {returncode}"
+    return (total_us / 1000, loaded, error)
+
+
+def run_checks(checks: Tuple[StartupCheck, ...], repeat: int, scale: float) -> bool:
+    baseline = interpreter_modules()
+    ok = True
+    for check in checks:
+        _run_importtime([CLI_SCRIPT, *check.argv])  # 先跑一次：寫入 .pyc / parse cache
+        samples: List[float] = []
+        loaded: Set[str] = set()
+        errors: Dict[str, None] = {}
+        for _ in range(repeat):
+            (ms, modules, error) = measure(check, baseline)
+            samples.append(ms)
+            loaded |= modules
+            if error:
+                errors[error] = None
+        median = statistics.median(samples)
+        budget = check.budget_ms * scale
+        leaked = [module for module in check.forbidden if module in loaded]
+        passed = median <= budget and not leaked and not errors
+        status = "ok" if passed else "FAIL"
+        print(f"{status:4}  {check.name:10} {median:7.1f} ms  (budget {budget:.0f} ms, {len(loaded)} modules)")
+        for module in leaked:
+            print(f"      imports {module}")
+        for error in errors:
+            print(f"      error: {error}")
+        ok = ok and passed
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check cli.py import-time budgets per subcommand")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per subcommand; the median is checked (default: 5)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget (default: 1.0)")
+    parser.add_argument("--only", choices=[check.name for check in CHECKS], help="Run a single check")
+    args = parser.parse_args()
+    checks = tuple(check for check in CHECKS if args.only in (None, check.name))
+    return 0 if run_checks(checks, max(args.repeat, 1), args.scale) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
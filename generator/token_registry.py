@@ -0,0 +1,213 @@
+"""
+Token registry: Marlowe token -> Sui Move coin type
+
+Resolution used to re-read and re-parse MARLOWE_TOKEN_MAP_JSON on every
+Pay / Deposit / AvailableMoney. A TokenRegistry is built once from
+
+    1. built-in defaults (TOKEN_MAP)
+    2. the registry file of the selected network
+       (MARLOWE_TOKEN_REGISTRY, default <repo>/deployments/tokens.<network>.json)
+    3. MARLOWE_TOKEN_MAP_JSON overrides
+
+later sources winning, and answers lookups from a precompiled index:
+exact "symbol:name" key, Move-type pass-through (symbol contains "::"),
+then the SUI default for the empty token.
+
+balance_key() gives the account key the deposit path writes on-chain
+(type_name::into_string: 64 hex digits, no 0x, then ::module::Name). Named
+addresses come from NAMED_ADDRESSES; the package's own address ("test",
+0x0 in Move.toml) is the package_id of deployments/deployment.json.
+
+Environment:
+    MARLOWE_NETWORK         network whose registry file is loaded (default: testnet)
+    MARLOWE_TOKEN_REGISTRY  explicit registry file (JSON object "symbol:name" -> Move type)
+    MARLOWE_TOKEN_MAP_JSON  inline overrides, same format
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, Optional, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_NETWORK = "testnet"
+
+# Global Token Map configuration
+# This can be expanded to include Mainnet addresses.
+TOKEN_MAP = {
+    ":": "sui::sui::SUI",
+    ":SUI": "sui::sui::SUI",
+    "0x2::sui::SUI:SUI": "sui::sui::SUI", # Explicit
+    # Mapping for Swap ADA spec (Mock Dollar)
+    "85bb65085bb65085bb65085bb65085bb65085bb65085bb65085bb650:dollar": "test::mock_dollar::DOLLAR",
+    # Mocks for ETH/USDC
+    "test::mock_eth::ETH:ETH": "test::mock_eth::ETH",
+    "test::mock_usdc::USDC:USDC": "test::mock_usdc::USDC"
+}
+
+SUI_TYPE = "sui::sui::SUI"
+
+# contract/Move.toml [addresses]，外加 framework 的 std
+NAMED_ADDRESSES = {"std": "0x1", "sui": "0x2"}
+PACKAGE_ADDRESS_NAME = "test"
+DEPLOYMENT_FILE = os.path.join(ROOT_DIR, "deployments", "deployment.json")
+
+# 後面接 ::module:: 的片段即 address (泛型參數內的也算)
+_ADDRESS_RE = re.compile(r"(?<![\w:])(0x[0-9a-fA-F]+|[A-Za-z_]\w*)(?=::\w+::)")
+
+
+def _check_entries(entries: Any, source: str) -> Dict[str, str]:
+    if not isinstance(entries, dict):
+        raise ValueError(f"{source} must be a JSON object")
+    for (k, v) in entries.items():
+        if not (isinstance(k, str) and isinstance(v, str)):
+            raise ValueError(f"{source} entries must be string:string")
+    return entries
+
+
+def registry_path(network: Optional[str] = None) -> str:
+    """Registry file for `network` (MARLOWE_TOKEN_REGISTRY wins when set)"""
+    explicit = os.environ.get("MARLOWE_TOKEN_REGISTRY", "").strip()
+    if explicit:
+        return explicit
+    network = network or os.environ.get("MARLOWE_NETWORK", "").strip() or DEFAULT_NETWORK
+    return os.path.join(ROOT_DIR, "deployments", f"tokens.{network}.json")
+
+
+class TokenRegistry:
+    """Merged token map plus a per-(symbol, name) resolution index"""
+
+    def __init__(
+        self, entries: Dict[str, str], path: Optional[str] = None, addresses: Optional[Dict[str, str]] = None
+    ) -> None:
+        self.entries: Dict[str, str] = dict(entries)
+        self.path = path
+        self.addresses: Dict[str, str] = dict(NAMED_ADDRESSES if addresses is None else addresses)
+        # (symbol, name) -> Move type；解析過的 token 之後都是一次 dict 查詢
+        self._index: Dict[Tuple[str, str], str] = {}
+        for (key, move_type) in self.entries.items():
+            (symbol, sep, name) = key.rpartition(":")
+            if sep:
+                self._index[(symbol, name)] = move_type
+        self._fingerprint: Optional[str] = None
+
+    @classmethod
+    def load(cls, network: Optional[str] = None, inline: Optional[str] = None) -> "TokenRegistry":
+        """Built-ins, then the network's registry file (if present), then inline JSON overrides"""
+        merged = dict(TOKEN_MAP)
+        path = registry_path(network)
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                merged.update(_check_entries(json.load(f), path))
+        else:
+            path = None
+        if inline is None:
+            inline = os.environ.get("MARLOWE_TOKEN_MAP_JSON", "")
+        inline = inline.strip()
+        if inline:
+            merged.update(_check_entries(json.loads(inline), "MARLOWE_TOKEN_MAP_JSON"))
+        addresses = dict(NAMED_ADDRESSES)
+        if os.path.isfile(DEPLOYMENT_FILE):
+            with open(DEPLOYMENT_FILE, "r", encoding="utf-8") as f:
+                package_id = json.load(f).get("package_id")
+            if isinstance(package_id, str) and package_id.startswith("0x"):
+                addresses[PACKAGE_ADDRESS_NAME] = package_id
+        return cls(merged, path, addresses)
+
+    def resolve(self, token_info: Dict[str, str]) -> str:
+        """
+        Converts Marlowe Token JSON representation to a Sui Move type string.
+        Priority:
+        1. Lookup in the merged map (Key = "symbol:name")
+        2. Pass-through if symbol looks like a Move type (contains "::")
+        3. SUI for the empty token, otherwise ValueError
+        """
+        currency_symbol = token_info.get("currency_symbol", "")
+        token_name = token_info.get("token_name", "")
+        key = (currency_symbol, token_name)
+        move_type = self._index.get(key)
+        if move_type is not None:
+            return move_type
+
+        # 名稱本身含 ':' 時 index 的切分可能不同，退回完整 key 比對
+        move_type = self.entries.get(f"{currency_symbol}:{token_name}")
+        if move_type is None and "::" in currency_symbol:
+            move_type = currency_symbol
+        elif move_type is None and not currency_symbol and not token_name:
+            move_type = SUI_TYPE
+        elif move_type is None:
+            raise ValueError(f"Could not map Marlowe token to Move type: {token_info}")
+        self._index[key] = move_type
+        return move_type
+
+    def can_resolve(self, token_info: Dict[str, str]) -> bool:
+        try:
+            self.resolve(token_info)
+        except ValueError:
+            return False
+        return True
+
+    def type_name(self, move_type: str) -> str:
+        """`move_type` as type_name::into_string spells it (addresses as 64 hex digits without 0x)"""
+        def address(match: "re.Match[str]") -> str:
+            literal = match.group(1)
+            if not literal.startswith("0x"):
+                if literal not in self.addresses:
+                    raise ValueError(f"No address known for named address '{literal}' in {move_type}")
+                literal = self.addresses[literal]
+            return literal[2:].lower().rjust(64, "0")
+        return _ADDRESS_RE.sub(address, move_type)
+
+    def balance_key(self, token_info: Dict[str, str]) -> str:
+        """Account key the RPN AvailableMoney ops read; the deposit path writes the same string"""
+        return self.type_name(self.resolve(token_info))
+
+    def fingerprint(self) -> str:
+        """Digest of the merged map and named addresses (part of the parse cache key)"""
+        if self._fingerprint is None:
+            text = json.dumps([self.entries, self.addresses], sort_keys=True)
+            self._fingerprint = hashlib.sha256(text.encode()).hexdigest()[:16]
+        return self._fingerprint
+
+
+_current: Optional[TokenRegistry] = None
+_current_state: Optional[Tuple[Any, ...]] = None
+
+
+def _file_state(path: str) -> Tuple[int, int]:
+    """(mtime_ns, size)；檔案不存在時為 (0, -1)"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (0, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _env_state() -> Tuple[Any, ...]:
+    env = os.environ
+    return (
+        env.get("MARLOWE_NETWORK", ""),
+        env.get("MARLOWE_TOKEN_REGISTRY", ""),
+        env.get("MARLOWE_TOKEN_MAP_JSON", ""),
+        # watch / 長時間執行的行程在檔案被編輯後也要重新載入
+        _file_state(registry_path()),
+        _file_state(DEPLOYMENT_FILE),
+    )
+
+
+def current_token_registry() -> TokenRegistry:
+    """Process-wide registry; rebuilt when the token environment or the files it reads change"""
+    global _current, _current_state
+    state = _env_state()
+    if _current is None or state != _current_state:
+        _current = TokenRegistry.load()
+        _current_state = state
+    return _current
+
+
+def reset_token_registry() -> None:
+    """Forces the next lookup to reload (e.g. after an edit within the same mtime tick)"""
+    global _current, _current_state
+    _current = None
+    _current_state = None
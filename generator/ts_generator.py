@@ -1,9 +1,23 @@
+import io
 import json
-from typing import Dict, List, Any
-from fsm_model import ChoiceStageInfo, DepositStageInfo, NotifyStageInfo
-from move_generator import parse_party_str
+from typing import Dict, List, Any, Optional, TextIO, Union
+from fsm_model import ChoiceStageInfo, DepositStageInfo, NotifyStageInfo, StageTable, as_stage_table, build_symbol_table
+from instrumentation import traced
+from move_generator import parse_party_str, LoweringOptions
+
+@traced("write_ts_sdk")
+def write_ts_sdk(
+    out: TextIO,
+    infos: Union[Dict[str, List[Any]], StageTable],
+    deployment_path: str = "deployment.json",
+    module_name: str = "generated_marlowe",
+    options: Optional[LoweringOptions] = None,
+) -> None:
+    """Writes the TypeScript SDK to `out`, one method at a time"""
+    options = (options or LoweringOptions()).normalized()
+    stages = as_stage_table(infos)
+    symbols = build_symbol_table(stages.infos) if options.symbol_keys else None
 
-def generate_ts_sdk(infos: Dict[str, List[Any]], deployment_path: str = "deployment.json", module_name: str = "generated_marlowe") -> str:
     # 1. Load Deployment Config
     try:
         with open(deployment_path, "r") as f:
@@ -15,51 +29,64 @@ def generate_ts_sdk(infos: Dict[str, List[Any]], deployment_path: str = "deploym
         contract_id = "YOUR_CONTRACT_ID"
 
     # 2. Header & Imports
-    ts_code = f"""
-import {{ Transaction }} from '@mysten/sui/transactions';
-import {{ bcs }} from '@mysten/sui/bcs';
-
-export const PACKAGE_ID = "{package_id}";
-export const CONTRACT_ID = "{contract_id}";
-
-export class MarloweContract {{
-    packageId: string;
-    contractId: string;
-    moduleId: string = "{module_name}";
-
-    constructor(packageId: string = PACKAGE_ID, contractId: string = CONTRACT_ID) {{
-        this.packageId = packageId;
-        this.contractId = contractId;
-    }}
-
-    /**
-     * Helper to call a Move function
+    if symbols:
+        role_ids = {party[5:-1]: pid for party, pid in symbols.party.items() if party.startswith("Role(")}
+        symbol_maps = f"""
+// Compile-time ids used as on-chain keys (LoweringOptions.symbol_keys)
+export const ROLE_IDS: Record<string, number> = {json.dumps(role_ids)};
+export const TOKEN_IDS: Record<string, number> = {json.dumps(symbols.token)};
+"""
+        role_methods = """    /**
+     * Mint a Role NFT (Requires AdminCap)
+     * @param role Role id from ROLE_IDS
      */
-    private moveCall(tx: Transaction, func: string, args: any[], typeArgs: string[] = []) {{
-        tx.moveCall({{
-            target: `${{this.packageId}}::${{this.moduleId}}::${{func}}`,
-            arguments: args,
-            typeArguments: typeArgs,
-        }});
-    }}
+    mintRole(tx: Transaction, adminCap: string, role: number | bigint, recipient: string) {
+        this.moveCall(tx, 'mint_role', [
+            tx.object(adminCap),
+            tx.object(this.contractId),
+            tx.pure(bcs.u64().serialize(role)),
+            tx.pure(bcs.Address.serialize(recipient))
+        ]);
+    }
 
     /**
+     * Withdraw Assets (via Role)
+     * @param tokenId Token id from TOKEN_IDS matching typeArg
+     * @param typeArg The Coin Type (e.g. '0x2::sui::SUI')
+     */
+    withdraw(tx: Transaction, roleNftId: string, tokenId: number | bigint, amount: bigint, typeArg: string) {
+        this.moveCall(
+            tx, 
+            'withdraw_by_role', 
+            [
+                tx.object(this.contractId),
+                tx.object(roleNftId),
+                tx.pure(bcs.u64().serialize(tokenId)),
+                tx.pure(bcs.u64().serialize(amount))
+            ],
+            [typeArg]
+        );
+    }
+"""
+    else:
+        symbol_maps = ""
+        role_methods = """    /**
      * Mint a Role NFT (Requires AdminCap)
      */
-    mintRole(tx: Transaction, adminCap: string, name: string, recipient: string) {{
+    mintRole(tx: Transaction, adminCap: string, name: string, recipient: string) {
         this.moveCall(tx, 'mint_role', [
             tx.object(adminCap),
             tx.object(this.contractId),
             tx.pure(bcs.string().serialize(name)),
             tx.pure(bcs.Address.serialize(recipient))
         ]);
-    }}
+    }
 
     /**
      * Withdraw Assets (via Role)
      * @param typeArg The Coin Type (e.g. '0x2::sui::SUI')
      */
-    withdraw(tx: Transaction, roleNftId: string, amount: bigint, typeArg: string) {{
+    withdraw(tx: Transaction, roleNftId: string, amount: bigint, typeArg: string) {
         this.moveCall(
             tx, 
             'withdraw_by_role', 
@@ -70,30 +97,57 @@ export class MarloweContract {{
             ],
             [typeArg]
         );
-    }}
+    }
 """
 
+    out.write(f"""
+import {{ Transaction }} from '@mysten/sui/transactions';
+import {{ bcs }} from '@mysten/sui/bcs';
+
+export const PACKAGE_ID = "{package_id}";
+export const CONTRACT_ID = "{contract_id}";
+{symbol_maps}
+export class MarloweContract {{
+    packageId: string;
+    contractId: string;
+    moduleId: string = "{module_name}";
+
+    constructor(packageId: string = PACKAGE_ID, contractId: string = CONTRACT_ID) {{
+        this.packageId = packageId;
+        this.contractId = contractId;
+    }}
+
+    /**
+     * Helper to call a Move function
+     */
+    private moveCall(tx: Transaction, func: string, args: any[], typeArgs: string[] = []) {{
+        tx.moveCall({{
+            target: `${{this.packageId}}::${{this.moduleId}}::${{func}}`,
+            arguments: args,
+            typeArguments: typeArgs,
+        }});
+    }}
+
+{role_methods}""")
+
     # 3. Generate Methods for Each Stage
-    # Iterate through all stages in 'infos'
-    # We want to sort them by stage/case to be neat, but dict iteration involves keys "choice", "deposit" etc.
-    # Let's just iterate logical types.
+    # Per-kind views of the stage table, in linearization order.
 
     # --- Choices ---
-    if "choice" in infos:
-        for choice in infos["choice"]:
-            fn_name = f"choice_stage_{choice.stage}_case_{choice.case_index}"
-            ts_method_name = f"choice_Stage{choice.stage}_{choice.case_index}_{choice.choice_name}"
-            
-            (party_type, party_name) = parse_party_str(choice.by)
-            
-            # Param generation
-            # If Role: need (role_nft_obj)
-            # If Address: checks sender (no extra arg)
-            
-            params_doc = f" * @param choiceVal Value between {choice.bounds[0]['from']} and {choice.bounds[0]['to']}" if choice.bounds else ""
-            
-            if party_type == "role":
-                ts_code += f"""
+    for choice in stages.of_kind("choice"):
+        fn_name = f"choice_stage_{choice.stage}_case_{choice.case_index}"
+        ts_method_name = f"choice_Stage{choice.stage}_{choice.case_index}_{choice.choice_name}"
+        
+        (party_type, party_name) = parse_party_str(choice.by)
+        
+        # Param generation
+        # If Role: need (role_nft_obj)
+        # If Address: checks sender (no extra arg)
+        
+        params_doc = f" * @param choiceVal Value between {choice.bounds[0]['from']} and {choice.bounds[0]['to']}" if choice.bounds else ""
+        
+        if party_type == "role":
+            out.write(f"""
     /**
      * Stage {choice.stage}: Choice '{choice.choice_name}' by Role '{party_name}'
      {params_doc}
@@ -105,9 +159,9 @@ export class MarloweContract {{
             tx.pure(bcs.u64().serialize(choiceVal))
         ]);
     }}
-"""
-            else: # Address
-                ts_code += f"""
+""")
+        else: # Address
+            out.write(f"""
     /**
      * Stage {choice.stage}: Choice '{choice.choice_name}' by Address {party_name}
      {params_doc}
@@ -118,16 +172,15 @@ export class MarloweContract {{
             tx.pure(bcs.u64().serialize(choiceVal))
         ]);
     }}
-"""
+""")
 
     # --- Deposits ---
-    if "deposit" in infos:
-        for dep in infos["deposit"]:
-            fn_name = f"deposit_stage_{dep.stage}_case_{dep.case_index}"
-            ts_method_name = f"deposit_Stage{dep.stage}_{dep.case_index}"
-            
-            # Param: coin object
-            ts_code += f"""
+    for dep in stages.of_kind("deposit"):
+        fn_name = f"deposit_stage_{dep.stage}_case_{dep.case_index}"
+        ts_method_name = f"deposit_Stage{dep.stage}_{dep.case_index}"
+        
+        # Param: coin object
+        out.write(f"""
     /**
      * Stage {dep.stage}: Deposit into '{dep.into_account}'
      */
@@ -137,15 +190,14 @@ export class MarloweContract {{
             tx.object(coinObj)
         ]);
     }}
-"""
+""")
 
     # --- Notify ---
-    if "notify" in infos:
-        for notif in infos["notify"]:
-            fn_name = f"notify_stage_{notif.stage}_case_{notif.case_index}"
-            ts_method_name = f"notify_Stage{notif.stage}_{notif.case_index}"
-            
-            ts_code += f"""
+    for notif in stages.of_kind("notify"):
+        fn_name = f"notify_stage_{notif.stage}_case_{notif.case_index}"
+        ts_method_name = f"notify_Stage{notif.stage}_{notif.case_index}"
+        
+        out.write(f"""
     /**
      * Stage {notif.stage}: Notify
      */
@@ -154,20 +206,19 @@ export class MarloweContract {{
             tx.object(this.contractId)
         ]);
     }}
-"""
+""")
 
     # --- Timeouts ---
     # Collect Timeouts map
     timeouts_map = {}
-    if "when" in infos:
-        for when in infos["when"]:
-            if when.timeout:
-                timeouts_map[when.stage] = when.timeout
-            
-            # Generate timeout method
-            fn_name = f"timeout_stage_{when.stage}"
-            ts_method_name = f"timeout_Stage{when.stage}"
-            ts_code += f"""
+    for when in stages.of_kind("when"):
+        if when.timeout:
+            timeouts_map[when.stage] = when.timeout
+        
+        # Generate timeout method
+        fn_name = f"timeout_stage_{when.stage}"
+        ts_method_name = f"timeout_Stage{when.stage}"
+        out.write(f"""
     /**
      * Stage {when.stage}: Timeout Action (Trigger when time >= {when.timeout})
      */
@@ -176,7 +227,7 @@ export class MarloweContract {{
             tx.object(this.contractId)
         ]);
     }}
-"""
+""")
 
     # Inject static TIMEOUTS map at top of class? Or end?
     # Actually TypeScript static property.
@@ -187,15 +238,27 @@ export class MarloweContract {{
     # Let's add readonly property `timeouts`.
     
     timeouts_json = json.dumps(timeouts_map)
-    ts_code += f"""
+    out.write(f"""
     public getTimeouts(): Record<number, number> {{
         return {timeouts_json};
     }}
-"""
+""")
 
     # End Class
-    ts_code += "\n}\n"
-    return ts_code
+    out.write("\n}\n")
+
+
+def generate_ts_sdk(
+    infos: Union[Dict[str, List[Any]], StageTable],
+    deployment_path: str = "deployment.json",
+    module_name: str = "generated_marlowe",
+    options: Optional[LoweringOptions] = None,
+) -> str:
+    """write_ts_sdk into a string"""
+    out = io.StringIO()
+    write_ts_sdk(out, infos, deployment_path, module_name, options)
+    return out.getvalue()
+
 
 if __name__ == "__main__":
     # Test stub
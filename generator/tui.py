@@ -27,8 +27,7 @@ except ImportError:
     exit(1)
 
 # Local imports
-from parser import parse_contract
-from fsm_model import parse_contract_to_infos
+from parse_cache import parse_spec_file
 from move_generator import generate_module, build_stage_lookup, generate_test_module, sanitize_module_name
 from ts_generator import generate_ts_sdk
 
@@ -287,11 +286,7 @@ class MarloweCompilerApp(App):
         self.log_message(f"[blue]Validating {self.selected_spec}...[/]")
         
         try:
-            with open(spec_path, "r") as f:
-                json_data = json.load(f)
-            
-            contract_ast = parse_contract(json_data)
-            (infos, _) = parse_contract_to_infos(contract_ast, stage=0)
+            infos = parse_spec_file(spec_path).infos
             
             self.log_message(f"[green]✓ {self.selected_spec} is valid ({len(infos)} stages)[/]")
             
@@ -313,12 +308,8 @@ class MarloweCompilerApp(App):
         module_name = sanitize_module_name(self.selected_spec)
         
         try:
-            # Parse
-            with open(spec_path, "r") as f:
-                json_data = json.load(f)
-            
-            contract_ast = parse_contract(json_data)
-            (infos, _) = parse_contract_to_infos(contract_ast, stage=0)
+            # Parse (cached by spec content hash)
+            infos = parse_spec_file(spec_path).infos
             stage_lookup = build_stage_lookup(infos)
             
             self.log_message(f"  Parsed: {len(infos)} stages")
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Synthetic Marlowe workload generator
+
+Emits valid Marlowe JSON of controllable size and shape for scale testing
+the parser, linearizer, Move emitter and BPMN layout. Everything is drawn
+from a seeded RNG, so a WorkloadShape always yields the same contract.
+
+    stages       approximate number of linearized stages
+    when_fanout  cases per When; each case continues into its own subtree
+    if_depth     nested If guards on every case path (else -> close)
+    pay_chain    Pays on every case path before the continuation
+    parties      distinct role_token parties
+    tokens       distinct tokens (SUI, mock USDC / ETH, then test::synthetic_tN::TN)
+    expr_depth   nesting depth of every Value / Observation
+
+The tree is assembled bottom-up from a queue of subtrees (`when_fanout`
+subtrees per When), so nesting depth grows with log(stages) rather than
+stages (when_fanout 1 gives a single chain). Inner Whens time out later than
+their ancestors. Output uses only the constructs the validator skill
+accepts (no Let / Assert) and the Move lowering supports (no negate, no
+negative constants), and every token resolves without a registry entry.
+JSON is written compact. The validator skill walks contracts recursively, so
+--check skips it (and says so) past VALIDATOR_MAX_NESTING contract levels.
+
+    python generator/workload_generator.py --stages 5000 --fanout 3 --seed 7 -o /tmp/big.json --check
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Tuple
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPTS_DIR)
+VALIDATOR_SCRIPT = os.path.join(ROOT_DIR, ".codex", "skills", "marlowe-json-validator", "scripts", "validate_marlowe_json.py")
+# validator 每層巢狀 contract 遞迴一次，在 CPython 預設 recursion limit (1000) 下約到此為止
+VALIDATOR_MAX_NESTING = 950
+
+# 內建 token map 已有的前三個；之後以 "::" pass-through，不需 registry
+_KNOWN_TOKENS = (
+    ("0x2::sui::SUI", "SUI"),
+    ("test::mock_usdc::USDC", "USDC"),
+    ("test::mock_eth::ETH", "ETH"),
+)
+
+LATEST_TIMEOUT = 2_000_000_000_000  # ms (2033-05)；越外層的 When 越早到期
+TIMEOUT_STEP = 60_000
+
+
+@dataclass(frozen=True)
+class WorkloadShape:
+    """Size / shape knobs of a synthetic contract"""
+    stages: int = 100
+    when_fanout: int = 2
+    if_depth: int = 1
+    pay_chain: int = 1
+    parties: int = 4
+    tokens: int = 1
+    expr_depth: int = 2
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        for (name, minimum) in (("stages", 1), ("when_fanout", 1), ("if_depth", 0), ("pay_chain", 0),
+                                ("parties", 2), ("tokens", 1), ("expr_depth", 0)):
+            if getattr(self, name) < minimum:
+                raise ValueError(f"{name} must be at least {minimum}")
+
+
+class WorkloadGenerator:
+    """Builds one contract for `shape`; `stages` counts the contract nodes emitted"""
+
+    def __init__(self, shape: WorkloadShape) -> None:
+        self.shape = shape
+        self.rng = random.Random(shape.seed)
+        self.stages = 0
+        self._whens = 0
+        self._choices: List[Dict[str, Any]] = []
+        self._parties = [{"role_token": f"Party {i}"} for i in range(shape.parties)]
+        self._tokens = [
+            {"currency_symbol": symbol, "token_name": name}
+            for (symbol, name) in (
+                _KNOWN_TOKENS[i] if i < len(_KNOWN_TOKENS) else (f"test::synthetic_t{i}::T{i}", f"T{i}")
+                for i in range(shape.tokens)
+            )
+        ]
+
+    # --- Leaves ---
+
+    def _party(self) -> Dict[str, str]:
+        return self.rng.choice(self._parties)
+
+    def _token(self) -> Dict[str, str]:
+        return self.rng.choice(self._tokens)
+
+    def _constant(self) -> Any:
+        amount = self.rng.randint(1, 1_000_000)
+        return amount if self.rng.random() < 0.5 else {"constant": amount}
+
+    def _value_leaf(self) -> Any:
+        roll = self.rng.random()
+        if roll < 0.3 and self._choices:
+            return {"value_of_choice": self.rng.choice(self._choices)}
+        if roll < 0.6:
+            return {"amount_of_token": self._token(), "in_account": self._party()}
+        if roll < 0.65:
+            return self.rng.choice(("time_interval_start", "time_interval_end"))
+        return self._constant()
+
+    # --- Expressions (left/right-deep: size grows linearly with depth) ---
+
+    def value(self, depth: int) -> Any:
+        if depth <= 0:
+            return self._value_leaf()
+        deep = self.value(depth - 1)
+        op = self.rng.choice(("add", "minus", "multiply", "divide"))
+        if op == "divide":
+            return {"divide": deep, "by": {"constant": self.rng.randint(1, 100)}}
+        (lhs, rhs) = (deep, self._value_leaf()) if self.rng.random() < 0.5 else (self._value_leaf(), deep)
+        if op == "add":
+            return {"add": lhs, "and": rhs}
+        if op == "minus":
+            return {"value": lhs, "minus": rhs}
+        return {"multiply": lhs, "times": rhs}
+
+    def _comparison(self, depth: int) -> Dict[str, Any]:
+        op = self.rng.choice(("ge_than", "gt", "lt", "le_than", "equal_to"))
+        return {"value": self.value(depth), op: self._value_leaf()}
+
+    def observation(self, depth: int) -> Any:
+        if depth <= 1:
+            if self._choices and self.rng.random() < 0.1:
+                return {"chose_something_for": self.rng.choice(self._choices)}
+            return self._comparison(0)
+        roll = self.rng.random()
+        if roll < 0.3:
+            return {"both": self.observation(depth - 1), "and": self._comparison(0)}
+        if roll < 0.6:
+            return {"either": self._comparison(0), "or": self.observation(depth - 1)}
+        if roll < 0.7:
+            return {"not": self.observation(depth - 1)}
+        return self._comparison(depth - 1)
+
+    # --- Contracts ---
+
+    def _action(self) -> Dict[str, Any]:
+        roll = self.rng.random()
+        party = self._party()
+        if roll < 0.5:
+            return {"party": party, "deposits": self.value(self.shape.expr_depth), "of_token": self._token(), "into_account": party}
+        if roll < 0.8:
+            choice_id = {"choice_name": f"choice_{len(self._choices)}", "choice_owner": party}
+            self._choices.append(choice_id)
+            low = self.rng.randint(0, 100)
+            bounds = [{"from": low, "to": low + self.rng.randint(0, 1000)}]
+            if self.rng.random() < 0.2:
+                bounds.append({"from": bounds[0]["to"] + 1, "to": bounds[0]["to"] + 1 + self.rng.randint(0, 1000)})
+            return {"for_choice": choice_id, "choose_between": bounds}
+        return {"notify_if": self.observation(max(self.shape.expr_depth, 1))}
+
+    def _close(self) -> str:
+        self.stages += 1
+        return "close"
+
+    def _case_path(self, then: Any) -> Any:
+        """Pay chain then If guards (built inside-out) in front of `then`"""
+        for _ in range(self.shape.pay_chain):
+            payer = self._party()
+            payee = self._party()
+            self.stages += 1
+            then = {
+                "pay": self.value(self.shape.expr_depth),
+                "token": self._token(),
+                "from_account": payer,
+                "to": {"party": payee} if self.rng.random() < 0.7 else {"account": payee},
+                "then": then,
+            }
+        for _ in range(self.shape.if_depth):
+            self.stages += 1
+            then = {"if": self.observation(max(self.shape.expr_depth, 1)), "then": then, "else": self._close()}
+        return then
+
+    def _when(self, continuations: List[Any]) -> Dict[str, Any]:
+        self.stages += 1
+        timeout = LATEST_TIMEOUT - self._whens * TIMEOUT_STEP
+        self._whens += 1
+        return {
+            "when": [{"case": self._action(), "then": self._case_path(then)} for then in continuations],
+            "timeout": timeout,
+            "timeout_continuation": self._close(),
+        }
+
+    def _leaf_count(self) -> int:
+        """Leaves so that a full `when_fanout`-ary tree lands near `stages`"""
+        shape = self.shape
+        per_case = 2 * shape.if_depth + shape.pay_chain
+        if shape.when_fanout == 1:
+            return 1
+        # S = L(1 + g) + W(2 + g) - g，W = (L - 1) / (f - 1)
+        per_when = (2 + per_case) / (shape.when_fanout - 1)
+        return max(round((shape.stages + per_case + per_when) / (1 + per_case + per_when)), 1)
+
+    def generate(self) -> Any:
+        pool: Deque[Any] = deque(self._close() for _ in range(self._leaf_count()))
+        while len(pool) > 1:
+            take = min(self.shape.when_fanout, len(pool))
+            pool.append(self._when([pool.popleft() for _ in range(take)]))
+        contract = pool[0]
+        # fan-out 1 (或目標大於完整樹)：在根上再疊單一 case 的 When 直到接近目標
+        single = 2 + 2 * self.shape.if_depth + self.shape.pay_chain
+        while self.stages + single <= self.shape.stages:
+            contract = self._when([contract])
+        return contract
+
+
+def generate_contract(shape: WorkloadShape) -> Tuple[Any, int]:
+    """(Marlowe JSON, stage count) for `shape`"""
+    generator = WorkloadGenerator(shape)
+    contract = generator.generate()
+    return (contract, generator.stages)
+
+
+def contract_nesting(contract: Any) -> int:
+    """Contract nodes on the deepest path (Pay / If / When / ... each count as one level)"""
+    deepest = 0
+    stack = [(contract, 1)]
+    while stack:
+        (node, depth) = stack.pop()
+        if not isinstance(node, dict):
+            deepest = max(deepest, depth)
+            continue
+        if "when" in node:
+            children = [case.get("then") for case in node["when"]] + [node.get("timeout_continuation")]
+        elif "if" in node:
+            children = [node.get("then"), node.get("else")]
+        else:
+            children = [node.get("then")]
+        stack.extend((child, depth + 1) for child in children)
+    return deepest
+
+
+def check_contract(path: str) -> List[str]:
+    """Problems reported by parse_contract and the marlowe-json-validator skill for the file at `path`"""
+    from parser import parse_contract
+
+    problems = []
+    with open(path, "r") as f:
+        contract = json.load(f)
+    try:
+        parse_contract(contract)
+    except Exception as e:
+        problems.append(f"parse_contract: {e}")
+    nesting = contract_nesting(contract)
+    if nesting > VALIDATOR_MAX_NESTING:
+        problems.append(
+            f"validator: skipped, contract nesting {nesting} exceeds the {VALIDATOR_MAX_NESTING} levels it handles "
+            f"(use a larger --fanout or fewer --stages)"
+        )
+        return problems
+    proc = subprocess.run([sys.executable, VALIDATOR_SCRIPT, path], capture_output=True, text=True, check=False)
+    if proc.returncode != 0:
+        try:
+            errors = json.loads(proc.stdout).get("errors", [])
+            problems.extend(f"validator: {e['path']}: {e['message']}" for e in errors)
+        except (ValueError, AttributeError):
+            problems.append(f"validator: exit status {proc.returncode}: {proc.stderr.strip() or proc.stdout.strip()}")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic Marlowe contract for scale testing")
+    parser.add_argument("--stages", type=int, default=100, help="Approximate number of stages (default: 100)")
+    parser.add_argument("--fanout", type=int, default=2, help="Cases per When (default: 2)")
+    parser.add_argument("--if-depth", type=int, default=1, help="Nested If guards per case (default: 1)")
+    parser.add_argument("--pay-chain", type=int, default=1, help="Pays per case before its continuation (default: 1)")
+    parser.add_argument("--parties", type=int, default=4, help="Distinct parties (default: 4)")
+    parser.add_argument("--tokens", type=int, default=1, help="Distinct tokens (default: 1)")
+    parser.add_argument("--expr-depth", type=int, default=2, help="Value / Observation nesting depth (default: 2)")
+    parser.add_argument("--seed", type=int, default=0, help="RNG seed (default: 0)")
+    parser.add_argument("--output", "-o", help="Write the contract here instead of stdout")
+    parser.add_argument("--check", action="store_true", help="Run parse_contract and the validator skill on the output")
+    args = parser.parse_args()
+
+    try:
+        shape = WorkloadShape(
+            stages=args.stages,
+            when_fanout=args.fanout,
+            if_depth=args.if_depth,
+            pay_chain=args.pay_chain,
+            parties=args.parties,
+            tokens=args.tokens,
+            expr_depth=args.expr_depth,
+            seed=args.seed,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    (contract, stages) = generate_contract(shape)
+    text = json.dumps(contract, separators=(",", ":"))  # indent 會讓輸出隨深度平方成長
+
+    if not args.output:
+        if args.check:
+            parser.error("--check needs --output")
+        print(text)
+        return 0
+    with open(args.output, "w") as f:
+        f.write(text + "\n")
+    print(f"Wrote {args.output}: {stages} stages, {len(text)} bytes", file=sys.stderr)
+    if args.check:
+        problems = check_contract(args.output)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        if problems:
+            return 1
+        print("parse_contract and validator: ok", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())